@@ -1,11 +1,13 @@
+import functools
 import logging
 import os.path as op
-import os, glob
-import zipfile
-from time import sleep
+import os
+import subprocess
+import threading
+from time import monotonic, sleep
 
 from .pyand import ADB
-from AndroidRunner.util import ConfigError
+from .AdbProfiler import caller_name
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +23,100 @@ class ConnectionError(Exception):
 
 
 adb = None
+# The ADB instance keeps the target device and the output of the last command, commands that use it are serialized
+# so they can be issued from several threads. Shell commands run in their own adb process and are only serialized
+# per device, so e.g. the profiler sampling of one device does not wait for the commands of another. See AsyncAdb for
+# commands that run concurrently.
+lock = threading.RLock()
+device_locks = {}
+
+
+def reset_lock():
+    """Gives a forked process (scripts) its own locks, another thread may hold a lock at the fork"""
+    global lock, device_locks
+    lock = threading.RLock()
+    device_locks = {}
+
+
+def device_lock(device_id):
+    """Returns the lock that serializes the shell commands of device_id"""
+    return device_locks.setdefault(device_id, threading.RLock())
+
+
+os.register_at_fork(after_in_child=reset_lock)
+
+# AdbProfiler the adb commands are recorded in when 'adb_profiling' is enabled, None otherwise
+profiler = None
 
 settings_options = {"location_high_accuracy": ("settings put secure location_providers_allowed -gps,network","settings put secure location_providers_allowed +gps,network"),
                     "location_gps_only": ("settings put secure location_providers_allowed -gps","settings put secure location_providers_allowed +gps")
                     }
 
+def command_name(args):
+    """Returns the name of an adb command for the profiler: the adb command and the program it executes"""
+    words = ' '.join(str(arg) for arg in args).split()
+    if words and words[0] in ('shell', 'exec-in', 'exec-out') and len(words) > 1:
+        program = words[3] if words[1] == 'su' and len(words) > 3 and words[2] == '-c' else words[1]
+        return '%s %s' % (words[0], op.basename(program.strip('\'"')))
+    return words[0] if words else ''
+
+
+def file_size(path):
+    return op.getsize(path) if op.isfile(path) else 0
+
+
+def profiled(name, transferred=None):
+    """ Records the calls of the decorated function in the profiler when adb profiling is enabled.
+
+        Parameters
+        ----------
+        name : callable
+            Returns the command name of the arguments of the call.
+        transferred : callable
+            Returns the number of bytes transferred of the arguments and result of the call.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if profiler is None:
+                return function(*args, **kwargs)
+            caller = caller_name()
+            start = monotonic()
+            result = None
+            error = True
+            try:
+                result = function(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                size = transferred(args, result) if transferred is not None and not error else 0
+                profiler.record(name(args), monotonic() - start, size, caller, error)
+        return wrapper
+    return decorator
+
+
+def synchronized(function):
+    """Holds the lock of the ADB instance while the decorated function executes"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with lock:
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def synchronized_device(function):
+    """Holds the lock of the device (the first argument) while the decorated function executes"""
+    @functools.wraps(function)
+    def wrapper(device_id, *args, **kwargs):
+        with device_lock(device_id):
+            return function(device_id, *args, **kwargs)
+    return wrapper
+
+
+def output_size(args, result):
+    return len(result) if isinstance(result, (str, bytes)) else 0
+
+
 def configure_settings(device_id, setting, enable):
     cmd = settings_options[setting][enable]
     return shell(device_id, cmd)
@@ -40,6 +131,8 @@ def setup(path='adb'):
         raise AdbError('adb path is incorrect')
 
 
+@synchronized
+@profiled(lambda args: 'devices')
 def connect(device_id):
     device_list = adb.get_devices()
     if not device_list:
@@ -49,66 +142,85 @@ def connect(device_id):
         raise ConnectionError('%s: Device not recognized' % device_id)
 
 
+@synchronized_device
+@profiled(lambda args: command_name(['shell', 'su', '-c', args[1]]), output_size)
 def shell_su(device_id, cmd):
-    adb.set_target_by_name(device_id)
-    result = adb.shell_command("su -c \'%s\'" % cmd)
-    result = result.decode('utf-8') if (isinstance(result, bytes) == True) else result
+    result = run_shell(device_id, "su -c \'%s\'" % cmd)
     logger.debug('%s: "su -c \'%s\'" returned: \n%s' % (device_id, cmd, result))
     if 'error' in result:
         raise AdbError(result)
     return result.rstrip()
 
 
+@synchronized_device
+@profiled(lambda args: command_name(['shell', args[1]]), output_size)
 def shell(device_id, cmd):
-    adb.set_target_by_name(device_id)
-    result = adb.shell_command(cmd)
-    result = result.decode('utf-8') if (isinstance(result, bytes) == True) else result
+    result = run_shell(device_id, cmd)
     logger.debug('%s: "%s" returned: \n%s' % (device_id, cmd, result))
     if 'error' in result:
         raise AdbError(result)
     return result.rstrip()
 
 
+@profiled(lambda args: 'wait-for-device')
+def wait_for_device(device_id, timeout):
+    """Waits until the device is connected again, at most timeout seconds"""
+    logger.info('%s: Waiting for the device' % device_id)
+    try:
+        subprocess.run(command(device_id, 'wait-for-device'), timeout=timeout, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        raise ConnectionError('%s: Device did not reconnect within %s seconds' % (device_id, timeout))
+    connect(device_id)
+
+
 def list_apps(device_id):
     return shell(device_id, 'pm list packages').replace('package:', '').split()
 
 
-def install(device_id, apk, replace=True, all_permissions=True):
-    filename = op.basename(apk)
-    logger.debug('%s: Installing "%s"' % (device_id, filename))
-    adb.set_target_by_name(device_id)
+def parse_package_versions(output):
+    """Returns {package: versionCode} of the output of 'pm list packages [--show-versioncode]'"""
+    packages = {}
+    for line in output.splitlines():
+        fields = line.strip().split()
+        if not fields or not fields[0].startswith('package:'):
+            continue
+        version = fields[1].split(':', 1)[1] if len(fields) > 1 and fields[1].startswith('versionCode:') else None
+        packages[fields[0][len('package:'):]] = int(version) if version else None
+    return packages
 
-    # get extension filename
-    extension = op.splitext(apk)[-1].lower()
 
-    if extension == '.xapk':
-        cmd = ['install-multiple']
-        android_runner_dir = os.getcwd()
-        # get path of directory apks will be unzipped into.
-        path_apks_to_be_installed = op.splitext(apk)[0].lower()
-        with zipfile.ZipFile(apk, 'r') as zip_ref:
-            if not op.exists(path_apks_to_be_installed):
-                os.makedirs(path_apks_to_be_installed)
-            zip_ref.extractall(path_apks_to_be_installed)
+def list_package_versions(device_id):
+    """Returns {package: versionCode} of the installed packages, the versionCode is None before Android 9"""
+    try:
+        packages = parse_package_versions(shell(device_id, 'pm list packages --show-versioncode'))
+    except AdbError:
+        packages = {}
+    return packages or dict.fromkeys(list_apps(device_id))
 
-        os.chdir(path_apks_to_be_installed)
 
-        current_working_directory = os.getcwd()
+# noinspection PyProtectedMember
+def command(device_id, *args):
+    """Returns the adb command line of args for device_id, for commands that stream data to or from adb"""
+    # WARNING: Accessing class private variables
+    return [adb._ADB__adb_path, '-s', device_id] + list(args)
 
-        apk_files = glob.glob('*.apk')
 
-        if not apk_files:
-            raise ConfigError('No apks found in xapk')
+def run_shell(device_id, cmd):
+    """Executes cmd in the shell of device_id in its own adb process, returns its output (stdout and stderr)"""
+    result = subprocess.run(command(device_id, 'shell', cmd), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, check=False)
+    return result.stdout.decode('utf-8', errors='replace')
 
-        apk_files_paths = [op.join(current_working_directory, apk_file) for apk_file in apk_files]
 
-        # arguments of install-multiple
-        apk = ' '.join(apk_files_paths)
-        logger.info('installing APKs %s' % apk)
-        os.chdir(android_runner_dir) # go back to android runner dir
-    else:
-        cmd = ['install']
-        
+@synchronized
+@profiled(lambda args: 'install', lambda args, result: file_size(args[1]))
+def install(device_id, apk, replace=True, all_permissions=True):
+    filename = op.basename(apk)
+    logger.debug('%s: Installing "%s"' % (device_id, filename))
+    adb.set_target_by_name(device_id)
+
+    cmd = ['install']
     if replace:
         cmd += ['-r']
     if all_permissions:
@@ -121,6 +233,8 @@ def install(device_id, apk, replace=True, all_permissions=True):
     return output
 
 
+@synchronized
+@profiled(lambda args: 'uninstall')
 def uninstall(device_id, name, keep_data=False):
     logger.debug('%s: Uninstalling "%s"' % (device_id, name))
     adb.set_target_by_name(device_id)
@@ -133,6 +247,8 @@ def uninstall(device_id, name, keep_data=False):
                          )
 
 
+@synchronized
+@profiled(lambda args: 'shell pm')
 def clear_app_data(device_id, name):
     adb.set_target_by_name(device_id)
     success_or_exception(adb.shell_command('pm clear %s' % name),
@@ -153,6 +269,8 @@ def success_or_exception(result, success_msg, fail_msg):
 # Same with push_local_file(), but with the quotes removed
 # adb doesn't want quotes for some reason
 # noinspection PyProtectedMember
+@synchronized
+@profiled(lambda args: 'push', lambda args, result: file_size(args[1]))
 def push(device_id, local, remote):
     adb.set_target_by_name(device_id)
     adb.run_cmd('push %s %s' % (local, remote))
@@ -163,6 +281,8 @@ def push(device_id, local, remote):
 # Same with get_remote_file(), but with the quotes removed
 # adb doesn't want quotes for some reason
 # noinspection PyProtectedMember
+@synchronized
+@profiled(lambda args: 'pull', lambda args, result: file_size(args[2]))
 def pull(device_id, remote, local):
     adb.set_target_by_name(device_id)
     adb.run_cmd('pull %s %s' % (remote, local))
@@ -200,6 +320,7 @@ def logcat(device_id, regex=None):
     res = shell(device_id, params)
     return res
 
+@synchronized
 def reset(cmd):
     if cmd:
         logger.info('Shutting down adb...')
@@ -0,0 +1,150 @@
+import json
+import logging
+import math
+import os
+import os.path as op
+import sys
+import threading
+from collections import OrderedDict
+
+# Frames of these files are skipped to find the caller of an adb command
+WRAPPER_FILES = ('Adb.py', 'AsyncAdb.py', 'Device.py', 'AdbProfiler.py', 'InstallManager.py')
+
+
+def caller_name(depth=2):
+    """ Returns the hook or plugin that issued the adb command being executed, e.g. 'WebExperiment.before_run' or
+        'plugin android: get_data'.
+    """
+    frame = sys._getframe(depth)
+    while frame is not None and op.basename(frame.f_code.co_filename) in WRAPPER_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    code = frame.f_code
+    parts = op.normpath(code.co_filename).split(os.sep)
+    if 'Plugins' in parts[:-1]:
+        return 'plugin %s: %s' % (parts[parts.index('Plugins') + 1], code.co_name)
+    return getattr(code, 'co_qualname', code.co_name)
+
+
+def bucket(milliseconds):
+    """Returns the upper bound of the power of two histogram bucket of a latency in milliseconds"""
+    return 2 ** max(0, math.ceil(math.log2(milliseconds))) if milliseconds > 1 else 1
+
+
+class CallStats(object):
+    __slots__ = ('count', 'total', 'bytes', 'durations', 'errors')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.bytes = 0
+        self.durations = []
+        self.errors = 0
+
+    def add(self, seconds, transferred, error):
+        self.count += 1
+        self.total += seconds
+        self.bytes += transferred
+        self.durations.append(seconds)
+        self.errors += 1 if error else 0
+
+    def percentile(self, fraction):
+        durations = sorted(self.durations)
+        return durations[min(len(durations) - 1, int(fraction * len(durations)))]
+
+    def to_dict(self, histogram=False):
+        data = OrderedDict([('count', self.count), ('total_ms', round(self.total * 1e3, 3)),
+                            ('mean_ms', round(self.total * 1e3 / self.count, 3)),
+                            ('p50_ms', round(self.percentile(0.5) * 1e3, 3)),
+                            ('p90_ms', round(self.percentile(0.9) * 1e3, 3)),
+                            ('max_ms', round(max(self.durations) * 1e3, 3)),
+                            ('bytes', self.bytes), ('errors', self.errors)])
+        if histogram:
+            buckets = {}
+            for duration in self.durations:
+                upper = bucket(duration * 1e3)
+                buckets[upper] = buckets.get(upper, 0) + 1
+            data['histogram_ms'] = OrderedDict(('<=%d' % upper, buckets[upper]) for upper in sorted(buckets))
+        return data
+
+
+class AdbProfiler(object):
+    """ Records every adb command of the experiment process: its latency, the bytes transferred (shell output,
+        pushed and pulled files) and the hook or plugin that issued it.
+
+        Commands of the scripts are not recorded, the scripts run in a separate process.
+    """
+
+    FILENAME = 'adb_profile.json'
+
+    def __init__(self, heaviest=10):
+        """ Inits an AdbProfiler instance.
+
+            Parameters
+            ----------
+            heaviest : int
+                Number of call sites (caller and command) listed as the heaviest in the report.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.heaviest = heaviest
+        self.commands = {}
+        self.callers = {}
+        self.sites = {}
+        self._lock = threading.Lock()
+
+    def record(self, command, seconds, transferred=0, caller=None, error=False):
+        """ Records one adb command.
+
+            Parameters
+            ----------
+            command : str
+                Name of the command, e.g. 'shell dumpsys' or 'pull'.
+            seconds : float
+                Duration of the command.
+            transferred : int
+                Number of bytes transferred.
+            caller : str
+                The hook or plugin that issued the command, see caller_name.
+        """
+        caller = caller or caller_name()
+        with self._lock:
+            for stats, key in ((self.commands, command), (self.callers, caller), (self.sites, (caller, command))):
+                if key not in stats:
+                    stats[key] = CallStats()
+                stats[key].add(seconds, transferred, error)
+
+    def report(self):
+        with self._lock:
+            commands = sorted(self.commands.items(), key=lambda item: -item[1].total)
+            callers = sorted(self.callers.items(), key=lambda item: -item[1].total)
+            sites = sorted(self.sites.items(), key=lambda item: -item[1].total)[:self.heaviest]
+            calls = sum(stats.count for stats in self.commands.values())
+            total = sum(stats.total for stats in self.commands.values())
+            transferred = sum(stats.bytes for stats in self.commands.values())
+        return OrderedDict([
+            ('calls', calls), ('total_ms', round(total * 1e3, 3)), ('bytes', transferred),
+            ('commands', OrderedDict((command, stats.to_dict(histogram=True)) for command, stats in commands)),
+            ('callers', OrderedDict((caller, stats.to_dict()) for caller, stats in callers)),
+            ('heaviest', [OrderedDict([('caller', caller), ('command', command)] + list(stats.to_dict().items()))
+                          for (caller, command), stats in sites]),
+        ])
+
+    def save(self, output_dir):
+        """ Writes the report to adb_profile.json in output_dir and logs the heaviest call sites.
+
+            Returns
+            -------
+            str
+                Path of the report.
+        """
+        report = self.report()
+        filename = op.join(output_dir, self.FILENAME)
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=1)
+        self.logger.info('%s adb commands took %.1f s in total, heaviest call sites:' %
+                         (report['calls'], report['total_ms'] / 1e3))
+        for site in report['heaviest']:
+            self.logger.info('  %s: %s x "%s", %.1f ms (p90 %.1f ms)' %
+                             (site['caller'], site['count'], site['command'], site['total_ms'], site['p90_ms']))
+        return filename
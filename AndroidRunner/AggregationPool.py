@@ -0,0 +1,55 @@
+import logging
+import multiprocessing as mp
+
+# Objects the shards refer to by index. The pool forks after they are registered, so the workers inherit them
+# and only the (small) shard arguments and results are pickled.
+_registry = []
+
+
+def _run_shard(shard):
+    index, method, args = shard
+    return getattr(_registry[index], method)(*args)
+
+
+class AggregationPool(object):
+    """ Runs independent aggregation shards on a pool of forked worker processes.
+
+        A shard is a method call (index of a registered object, method name, arguments). Results are returned
+        in the order the shards were given, so merging them is deterministic regardless of which worker finished
+        first. With a single worker, or on platforms without fork, the shards are executed sequentially in the
+        calling process.
+    """
+
+    def __init__(self, workers=1):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.workers = workers
+        self.parallel = workers > 1 and 'fork' in mp.get_all_start_methods()
+        if workers > 1 and not self.parallel:
+            self.logger.warning('Parallel aggregation needs the fork start method, aggregating sequentially')
+
+    def map(self, objects, shards):
+        """ Executes shards and returns their results.
+
+            Parameters
+            ----------
+            objects : list
+                Objects the shards are executed on.
+            shards : list
+                List of (index in objects, method name, tuple of arguments).
+
+            Returns
+            -------
+            list
+                Return values of the shards, in the same order as shards.
+        """
+        global _registry
+        if not shards:
+            return []
+        if not self.parallel or len(shards) == 1:
+            return [getattr(objects[index], method)(*args) for index, method, args in shards]
+        _registry = objects
+        try:
+            with mp.get_context('fork').Pool(min(self.workers, len(shards))) as pool:
+                return pool.map(_run_shard, shards, chunksize=1)
+        finally:
+            _registry = []
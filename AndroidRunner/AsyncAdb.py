@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from time import monotonic
+
+from . import Adb
+from .Adb import AdbError
+from .AdbProfiler import caller_name
+
+
+class AsyncAdb(object):
+    """ asyncio API for the adb commands of one device.
+
+        Every command is executed in its own adb process with the serial of the device (adb -s), there is no shared
+        target to switch, so commands for one or several devices can overlap, e.g. a sampler polling dumpsys while
+        the logcat is read, or the same step on all devices with asyncio.gather. Commands are recorded in the adb
+        profiler like the commands of the Adb module.
+
+        Example::
+
+            results = AsyncAdb.run(*(AsyncAdb(device.id).shell('dumpsys battery') for device in devices))
+    """
+
+    def __init__(self, device_id, adb_path=None):
+        """ Inits an AsyncAdb instance.
+
+            Parameters
+            ----------
+            device_id : str
+                Serial of the device.
+            adb_path : str
+                Path of the adb executable, the one of Adb.setup when None.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.device_id = device_id
+        self._adb_path = adb_path
+
+    @property
+    def adb_path(self):
+        # WARNING: Accessing class private variables
+        return self._adb_path or Adb.adb._ADB__adb_path
+
+    @staticmethod
+    def run(*coroutines):
+        """Executes the coroutines concurrently from synchronous code, returns their results in the same order"""
+        async def gather():
+            return await asyncio.gather(*coroutines)
+        return asyncio.run(gather())
+
+    async def execute(self, *args, stdin=None, transferred=None):
+        """ Executes adb args for the device.
+
+            Parameters
+            ----------
+            stdin : bytes
+                Written to the standard input of adb.
+            transferred : int or callable
+                Number of bytes transferred recorded in the profiler, or a callable that returns it once the command
+                finished (e.g. the size of a pulled file). The size of the output when None.
+
+            Returns
+            -------
+            str
+                The output (stdout and stderr) of adb.
+        """
+        caller = caller_name()
+        start = monotonic()
+        error = True
+        output = ''
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.adb_path, '-s', self.device_id, *args, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL)
+            data, _ = await process.communicate(stdin)
+            output = data.decode('utf-8', errors='replace')
+            error = False
+            return output
+        finally:
+            if Adb.profiler is not None:
+                size = len(output)
+                if transferred is not None and not error:
+                    size = transferred() if callable(transferred) else transferred
+                Adb.profiler.record(Adb.command_name(args), monotonic() - start, size, caller, error)
+
+    async def shell(self, cmd):
+        """Executes cmd in the shell of the device, like Adb.shell"""
+        result = await self.execute('shell', cmd)
+        self.logger.debug('%s: "%s" returned: \n%s' % (self.device_id, cmd, result))
+        if 'error' in result:
+            raise AdbError(result)
+        return result.rstrip()
+
+    async def shell_su(self, cmd):
+        """Executes cmd as root in the shell of the device, like Adb.shell_su"""
+        return await self.shell("su -c '%s'" % cmd)
+
+    async def push(self, local, remote):
+        return await self.execute('push', local, remote, transferred=Adb.file_size(local))
+
+    async def pull(self, remote, local):
+        return await self.execute('pull', remote, local, transferred=lambda: Adb.file_size(local))
+
+    async def logcat(self, regex=None):
+        """Returns the logcat log of the device, only the entries that match regex when given, like Adb.logcat"""
+        params = 'logcat -d'
+        if regex is not None:
+            params += f' | grep "{regex}"'
+        return await self.shell(params)
@@ -1,6 +1,11 @@
 import logging
 from abc import ABC
 
+from ..Adb import AdbError
+
+SNAPSHOT_DIR = '/data/local/tmp/android-runner'
+
+
 class Browser(ABC):
 
     # noinspection PyUnusedLocal
@@ -8,9 +13,18 @@ class Browser(ABC):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.package_name = package_name
         self.main_activity = main_activity
+        # Restore the snapshot taken by take_snapshot instead of clearing the data
+        self.restore_snapshot = False
+        # Ids of the devices on which the data was reset and the browser has not been launched since
+        self._reset_devices = set()
+
+    @property
+    def snapshot_file(self):
+        return '%s/%s.tar' % (SNAPSHOT_DIR, self.package_name)
 
     def start(self, device):
         self.logger.info('%s: Start' % device.id)
+        self._reset_devices.discard(device.id)
         
         kwargs = {
             'from_scratch': True, 
@@ -25,14 +39,57 @@ class Browser(ABC):
 
     def load_url(self, device, url):
         self.logger.info('%s: Load URL: %s' % (device.id, url))
+        self._reset_devices.discard(device.id)
         device.launch_activity(self.package_name, self.main_activity, data_uri=url,
                                action='android.intent.action.VIEW')
 
     def stop(self, device, clear_data=False):
         self.logger.info('%s: Stop' % device.id)
-        device.force_stop(self.package_name)
         if clear_data:
-            device.clear_app_data(self.package_name)
+            self.reset(device)
+        else:
+            device.force_stop(self.package_name)
+
+    def reset_command(self):
+        """Returns the shell command that stops the browser and clears its data or restores the snapshot"""
+        package = self.package_name
+        clear = 'pm clear %s' % package
+        if not self.restore_snapshot:
+            return 'am force-stop %s; %s' % (package, clear)
+        # The lib symlink in the data directory belongs to the system and is neither archived nor removed
+        restore = ('run-as %s sh -c \'for f in *; do [ "$f" = lib ] || rm -rf "$f"; done; tar -xf -\' < %s '
+                   '&& echo Success' % (package, self.snapshot_file))
+        return 'am force-stop %s; if [ -f %s ]; then %s; else %s; fi' % (package, self.snapshot_file, restore, clear)
+
+    def reset(self, device):
+        """ Stops the browser and clears its data, or restores the snapshot of its data when restore_snapshot is
+            set, in a single shell call. Nothing is done when the data was already reset since the browser was last
+            launched on device.
+        """
+        if device.id in self._reset_devices:
+            self.logger.info('%s: Data of %s already reset' % (device.id, self.package_name))
+            return
+        output = device.shell(self.reset_command())
+        if 'Success' not in output:
+            raise AdbError('%s: Failed to reset the data of %s: %s' % (device.id, self.package_name, output))
+        self._reset_devices.add(device.id)
+        self.logger.info('%s: Data of %s reset' % (device.id, self.package_name))
+
+    def take_snapshot(self, device):
+        """ Archives the current data of the browser on device (e.g. a profile that went through the first-launch
+            setup), to be restored by reset. Requires a browser build run-as works with (debuggable).
+        """
+        output = device.shell('am force-stop {0}; mkdir -p {1}; run-as {0} tar -cf - --exclude=./lib . > {2} '
+                              '&& echo Success'.format(self.package_name, SNAPSHOT_DIR, self.snapshot_file))
+        if 'Success' not in output:
+            device.shell('rm -f %s' % self.snapshot_file)
+            raise AdbError('%s: Failed to take a snapshot of the data of %s: %s' %
+                           (device.id, self.package_name, output))
+        self._reset_devices.add(device.id)
+        self.logger.info('%s: Snapshot of the data of %s taken' % (device.id, self.package_name))
+
+    def delete_snapshot(self, device):
+        device.shell('rm -f %s' % self.snapshot_file)
 
     def to_string(self):
         return self.package_name
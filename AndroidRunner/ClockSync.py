@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import os.path as op
+import statistics
+import time
+from collections import OrderedDict
+
+from .util import makedirs
+
+# Clocks the timestamps of the profilers are based on, see Profiler.CLOCK
+HOST_MONOTONIC = 'host_monotonic'
+HOST_REALTIME = 'host_realtime'
+DEVICE_REALTIME = 'device_realtime'
+DEVICE_BOOTTIME = 'device_boottime'
+DEVICE_MONOTONIC = 'device_monotonic'
+CLOCKS = (HOST_MONOTONIC, HOST_REALTIME, DEVICE_REALTIME, DEVICE_BOOTTIME, DEVICE_MONOTONIC)
+
+# Device realtime with nanoseconds and the boot time (/proc/uptime, CLOCK_BOOTTIME in steps of 10 ms)
+PROBE_COMMAND = 'echo $(date +%s.%N) $(cat /proc/uptime)'
+UPTIME_RESOLUTION = 0.01
+
+
+class ClockSync(object):
+    """ Aligns the clocks of the host and the device, the common timebase is the monotonic clock of the host.
+
+        A sync takes a number of round-trip probes of the device clocks. The offset of the device realtime is
+        taken from the probe with the shortest round-trip, its uncertainty is half that round-trip. /proc/uptime
+        only has a resolution of 10 ms, so the offset of the boot time is the median over all probes. A run is
+        synced before and after it, the change of the offsets over the run is the drift of the device clocks.
+
+        CLOCK_MONOTONIC of the device cannot be read from the shell, it is only equal to the boot time when the
+        device did not suspend since it booted, its offset is therefore not measured.
+
+        The offsets, the drift and the clock of the timestamps of every profiler are written to
+        clock_sync/<runId>.json in the output directory of the run. A timestamp t (in seconds) of a clock is
+        t - offset(clock) on the common timebase, see to_timebase.
+    """
+
+    def __init__(self, probes=8):
+        """ Inits a ClockSync instance.
+
+            Parameters
+            ----------
+            probes : int
+                Number of round-trip probes per sync.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.probes = probes
+        self.begin = None
+
+    def probe(self, device):
+        """Returns (host monotonic before, host monotonic after, device realtime, device boot time) in seconds"""
+        before = time.monotonic()
+        output = device.shell(PROBE_COMMAND)
+        after = time.monotonic()
+        fields = output.split()
+        return before, after, float(fields[0]), float(fields[1])
+
+    def sync(self, device):
+        """ Probes the clocks of device.
+
+            Returns
+            -------
+            OrderedDict
+                host_monotonic: the host time of the sync, offsets: seconds to subtract from a timestamp of a clock
+                to get the host monotonic time, uncertainty: of the offsets in seconds.
+        """
+        probes = []
+        for _ in range(self.probes):
+            try:
+                probes.append(self.probe(device))
+            except (ValueError, IndexError) as e:
+                self.logger.debug('%s: Invalid clock probe: %s' % (device.id, e))
+        if not probes:
+            raise ValueError('%s: No valid clock probe' % device.id)
+        before, after, realtime, _ = min(probes, key=lambda p: p[1] - p[0])
+        host_time = (before + after) / 2
+        round_trip = after - before
+        boottime_offset = statistics.median(p[3] - (p[0] + p[1]) / 2 for p in probes) + UPTIME_RESOLUTION / 2
+        return OrderedDict([
+            ('host_monotonic', host_time),
+            ('offsets', OrderedDict([(HOST_MONOTONIC, 0.0),
+                                     (HOST_REALTIME, time.time() - time.monotonic()),
+                                     (DEVICE_REALTIME, realtime - host_time),
+                                     (DEVICE_BOOTTIME, boottime_offset)])),
+            ('uncertainty', OrderedDict([(DEVICE_REALTIME, round_trip / 2),
+                                         (DEVICE_BOOTTIME, max(p[1] - p[0] for p in probes) / 2 +
+                                          UPTIME_RESOLUTION / 2)])),
+            ('probes', len(probes)),
+        ])
+
+    @staticmethod
+    def drift(begin, end):
+        """Returns the drift of the clocks between two syncs in parts per million of the host time"""
+        elapsed = end['host_monotonic'] - begin['host_monotonic']
+        if elapsed <= 0:
+            return OrderedDict()
+        return OrderedDict((clock, (end['offsets'][clock] - offset) / elapsed * 1e6)
+                           for clock, offset in begin['offsets'].items() if clock in end['offsets'])
+
+    @staticmethod
+    def to_timebase(clock, timestamp, begin, end=None):
+        """ Converts a timestamp (seconds) of clock to the host monotonic time.
+
+            The offset is interpolated between the syncs begin and end (when given), so the drift of the clock over
+            the run is taken into account.
+        """
+        offset = begin['offsets'][clock]
+        if end is not None and end['host_monotonic'] > begin['host_monotonic']:
+            rate = (end['offsets'][clock] - offset) / (end['host_monotonic'] - begin['host_monotonic'])
+            # Solve t - host = offset + rate * (host - begin host) for host
+            return (timestamp - offset + rate * begin['host_monotonic']) / (1 + rate)
+        return timestamp - offset
+
+    def begin_run(self, device):
+        """Syncs the clocks before a run"""
+        try:
+            self.begin = self.sync(device)
+        except Exception as e:
+            self.begin = None
+            self.logger.warning('%s: Clock sync failed: %s' % (device.id, e))
+
+    def end_run(self, device, output_dir, run_id, profiler_clocks):
+        """ Syncs the clocks after a run and writes the sync of the run.
+
+            Parameters
+            ----------
+            profiler_clocks : dict
+                Name of each profiler to the clock of its timestamps (None when it has none).
+
+            Returns
+            -------
+            str
+                Path of the file with the sync of the run, None when the clocks could not be synced.
+        """
+        begin, self.begin = self.begin, None
+        if begin is None:
+            return None
+        try:
+            end = self.sync(device)
+        except Exception as e:
+            self.logger.warning('%s: Clock sync failed: %s' % (device.id, e))
+            return None
+        data = OrderedDict([('runId', str(run_id)), ('device', device.id), ('timebase', HOST_MONOTONIC),
+                            ('begin', begin), ('end', end), ('drift_ppm', self.drift(begin, end)),
+                            ('profilers', OrderedDict(sorted(profiler_clocks.items())))])
+        filename = op.join(output_dir, 'clock_sync', '%s.json' % run_id)
+        makedirs(op.dirname(filename))
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_file, filename)
+        return filename
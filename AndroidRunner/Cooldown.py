@@ -0,0 +1,158 @@
+import logging
+import statistics
+import time
+from collections import OrderedDict
+
+from . import Tests
+from .util import ConfigError
+
+# One shell invocation that prints every thermal zone, the current frequency of every CPU core and the battery current
+READ_COMMAND = ('for f in /sys/class/thermal/thermal_zone*/temp; do echo "thermal $(cat $f 2>/dev/null)"; done; '
+                'for f in /sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq; '
+                'do echo "cpu_freq $(cat $f 2>/dev/null)"; done; '
+                'echo "battery_current $(cat /sys/class/power_supply/battery/current_now 2>/dev/null)"')
+
+SETTLED = 'settled'
+MAX_WAIT = 'max_wait'
+
+
+class AdaptiveCooldown(object):
+    """ Waits between runs until the device is back at the state it had before the experiment.
+
+        A baseline of the device is read when the device is prepared. After a run the cooldown waits at least
+        min_wait ms and then polls the device every poll_interval ms until all readings are back within their band
+        of the baseline, or max_wait ms passed:
+
+        * temperature: the hottest thermal zone (degrees Celsius) is at most thermal_band above the baseline,
+        * cpu_freq: the mean frequency of the CPU cores deviates at most cpu_freq_band (fraction) from the baseline,
+        * battery_current: the battery current deviates at most battery_current_band (fraction) from the baseline.
+
+        A band of null disables its reading, readings the device does not expose are ignored.
+    """
+
+    DEFAULTS = OrderedDict([('thermal_band', 1.0), ('cpu_freq_band', 0.2), ('battery_current_band', 0.25),
+                            ('min_wait', 0), ('max_wait', 600000), ('poll_interval', 2000)])
+    BANDS = OrderedDict([('temperature', 'thermal_band'), ('cpu_freq', 'cpu_freq_band'),
+                         ('battery_current', 'battery_current_band')])
+
+    def __init__(self, config):
+        """ Inits an AdaptiveCooldown instance.
+
+            Parameters
+            ----------
+            config : dict
+                The 'cooldown' configuration, see DEFAULTS for the keys.
+
+            Raises
+            ------
+            ConfigError
+                If a key is unknown or a value is invalid.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        unknown = [key for key in config if key not in self.DEFAULTS]
+        if unknown:
+            raise ConfigError('Unknown cooldown option(s): %s' % ', '.join(unknown))
+        settings = OrderedDict(self.DEFAULTS)
+        settings.update(config)
+        self.bands = OrderedDict()
+        for reading, key in self.BANDS.items():
+            band = settings[key]
+            if band is not None and (isinstance(band, bool) or not isinstance(band, (int, float)) or band < 0):
+                raise ConfigError('cooldown %s must be a positive number or null, got %s' % (key, band))
+            self.bands[reading] = band
+        self.min_wait = Tests.is_integer(settings['min_wait'])
+        self.max_wait = Tests.is_integer(settings['max_wait'], minimum=self.min_wait)
+        self.poll_interval = Tests.is_integer(settings['poll_interval'], minimum=1)
+        self.baselines = {}
+
+    @staticmethod
+    def parse(output):
+        """Returns the readings of the output of READ_COMMAND, readings the device did not print are left out"""
+        values = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) != 2:
+                continue
+            try:
+                values.setdefault(fields[0], []).append(float(fields[1]))
+            except ValueError:
+                continue
+        readings = OrderedDict()
+        # Thermal zones report millidegrees on most devices, disabled zones report negative values
+        temperatures = [t / 1000.0 if abs(t) >= 1000 else t for t in values.get('thermal', [])]
+        temperatures = [t for t in temperatures if t > 0]
+        if temperatures:
+            readings['temperature'] = max(temperatures)
+        if values.get('cpu_freq'):
+            readings['cpu_freq'] = statistics.mean(values['cpu_freq'])
+        if values.get('battery_current'):
+            readings['battery_current'] = abs(values['battery_current'][0])
+        return readings
+
+    def read(self, device):
+        return self.parse(device.shell(READ_COMMAND))
+
+    def set_baseline(self, device):
+        """Reads the state of the idle device the cooldowns wait for"""
+        try:
+            self.baselines[device.id] = self.read(device)
+        except Exception as e:
+            self.logger.warning('%s: Cannot read the device state, waiting min_wait only: %s' % (device.id, e))
+            self.baselines[device.id] = OrderedDict()
+        self.logger.info('%s: Cooldown baseline %s' % (device.id, self.format(self.baselines[device.id])))
+
+    def deviations(self, baseline, readings):
+        """Returns the readings that are outside their band of the baseline"""
+        outside = OrderedDict()
+        for reading, band in self.bands.items():
+            if band is None or reading not in baseline or reading not in readings:
+                continue
+            if reading == 'temperature':
+                deviation = readings[reading] - baseline[reading]
+            else:
+                deviation = abs(readings[reading] - baseline[reading]) / max(baseline[reading], 1)
+            if deviation > band:
+                outside[reading] = readings[reading]
+        return outside
+
+    def wait(self, device):
+        """ Waits until the device cooled down.
+
+            Returns
+            -------
+            OrderedDict
+                cooldown_ms: the time waited, cooldown_reason: 'settled' or 'max_wait', and the last readings.
+        """
+        start = time.monotonic()
+        time.sleep(self.min_wait / 1000.0)
+        baseline = self.baselines.get(device.id)
+        readings = OrderedDict()
+        reason = SETTLED
+        while baseline:
+            try:
+                readings = self.read(device)
+                outside = self.deviations(baseline, readings)
+            except Exception as e:
+                # Keeps waiting, a device that cannot be read is not known to have cooled down
+                self.logger.warning('%s: Cannot read the device state: %s' % (device.id, e))
+                readings = OrderedDict()
+                outside = OrderedDict([('error', str(e))])
+            if not outside:
+                break
+            elapsed = (time.monotonic() - start) * 1000
+            if elapsed >= self.max_wait:
+                reason = MAX_WAIT
+                self.logger.warning('%s: Device did not cool down within %s ms: %s' %
+                                    (device.id, self.max_wait, self.format(outside)))
+                break
+            time.sleep(min(self.poll_interval, self.max_wait - elapsed) / 1000.0)
+        waited = int(round((time.monotonic() - start) * 1000))
+        self.logger.info('%s: Cooled down in %s ms' % (device.id, waited))
+        result = OrderedDict([('cooldown_ms', waited), ('cooldown_reason', reason)])
+        result.update(('cooldown_%s' % reading, round(value, 3)) for reading, value in readings.items())
+        return result
+
+    @staticmethod
+    def format(readings):
+        return ', '.join('%s=%s' % (name, round(value, 1) if isinstance(value, float) else value)
+                         for name, value in readings.items()) or 'no readings'
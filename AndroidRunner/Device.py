@@ -5,6 +5,9 @@ import time
 
 from . import Adb
 from .Adb import AdbError
+from .AsyncAdb import AsyncAdb
+from .DeviceSettings import DeviceSettings
+from .InstallManager import InstallManager
 from .util import ConfigError, makedirs
 from . import Tests
 import subprocess
@@ -19,12 +22,21 @@ class Device:
         self.logger = logging.getLogger(self.__class__.__name__)
         self.name = name
         self.id = device_id
+        # asyncio API of the adb commands of this device, e.g. await device.aio.shell(cmd)
+        self.aio = AsyncAdb(device_id)
         self.root_unplug = settings.get('root_disable_charging', False)
         self.root_unplug_value = settings.get('charging_disabled_value', None)
         self.root_unplug_file = settings.get('usb_charging_disabled_file', None)
         self.root_plug_value = None
         self.power_device = settings.get('power_device', None)
         self.device_settings_reqs = settings.get('device_settings_reqs', None)
+        # app -> DeviceSettings of its profile, and the values the profile replaced while it is applied
+        self._device_settings = {}
+        self._settings_snapshots = {}
+        # Installed packages and their versionCode, listed on first use and then updated by install and uninstall
+        self._packages = None
+        # Incremented whenever the installed packages (may) have changed, see InstallManager.is_verified
+        self.install_count = 0
         if self.power_device:
             subprocess.call([self.power_device["py_path"], self.power_device["script_path"], self.power_device["vout"], self.power_device["serial_num"]])
         Adb.connect(device_id)
@@ -69,13 +81,23 @@ class Device:
         Adb.shell(self.id, f'logcat -G {self._logcat_buffer_size}K')
 
     def configure_settings_device(self, app, enable=True):
-        if self.device_settings_reqs is not None:
-            settings_for_app = self.device_settings_reqs.get(app, None)
-            if settings_for_app is not None:
-                num_settings = len(settings_for_app)
-                for setting in range(num_settings):
-                    self.logger.info('Enabling ' + str(settings_for_app[setting])) if enable else self.logger.info('Disabling ' + str(settings_for_app[setting]))
-                    Adb.configure_settings(self.id, settings_for_app[setting], enable)
+        """ Applies (enable) or restores (not enable) the device_settings_reqs profile of app.
+
+            The profile is a dict of setting to value (see DeviceSettings.SETTINGS) or a list of legacy setting names.
+            Applying it takes a single adb shell call that also returns the previous values, restoring them takes
+            another one.
+        """
+        if self.device_settings_reqs is None or self.device_settings_reqs.get(app, None) is None:
+            return
+        if app not in self._device_settings:
+            self._device_settings[app] = DeviceSettings(self.device_settings_reqs[app])
+        device_settings = self._device_settings[app]
+        if enable:
+            snapshot = device_settings.apply(self.id)
+            # Applying twice without restoring in between keeps the values from before the first time
+            self._settings_snapshots.setdefault(app, snapshot)
+        elif app in self._settings_snapshots:
+            device_settings.restore(self.id, self._settings_snapshots.pop(app))
 
     def get_version(self):
         """Returns the Android version"""
@@ -87,21 +109,53 @@ class Device:
 
     def is_installed(self, apps):
         """Returns a boolean if a package is installed"""
-        return {app: app in self.get_app_list() for app in apps}
+        installed = set(self.get_app_list())
+        return {app: app in installed for app in apps}
+
+    def get_app_list(self, refresh=False):
+        """Returns a list of installed packages on the system, see package_index"""
+        return list(self.package_index(refresh))
 
-    def get_app_list(self):
-        """Returns a list of installed packages on the system"""
-        return Adb.list_apps(self.id)
+    def package_index(self, refresh=False):
+        """ Returns the installed packages as a set-like view.
 
-    def install(self, apk):
-        """Check if the file exists, and then install the package"""
+            'pm list packages' is only executed on first use or when refresh is True, afterwards the index is kept
+            up to date by install, uninstall and mark_installed. Packages installed or removed outside of
+            AndroidRunner are only seen after a refresh.
+        """
+        return self.package_versions(refresh).keys()
+
+    def package_versions(self, refresh=False):
+        """Returns {package: versionCode} of the installed packages, see package_index and Adb.list_package_versions"""
+        if self._packages is None or refresh:
+            packages = Adb.list_package_versions(self.id)
+            if self._packages is not None and packages != self._packages:
+                self.install_count += 1
+            self._packages = packages
+        return self._packages
+
+    def mark_installed(self, name, version_code=None):
+        """Adds a package that was installed without Device.install to the package index"""
+        if self._packages is not None:
+            self._packages[name] = version_code
+        self.install_count += 1
+
+    def install(self, apk, install_manager=None):
+        """ Check if the file exists, and then install the package.
+
+            The install goes through install_manager (a new InstallManager when not given), so it is skipped when the
+            same build is installed already.
+        """
         if not op.isfile(apk):
             raise AdbError("%s is not found" % apk)
-        Adb.install(self.id, apk)
+        return (install_manager or InstallManager()).install(self, apk)
 
     def uninstall(self, name):
         """Uninstalls the package on the device"""
         Adb.uninstall(self.id, name)
+        if self._packages is not None:
+            self._packages.pop(name, None)
+        self.install_count += 1
 
     def su_unplug(self, restart):
         """Root unplugs the device"""
@@ -230,5 +284,9 @@ class Device:
         """Runs the device shell with command specified by cmd"""
         return Adb.shell(self.id, cmd)
 
+    def wait_for_device(self, timeout):
+        """Waits until the device is connected again after it dropped, at most timeout seconds"""
+        Adb.wait_for_device(self.id, timeout)
+
     def __str__(self):
         return '%s (%s, Android %s, API level %s)' % (self.name, self.id, self.get_version(), self.get_api_level())
@@ -0,0 +1,179 @@
+import logging
+from collections import OrderedDict, namedtuple
+
+from . import Adb
+from .util import ConfigError
+
+# get: command that prints the current value, put: command that sets {value} (or {switch}: enable/disable),
+# delete: command that restores a value that was not set before, None when there is no such value
+Setting = namedtuple('Setting', ['get', 'put', 'delete'])
+
+
+def provider_setting(namespace, key):
+    return Setting('settings get %s %s' % (namespace, key), 'settings put %s %s {value}' % (namespace, key),
+                   'settings delete %s %s' % (namespace, key))
+
+
+def radio_setting(key, command):
+    """A radio that is switched with a command, its state is read from the settings provider"""
+    return Setting('settings get global %s' % key, command, None)
+
+
+SETTINGS = OrderedDict([
+    ('airplane_mode', radio_setting('airplane_mode_on', 'cmd connectivity airplane-mode {switch}')),
+    ('wifi', radio_setting('wifi_on', 'svc wifi {switch}')),
+    ('brightness_mode', provider_setting('system', 'screen_brightness_mode')),
+    ('brightness', provider_setting('system', 'screen_brightness')),
+    ('screen_timeout', provider_setting('system', 'screen_off_timeout')),
+    ('stay_awake', provider_setting('global', 'stay_on_while_plugged_in')),
+    ('location_mode', provider_setting('secure', 'location_mode')),
+    ('location_providers', provider_setting('secure', 'location_providers_allowed')),
+    ('window_animation_scale', provider_setting('global', 'window_animation_scale')),
+    ('transition_animation_scale', provider_setting('global', 'transition_animation_scale')),
+    ('animator_duration_scale', provider_setting('global', 'animator_duration_scale')),
+])
+# Profile keys that set several settings to the same value
+GROUPS = {'animations': ['window_animation_scale', 'transition_animation_scale', 'animator_duration_scale']}
+# Names of the former Adb.settings_options, usable in a list instead of a profile
+LEGACY_SETTINGS = {'location_high_accuracy': {'location_providers': '+gps,network'},
+                   'location_gps_only': {'location_providers': '+gps'}}
+# Settings whose value enables (+entry) or disables (-entry) entries of a list instead of replacing it, a value
+# without prefix is ignored since Android 8
+TOGGLE_SETTINGS = {'location_providers'}
+
+MARKER = '__setting__'
+
+
+def quote(value):
+    """Quotes a value for the device shell"""
+    return "'" + value.replace("'", "'\\''") + "'"
+
+
+def toggled(value):
+    """Returns the entries a toggle value enables and disables, e.g. '+gps,network' enables gps and network"""
+    enabled, disabled = [], []
+    sign = '+'
+    for entry in str(value).split(','):
+        entry = entry.strip()
+        if entry[:1] in ('+', '-'):
+            sign, entry = entry[0], entry[1:]
+        if entry:
+            (enabled if sign == '+' else disabled).append(entry)
+    return enabled, disabled
+
+
+class DeviceSettings(object):
+    """ Applies a profile of device settings (e.g. {"brightness": 10, "animations": 0, "wifi": false}) in one adb
+        shell invocation, and restores the previous values in another.
+
+        The command that applies a profile first prints the current value of every setting it changes, so the
+        snapshot used to restore the device costs no extra round-trip.
+    """
+
+    def __init__(self, profile):
+        """ Inits a DeviceSettings instance.
+
+            Parameters
+            ----------
+            profile : dict or list
+                Setting name to value, or a list of legacy setting names (location_high_accuracy,
+                location_gps_only).
+
+            Raises
+            ------
+            ConfigError
+                If the profile contains an unknown setting.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.values = OrderedDict()
+        if isinstance(profile, list):
+            for name in profile:
+                if name not in LEGACY_SETTINGS:
+                    raise ConfigError('Unknown device setting "%s"' % name)
+                self.values.update(LEGACY_SETTINGS[name])
+            return
+        for name, value in profile.items():
+            if name in GROUPS:
+                for member in GROUPS[name]:
+                    self.values[member] = value
+            elif name in SETTINGS:
+                self.values[name] = value
+            else:
+                raise ConfigError('Unknown device setting "%s", use one of: %s' %
+                                  (name, ', '.join(sorted(list(SETTINGS.keys()) + list(GROUPS.keys())))))
+
+    @staticmethod
+    def format_value(value):
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        return str(value)
+
+    @staticmethod
+    def put_command(name, value):
+        """Returns the command that sets name to value, None restores a value that was not set"""
+        setting = SETTINGS[name]
+        if value is None:
+            return setting.delete
+        value = DeviceSettings.format_value(value)
+        switch = 'disable' if value in ('0', 'false', 'off') else 'enable'
+        return setting.put.format(value=quote(value), switch=switch)
+
+    def apply_command(self):
+        """Returns the shell command that prints the current values and then applies the profile"""
+        commands = ['echo "%s%s=$(%s)"' % (MARKER, name, SETTINGS[name].get) for name in self.values]
+        commands += [self.put_command(name, value) for name, value in self.values.items()]
+        return '; '.join(commands)
+
+    def toggle_restore_commands(self, name, value):
+        """ Returns the commands that undo the toggle value of name applied to the entries in value.
+
+            Only the entries the profile changed are toggled back, e.g. a profile that enabled gps and network
+            while network was already enabled disables gps only.
+        """
+        before = set(value.split(',')) if value else set()
+        enabled, disabled = toggled(self.values[name])
+        return [self.put_command(name, '-' + entry) for entry in enabled if entry not in before] + \
+            [self.put_command(name, '+' + entry) for entry in disabled if entry in before]
+
+    def restore_command(self, snapshot):
+        commands = []
+        for name, value in snapshot.items():
+            if name in TOGGLE_SETTINGS:
+                commands.extend(self.toggle_restore_commands(name, value))
+            else:
+                commands.append(self.put_command(name, value))
+        return '; '.join(command for command in commands if command)
+
+    @staticmethod
+    def parse_snapshot(output):
+        """Returns the values printed by the apply command, None for settings that were not set ('null')"""
+        snapshot = OrderedDict()
+        for line in output.splitlines():
+            line = line.strip()
+            if not line.startswith(MARKER) or '=' not in line:
+                continue
+            name, value = line[len(MARKER):].split('=', 1)
+            if name in SETTINGS:
+                snapshot[name] = None if value in ('', 'null') else value
+        return snapshot
+
+    def apply(self, device_id):
+        """ Applies the profile to the device.
+
+            Returns
+            -------
+            OrderedDict
+                The values before the profile was applied, to be passed to restore.
+        """
+        if not self.values:
+            return OrderedDict()
+        snapshot = self.parse_snapshot(Adb.shell(device_id, self.apply_command()))
+        self.logger.info('%s: Applied %s' % (device_id, ', '.join('%s=%s' % item for item in self.values.items())))
+        return snapshot
+
+    def restore(self, device_id, snapshot):
+        """Sets the settings in snapshot back to the values they had before apply"""
+        command = self.restore_command(snapshot)
+        if command:
+            Adb.shell(device_id, command)
+            self.logger.info('%s: Restored %s' % (device_id, ', '.join(snapshot.keys())))
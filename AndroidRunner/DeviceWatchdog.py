@@ -0,0 +1,214 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from . import Tests
+from .Cooldown import AdaptiveCooldown
+from .util import ConfigError
+
+# One shell invocation with the battery level, the boot id, the thermal zones and the free space of the paths
+HEALTH_COMMAND = ('echo "battery $(cat /sys/class/power_supply/battery/capacity 2>/dev/null)"; '
+                  'echo "boot_id $(cat /proc/sys/kernel/random/boot_id 2>/dev/null)"; '
+                  'for f in /sys/class/thermal/thermal_zone*/temp; do echo "thermal $(cat $f 2>/dev/null)"; done; '
+                  'for p in {paths}; do echo "storage $p $(df -k $p 2>/dev/null | tail -n 1)"; done')
+
+
+class WatchdogError(Exception):
+    """Raised when a device does not get healthy again, e.g. it does not charge"""
+    pass
+
+
+class DeviceWatchdog(object):
+    """ Watches the health of the devices while the experiment executes.
+
+        Every interval seconds a background thread per device reads the battery level, the free space of
+        storage_paths, the hottest thermal zone and the boot id in one shell invocation. The background checks
+        pause while a run of the device executes, so they do not add load to the measurement; the device is
+        checked right before and after every run instead. A check records an anomaly when the battery is below
+        min_battery, a storage path has less than min_storage_mb MB free, the device is hotter than
+        max_temperature, the device rebooted or it cannot be reached.
+
+        Before a run the battery has to be at least min_battery: otherwise the device is charged (USB enabled,
+        battery status reset) until it reaches resume_battery, for at most charge_timeout seconds. The anomalies
+        that overlapped a run are recorded as run metrics, watchdog (descriptions), watchdog_anomalies (count) and
+        watchdog_resets (count of the transient anomalies, a reboot or an unreachable device, that interrupted the
+        run). Heat, a low battery or low storage usually persist over several runs and are only recorded.
+    """
+
+    DEFAULTS = OrderedDict([('interval', 60), ('min_battery', 20), ('resume_battery', 50), ('min_storage_mb', 500),
+                            ('storage_paths', ['/sdcard', '/data/misc/perfetto-traces']), ('max_temperature', 45),
+                            ('charge_timeout', 3600)])
+    # Descriptions of the anomalies that interrupt a run, unlike the conditions that persist over several runs
+    TRANSIENT = ('rebooted', 'unreachable')
+
+    def __init__(self, config, usb_handler):
+        """ Inits a DeviceWatchdog instance.
+
+            Parameters
+            ----------
+            config : dict
+                The 'watchdog' configuration, see DEFAULTS for the keys. An interval of 0 only checks the devices
+                around the runs.
+            usb_handler : USBHandler
+                Enables the USB ports to charge a device.
+
+            Raises
+            ------
+            ConfigError
+                If a key is unknown or a value is invalid.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        unknown = [key for key in config if key not in self.DEFAULTS]
+        if unknown:
+            raise ConfigError('Unknown watchdog option(s): %s' % ', '.join(unknown))
+        settings = OrderedDict(self.DEFAULTS)
+        settings.update(config)
+        self.interval = Tests.is_integer(settings['interval'])
+        self.min_battery = Tests.is_integer(settings['min_battery'])
+        self.resume_battery = Tests.is_integer(settings['resume_battery'], minimum=self.min_battery)
+        self.min_storage_mb = Tests.is_integer(settings['min_storage_mb'])
+        self.storage_paths = settings['storage_paths']
+        if not isinstance(self.storage_paths, list):
+            raise ConfigError('watchdog storage_paths must be a list of paths')
+        self.max_temperature = settings['max_temperature']
+        if isinstance(self.max_temperature, bool) or not isinstance(self.max_temperature, (int, float)):
+            raise ConfigError('watchdog max_temperature must be a number')
+        self.charge_timeout = Tests.is_integer(settings['charge_timeout'], minimum=1)
+        self.usb_handler = usb_handler
+        self.command = HEALTH_COMMAND.format(paths=' '.join(self.storage_paths))
+        # device id -> boot id of the last check, anomalies as (host monotonic time, description)
+        self.boot_ids = {}
+        self.anomalies = {}
+        self.run_begin = {}
+        # device id -> lock held by a check of the background thread and by the checks and the run of a device
+        self._device_locks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @staticmethod
+    def parse(output):
+        """Returns the readings of the output of the health command, readings the device did not print are left out"""
+        readings = OrderedDict()
+        storage = OrderedDict()
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[0] == 'battery' and fields[1].isdigit():
+                readings['battery'] = int(fields[1])
+            elif len(fields) == 2 and fields[0] == 'boot_id':
+                readings['boot_id'] = fields[1]
+            elif len(fields) >= 6 and fields[0] == 'storage' and fields[5].isdigit():
+                # storage <path> <filesystem> <1K-blocks> <used> <available> ...
+                storage[fields[1]] = int(fields[5]) // 1024
+        temperature = AdaptiveCooldown.parse(output).get('temperature')
+        if temperature is not None:
+            readings['temperature'] = temperature
+        if storage:
+            readings['storage_mb'] = storage
+        return readings
+
+    def check(self, device):
+        """ Reads the health of the device and records its anomalies.
+
+            Returns
+            -------
+            OrderedDict
+                The readings, empty when the device cannot be reached.
+        """
+        try:
+            readings = self.parse(device.shell(self.command))
+        except Exception as e:
+            self.record(device, 'unreachable (%s)' % e)
+            return OrderedDict()
+        if readings.get('battery') is not None and readings['battery'] < self.min_battery:
+            self.record(device, 'battery %s%%' % readings['battery'])
+        for path, free in readings.get('storage_mb', {}).items():
+            if free < self.min_storage_mb:
+                self.record(device, '%s %s MB free' % (path, free))
+        if readings.get('temperature') is not None and readings['temperature'] > self.max_temperature:
+            self.record(device, 'temperature %.1f C' % readings['temperature'])
+        boot_id = readings.get('boot_id')
+        if boot_id is not None:
+            previous = self.boot_ids.get(device.id)
+            if previous is not None and previous != boot_id:
+                self.record(device, 'rebooted')
+            self.boot_ids[device.id] = boot_id
+        return readings
+
+    @classmethod
+    def is_transient(cls, description):
+        return description.startswith(cls.TRANSIENT)
+
+    def record(self, device, description):
+        self.logger.warning('%s: %s' % (device.id, description))
+        with self._lock:
+            self.anomalies.setdefault(device.id, []).append((time.monotonic(), description))
+
+    def device_lock(self, device):
+        with self._lock:
+            return self._device_locks.setdefault(device.id, threading.Lock())
+
+    def watch(self, device):
+        while not self._stop.wait(self.interval):
+            with self.device_lock(device):
+                if device.id not in self.run_begin:
+                    self.check(device)
+
+    def start(self, devices):
+        """Starts a background thread per device that checks it every interval seconds"""
+        self._stop.clear()
+        if not self.interval:
+            return
+        for device in devices:
+            thread = threading.Thread(target=self.watch, args=(device,), name='DeviceWatchdog-%s' % device.id,
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def begin_run(self, device):
+        """ Checks the device before a run, charges it first when its battery is too low. The background checks
+            of the device pause until end_run.
+        """
+        with self.device_lock(device):
+            readings = self.check(device)
+            if readings.get('battery') is not None and readings['battery'] < self.min_battery:
+                self.charge(device, readings['battery'])
+            self.run_begin[device.id] = time.monotonic()
+
+    def charge(self, device, battery):
+        """ Charges the device until its battery level reaches resume_battery, or it cannot be read anymore.
+
+            Raises
+            ------
+            WatchdogError
+                If the battery did not reach resume_battery within charge_timeout seconds.
+        """
+        self.logger.info('%s: Pausing the experiment to charge to %s%%' % (device.id, self.resume_battery))
+        self.usb_handler.enable_usb()
+        device.plug()
+        deadline = time.monotonic() + self.charge_timeout
+        while battery is not None and battery < self.resume_battery:
+            if time.monotonic() >= deadline:
+                raise WatchdogError('%s: Battery at %s%% after charging for %s seconds' %
+                                    (device.id, battery, self.charge_timeout))
+            time.sleep(self.interval or 60)
+            battery = self.check(device).get('battery')
+            self.logger.info('%s: Battery at %s%%' % (device.id, battery))
+        device.unplug(True)
+
+    def end_run(self, device):
+        """Checks the device after a run, returns the descriptions of the anomalies that overlapped the run"""
+        with self.device_lock(device):
+            self.check(device)
+            begin = self.run_begin.pop(device.id, None)
+        with self._lock:
+            anomalies = [description for moment, description in self.anomalies.pop(device.id, [])
+                         if begin is None or moment >= begin]
+        return list(OrderedDict.fromkeys(anomalies))
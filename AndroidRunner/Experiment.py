@@ -3,15 +3,27 @@ import logging
 import multiprocessing as mp
 import os.path as op
 import time
-from os import remove, rmdir, walk
+from collections import OrderedDict
+from contextlib import contextmanager
 from threading import Thread
 from AndroidRunner.USBHandler import USBHandler
 from . import Tests
 from . import Adb
 import paths
+from .AdbProfiler import AdbProfiler
+from .ClockSync import ClockSync
+from .Cooldown import AdaptiveCooldown
+from .DeviceWatchdog import DeviceWatchdog
 from .Devices import Devices
 from .Profilers import Profilers
+from .ResultManifest import ResultManifest
+from .ResultStore import ResultStore
+from .RunMetrics import RunMetrics
+from .RunPipeline import RunPipeline
+from .RunValidator import ACCEPTED, KEPT, REQUEUED, RunValidator
 from .Scripts import Scripts
+from .SequentialStopping import SequentialStopping
+from .Timeline import MEASURED, Timeline
 from .util import ConfigError, makedirs, slugify_dir
 from AndroidRunner.PrematureStoppableRun import PrematureStoppableRun 
 import multiprocessing as mp
@@ -24,12 +36,17 @@ class Experiment(object):
         self.random = config.get('randomization', False)
         
         Tests.is_valid_option(self.random, valid_options=[True, False])
+        if self.random and config.get('run_order') is not None:
+            raise ConfigError('"randomization" and "run_order" cannot be combined, use the "random" run_order')
         self.clear_cache = config.get('clear_cache', False)
         Tests.is_valid_option(self.clear_cache, valid_options=[True, False])
         
         if 'devices' not in config:
             raise ConfigError('"device" is required in the configuration')
         adb_path = config.get('adb_path', 'adb')
+        adb_profiling = config.get('adb_profiling', False)
+        Tests.is_valid_option(adb_profiling, valid_options=[True, False])
+        Adb.profiler = AdbProfiler() if adb_profiling else None
         
         self.devices = Devices(config['devices'], adb_path=adb_path, devices_spec=config.get('devices_spec'))
         self.repetitions = Tests.is_integer(config.get('repetitions', 1))
@@ -39,16 +56,63 @@ class Experiment(object):
         self.reset_adb_among_runs = config.get('reset_adb_among_runs', False)
         Tests.is_valid_option(self.reset_adb_among_runs, valid_options=[True, False])
         self.time_between_run = Tests.is_integer(config.get('time_between_run', 0))
+        # Replaces the fixed time_between_run when configured
+        self.cooldown = AdaptiveCooldown(config['cooldown']) if config.get('cooldown') is not None else None
         Tests.check_dependencies(self.devices, self.profilers.dependencies())
         self.output_root = paths.OUTPUT_DIR
-        self.result_file_structure = None
+        self.result_manifest = None
+        self.run_metrics = RunMetrics(self.output_root)
+        self.run_validator = RunValidator(config['run_validation'], self.output_root) \
+            if config.get('run_validation') is not None else None
+        self.interaction_ms = None
+        # Ends the runs of a subject early once the mean of a metric is precise enough, repetitions is the maximum
+        self.sequential_stopping = SequentialStopping(config['sequential_stopping'], self.output_root) \
+            if config.get('sequential_stopping') is not None else None
+        if self.sequential_stopping is not None and restart:
+            done = set(progress.done_run_ids())
+            self.sequential_stopping.load(row for run_id, row in self.run_metrics.rows.items() if run_id in done)
+        self.timeline_enabled = config.get('timeline', False)
+        Tests.is_valid_option(self.timeline_enabled, valid_options=[True, False])
+        self.timeline = Timeline(self.output_root, enabled=self.timeline_enabled)
+        self.profilers.set_timeline(self.timeline)
+        clock_sync = config.get('clock_sync', False)
+        Tests.is_valid_option(clock_sync, valid_options=[True, False])
+        self.clock_sync = ClockSync(Tests.is_integer(config.get('clock_sync_probes', 8), minimum=1)) \
+            if clock_sync else None
+        self.profilers.set_clock_sync(clock_sync)
+        # (device, path, browser, experimentArg) of the subject whose before_subject scripts ran last
+        self.active_subject = None
 
         self.usb_handler_config = config.get("usb_handler", None)
         self.usb_handler = USBHandler(self.usb_handler_config)
+        self.watchdog = DeviceWatchdog(config['watchdog'], self.usb_handler) \
+            if config.get('watchdog') is not None else None
+
+        # Retries a run after the device dropped, {"timeout": seconds to wait for the device, "retries": per run}
+        device_recovery = config.get('device_recovery', None)
+        if device_recovery is not None:
+            unknown = [key for key in device_recovery if key not in ('timeout', 'retries')]
+            if unknown:
+                raise ConfigError('Unknown device_recovery option(s): %s' % ', '.join(unknown))
+            self.recovery_timeout = Tests.is_integer(device_recovery.get('timeout', 300), minimum=1)
+            self.recovery_retries = Tests.is_integer(device_recovery.get('retries', 2))
+        self.device_recovery = device_recovery is not None
 
         self.run_stopping_condition_config = config.get("run_stopping_condition", None)
         self.queue = mp.Queue()
 
+        self.pipeline_runs = config.get('pipeline_runs', False)
+        Tests.is_valid_option(self.pipeline_runs, valid_options=[True, False])
+        # The verdict of a run decides which run is next, so the result files of the run are needed right away
+        if self.pipeline_runs and self.run_validator is not None:
+            raise ConfigError('"pipeline_runs" and "run_validation" cannot be combined')
+        self.pipeline = RunPipeline(self.pipeline_runs)
+        self.aggregation_workers = Tests.is_integer(config.get('aggregation_workers', 1), minimum=1)
+
+        self.use_result_store = config.get('result_store', False)
+        Tests.is_valid_option(self.use_result_store, valid_options=[True, False])
+        self.result_store = ResultStore(op.join(self.output_root, 'results')) if self.use_result_store else None
+
         if restart:
             for device in self.devices:
                 self.prepare_device(device, restart=True)
@@ -58,6 +122,8 @@ class Experiment(object):
         self.logger.info('Device: %s' % device)
         self.profilers.load(device)
         device.unplug(restart)
+        if self.cooldown is not None:
+            self.cooldown.set_baseline(device)
 
     def cleanup(self, device):
         """Cleans up the changes on the devices"""
@@ -70,17 +136,26 @@ class Experiment(object):
         return self.progress.progress_xml_file
     def update_progress(self):
         self.progress.write_progress_to_file()
-        result_data_path = op.join(paths.BASE_OUTPUT_DIR, 'data')
-        self.result_file_structure = self.walk_to_list(walk(result_data_path))
+        if self.result_manifest is not None:
+            self.result_manifest.commit_run()
+            self.result_manifest.save()
 
     def start(self):
         try:
-            result_data_path = op.join(paths.BASE_OUTPUT_DIR, 'data')
-            self.result_file_structure = self.walk_to_list(walk(result_data_path))
+            self.result_manifest = ResultManifest(paths.BASE_OUTPUT_DIR)
+            if self.result_store is not None:
+                self.result_store.set_manifest(self.result_manifest)
+            if self.watchdog is not None:
+                self.watchdog.start(self.devices)
+            self.provision()
             while not self.progress.experiment_finished_check():
                 current_run = self.get_experiment()
-                self.run_experiment(current_run)
+                if self.device_recovery:
+                    self.run_experiment_recovering(current_run)
+                else:
+                    self.run_experiment(current_run)
                 self.save_progress()
+            self.pipeline.wait()
         except Exception as e:
             import traceback
             print((traceback.format_exc()))
@@ -94,64 +169,195 @@ class Experiment(object):
             self.finish_experiment(False, False)
 
     def finish_experiment(self, error, interrupted):
-        self.check_result_files(self.result_file_structure)
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        self.pipeline.shutdown()
+        self.check_result_files(self.result_manifest)
+        try:
+            self.leave_subject()
+        except Exception as e:
+            self.logger.error('after_subject failed: %s: %s' % (e.__class__.__name__, str(e)))
         for device in self.devices:
             try:
                 self.cleanup(device)
             except Exception:
                 continue
         if not error and not interrupted:
-            self.aggregate_end()
+            with self.timeline.phase('aggregate_end'):
+                self.aggregate_end()
+        self.timeline.save()
+        if Adb.profiler is not None:
+            Adb.profiler.save(self.output_root)
 
     def run_experiment(self, current_run):
-        self.prepare_run(current_run)
+        with self.timeline.phase('prepare_run'):
+            self.prepare_run(current_run)
         self.run_run(current_run)
-        self.finish_run(current_run)
+        with self.timeline.phase('finish_run'):
+            self.finish_run(current_run)
+
+    def run_experiment_recovering(self, current_run):
+        """Executes the run, when the device dropped it waits for the device to come back and runs it again"""
+        attempt = 0
+        while True:
+            try:
+                self.run_experiment(current_run)
+                return
+            except (Adb.AdbError, Adb.ConnectionError) as e:
+                attempt += 1
+                # A run that failed after it was marked as finished (e.g. in after_last_run) is not repeated
+                if attempt > self.recovery_retries or current_run['runId'] in self.progress.done_run_ids():
+                    raise
+                self.logger.warning('Run %s failed (%s: %s), recovering device %s (attempt %s of %s)' %
+                                    (current_run['runId'], e.__class__.__name__, e, current_run['device'], attempt,
+                                     self.recovery_retries))
+                with self.timeline.phase('device_recovery'):
+                    self.recover_device(self.devices.get_device(current_run['device']))
+
+    def recover_device(self, device):
+        """Discards the results of the failed run and prepares the device again once it reconnected"""
+        self.pipeline.wait()
+        self.check_result_files(self.result_manifest)
+        self.usb_handler.enable_usb()
+        device.wait_for_device(self.recovery_timeout)
+        # The rollback removed what the before_subject scripts wrote, the retry enters the subject again
+        try:
+            self.leave_subject()
+        except Exception as e:
+            self.logger.warning('after_subject failed while recovering device %s: %s' % (device.id, e))
+        self.profilers.reload(device)
+        device.unplug(True)
 
     def prepare_run(self, current_run):
+        # The after_subject scripts of the previous subject run while the output directory still is the one of it
+        if self.active_subject is not None and self.subject_key(current_run) != self.active_subject:
+            self.leave_subject()
         self.prepare_output_dir(current_run)
+        # The previous run is committed and its host-side work done before this run writes anything
+        with self.timeline.phase('pipeline_wait'):
+            self.pipeline.wait()
+        if self.result_manifest is not None:
+            self.result_manifest.begin_run(current_run['runId'], paths.OUTPUT_DIR)
+        if self.result_store is not None:
+            self.profilers.set_result_writer(self.result_store.writer(current_run))
         self.first_run_device(current_run)
         self.before_every_run_subject(current_run)
 
     def run_run(self, current_run):
+        self.interaction_ms = None
+        if self.watchdog is not None:
+            with self.timeline.phase('watchdog'):
+                self.watchdog.begin_run(self.devices.get_device(current_run['device']))
+        self.run_metrics.begin_run(current_run)
+        if self.timeline.enabled:
+            self.timeline.begin_run(current_run, self.devices.get_device(current_run['device']))
+        if self.clock_sync is not None:
+            with self.timeline.phase('clock_sync'):
+                self.clock_sync.begin_run(self.devices.get_device(current_run['device']))
         if 'browser' in current_run:
             self.run(self.devices.get_device(current_run['device']), current_run['path'],
                      int(current_run['runCount']), current_run, browser=current_run['browser'])
         else:
             self.run(self.devices.get_device(current_run['device']), current_run['path'],
                      int(current_run['runCount']), current_run)
+        if self.watchdog is not None:
+            self.record_watchdog(current_run)
+        if self.interaction_ms is not None:
+            # Kept in run_metrics.csv, so a resumed experiment knows the interaction durations of the finished runs
+            self.run_metrics.recorder().record('interaction_ms', self.interaction_ms)
+        run_files = [self.run_metrics.end_run(paths.OUTPUT_DIR)]
+        if self.clock_sync is not None:
+            with self.timeline.phase('clock_sync'):
+                run_files.append(self.clock_sync.end_run(self.devices.get_device(current_run['device']),
+                                                         paths.OUTPUT_DIR, current_run['runId'],
+                                                         self.profilers.clocks()))
+        run_files.append(self.timeline.end_run(paths.OUTPUT_DIR))
+        if self.result_manifest is not None:
+            for run_file in run_files:
+                if run_file is not None:
+                    self.result_manifest.record(run_file)
+
+    def record_watchdog(self, current_run):
+        """Records the device anomalies that overlapped the run as metrics of the run"""
+        with self.timeline.phase('watchdog'):
+            anomalies = self.watchdog.end_run(self.devices.get_device(current_run['device']))
+        if anomalies:
+            self.logger.warning('Run %s overlapped device anomalies: %s' % (current_run['runId'], '; '.join(anomalies)))
+        resets = [anomaly for anomaly in anomalies if DeviceWatchdog.is_transient(anomaly)]
+        self.run_metrics.recorder().update(OrderedDict([('watchdog', '; '.join(anomalies)),
+                                                        ('watchdog_anomalies', len(anomalies)),
+                                                        ('watchdog_resets', len(resets))]))
 
     def finish_run(self, current_run):
+        if self.run_validator is not None and not self.validate_run(current_run):
+            return
         self.progress.run_finished(current_run['runId'])
+        if self.sequential_stopping is not None:
+            self.check_precision(current_run)
         self.last_run_subject(current_run)
         self.last_run_device(current_run)
 
+    def check_precision(self, current_run):
+        """Skips the remaining runs of the subject of current_run when the mean of its metric is precise enough"""
+        value = self.sequential_stopping.value(self.interaction_ms,
+                                               self.run_metrics.rows.get(str(current_run['runId']), {}))
+        if self.sequential_stopping.add(current_run, value):
+            skipped = self.progress.stop_subject(current_run['runId'])
+            if skipped:
+                self.sequential_stopping.record(current_run, skipped)
+
+    def validate_run(self, current_run):
+        """ Checks the metrics of the run against the previous runs of its subject, a suspicious run is discarded
+            and re-queued while it has retries left.
+
+            Returns
+            -------
+            bool
+                Whether the run counts as done.
+        """
+        # The run validation disables the pipeline, the result files of the run were written in after_run
+        files = self.result_manifest.pending_files() if self.result_manifest is not None else []
+        metrics = self.run_validator.run_metrics(self.interaction_ms,
+                                                 self.run_metrics.rows.get(str(current_run['runId']), {}),
+                                                 paths.OUTPUT_DIR, files)
+        reasons = self.run_validator.check(current_run, metrics)
+        retries = self.progress.run_retries(current_run['runId'])
+        if not reasons:
+            self.run_validator.accept(current_run, metrics)
+            self.run_validator.record(current_run, ACCEPTED, reasons, retries)
+            return True
+        if retries >= self.run_validator.retries:
+            self.logger.warning('Run %s is suspicious, kept after %s retries: %s' %
+                                (current_run['runId'], retries, '; '.join(reasons)))
+            self.run_validator.record(current_run, KEPT, reasons, retries)
+            return True
+        self.logger.warning('Run %s is suspicious, running it again: %s' % (current_run['runId'], '; '.join(reasons)))
+        self.check_result_files(self.result_manifest)
+        self.progress.requeue_run(current_run['runId'])
+        self.run_validator.record(current_run, REQUEUED, reasons, retries)
+        return False
+
     def save_progress(self):
+        if self.pipeline_runs:
+            self.pipeline.submit(self.update_progress)
+            return
         a = Thread(target=self.update_progress)
         a.start()
         a.join()
 
-    def check_result_files(self, correct_file_list):
-        result_data_path = op.join(paths.BASE_OUTPUT_DIR, 'data')
-        current_file_structure = walk(result_data_path)
-        current_file_list = self.walk_to_list(current_file_structure)
-        for path in current_file_list:
-            if path not in correct_file_list:
-                if op.isfile(path):
-                    remove(path)
-                else:
-                    rmdir(path)
-
-    @staticmethod
-    def walk_to_list(walk_result):
-        walk_list = list()
-        for (path, dirs, files) in walk_result:
-            for dr in dirs:
-                walk_list.append(op.join(path, dr))
-            for fl in files:
-                walk_list.append(op.join(path, fl))
-        walk_list.reverse()
-        return walk_list
+    def check_result_files(self, result_manifest):
+        """ Removes the result files of the run that was not finished, and its metrics and the means the profilers
+            kept of it.
+        """
+        if result_manifest is None:
+            return
+        run_id = result_manifest.current_run
+        removed = result_manifest.rollback()
+        for path in removed:
+            self.logger.debug('Removed result of unfinished run: %s' % path)
+        if run_id is not None:
+            self.profilers.discard_results(removed)
+            self.run_metrics.discard(run_id)
 
     def get_experiment(self):
         if self.random:
@@ -166,7 +372,37 @@ class Experiment(object):
             self.before_experiment(device)
 
     def before_every_run_subject(self, current_run):
-        self.before_run_subject(self.devices.get_device(current_run['device']), current_run['path'])
+        device = self.devices.get_device(current_run['device'])
+        self.enter_subject(device, current_run)
+        self.before_run_subject(device, current_run['path'])
+
+    def enter_subject(self, device, current_run):
+        """ Runs the before_subject scripts when current_run belongs to another subject than the previous run.
+
+            The after_subject scripts of the previous subject are run first (prepare_run already runs them before
+            the output directory changes), so with a randomized run order every switch of subject restarts whatever
+            the scripts keep running for a subject (e.g. a model server). Runs with another experiment argument
+            are another subject.
+        """
+        subject = self.subject_key(current_run)
+        if subject == self.active_subject:
+            return
+        self.leave_subject()
+        self.scripts.run('before_subject', device, current_run['path'])
+        self.active_subject = subject
+
+    @staticmethod
+    def subject_key(current_run):
+        return (current_run['device'], current_run['path'], current_run.get('browser'),
+                current_run.get('experimentArg'))
+
+    def leave_subject(self):
+        """Runs the after_subject scripts of the subject that was entered last"""
+        if self.active_subject is None:
+            return
+        device_id, path = self.active_subject[:2]
+        self.active_subject = None
+        self.scripts.run('after_subject', self.devices.get_device(device_id), path)
 
     def last_run_device(self, current_run):
         if self.progress.device_finished(current_run['device']):
@@ -175,6 +411,7 @@ class Experiment(object):
     def last_run_subject(self, current_run):
         if self.progress.subject_finished(current_run['device'], current_run['path']):
             self.after_last_run(self.devices.get_device(current_run['device']), current_run['path'])
+            self.leave_subject()
             self.aggregate_subject()
 
     def prepare_output_dir(self, current_run):
@@ -191,22 +428,39 @@ class Experiment(object):
         self.queue.put(PrematureStoppableRun.STOPPING_MECHANISM_FUNCTION_CALL)
    
     def run(self, device, path, run_id, current_run, **kwargs):
-        self.before_run(device, path, run_id, current_run=current_run, **kwargs)
+        with self.timeline.phase('before_run'):
+            self.before_run(device, path, run_id, current_run=current_run, **kwargs)
 
         self.usb_handler.disable_usb()
-        self.start_profiling(device, path, run_id)
+        with self.timeline.phase('start_profiling'):
+            self.start_profiling(device, path, run_id)
+
+        with self.interaction_phase():
+            if self.run_stopping_condition_config:
+                self.queue = mp.Queue()
+                premature_stoppable_run = PrematureStoppableRun(self.run_stopping_condition_config, self.queue, self.interaction, device, path, run_id)
+                premature_stoppable_run.run()
+            else:
+                self.interaction(device, path, run_id, current_run=current_run)
+
+        with self.timeline.phase('stop_profiling'):
+            self.stop_profiling(device, path, run_id)
+        self.usb_handler.enable_usb()
 
-        if self.run_stopping_condition_config:
-            self.queue = mp.Queue()
-            premature_stoppable_run = PrematureStoppableRun(self.run_stopping_condition_config, self.queue, self.interaction, device, path, run_id)
-            premature_stoppable_run.run()
-        else:
-            self.interaction(device, path, run_id, current_run=current_run)
+        with self.timeline.phase('after_run'):
+            self.after_run(device, path, run_id)
 
-        self.stop_profiling(device, path, run_id)
-        self.usb_handler.enable_usb()
+    @contextmanager
+    def interaction_phase(self):
+        """Records the interaction in the timeline and its duration for the run validation"""
+        start = time.monotonic()
+        with self.timeline.phase('interaction', MEASURED):
+            yield
+        self.interaction_ms = round((time.monotonic() - start) * 1000, 1)
 
-        self.after_run(device, path, run_id)
+    def provision(self):
+        """Hook executed once before the first run of the experiment, to prepare the subjects on all devices"""
+        pass
 
     def before_experiment(self, device, *args, **kwargs):
         """Hook executed before the first run of a device in current experiment"""
@@ -235,8 +489,8 @@ class Experiment(object):
         self.profilers.start_profiling(device, **kwargs)
 
     def interaction(self, device, path, run, *args, **kwargs):
-        """Interactions on the device to be profiled"""
-        self.scripts.run('interaction', device, self, *args, **kwargs)
+        """Interactions on the device to be profiled, scripts record metrics of the run with kwargs['metrics']"""
+        self.scripts.run('interaction', device, self, *args, metrics=self.run_metrics.recorder(), **kwargs)
 
     def stop_profiling(self, device, path, run, *args, **kwargs):
         # FIXME: handle *args
@@ -248,10 +502,18 @@ class Experiment(object):
     def after_run(self, device, path, run, *args, **kwargs):
         """Hook executed after a run"""
         self.scripts.run('after_run', device, *args, **kwargs)
-        self.profilers.collect_results(device)
+        with self.timeline.phase('collect_results'):
+            tasks = self.profilers.collect_results(device)
+        for task in tasks:
+            self.pipeline.submit(task)
         Adb.reset(self.reset_adb_among_runs)
+        if self.cooldown is not None:
+            with self.timeline.phase('time_between_run'):
+                self.run_metrics.recorder().update(self.cooldown.wait(device))
+            return
         self.logger.info('Sleeping for %s milliseconds' % self.time_between_run)
-        time.sleep(self.time_between_run / 1000.0)
+        with self.timeline.phase('time_between_run'):
+            time.sleep(self.time_between_run / 1000.0)
 
     def after_last_run(self, device, path, *args, **kwargs):
         """Hook executed after the last run of a subject"""
@@ -263,7 +525,12 @@ class Experiment(object):
         self.scripts.run('after_experiment', device, *args, **kwargs)
 
     def aggregate_subject(self):
-        self.profilers.aggregate_subject()
+        self.pipeline.submit(self.timed, 'aggregate_subject', self.profilers.aggregate_subject)
+
+    def timed(self, name, function, *args, **kwargs):
+        """Executes function(*args, **kwargs) as phase name of the timeline"""
+        with self.timeline.phase(name):
+            return function(*args, **kwargs)
 
     def aggregate_end(self):
-        self.profilers.aggregate_end(self.output_root)
+        self.profilers.aggregate_end(self.output_root, workers=self.aggregation_workers)
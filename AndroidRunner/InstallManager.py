@@ -0,0 +1,312 @@
+import hashlib
+import json
+import logging
+import os.path as op
+import re
+import shutil
+import struct
+import subprocess
+import zipfile
+from collections import namedtuple
+
+from . import Adb
+from .Adb import AdbError
+from .util import ConfigError
+
+# Chunk types of the binary XML format of AndroidManifest.xml
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+UTF8_FLAG = 1 << 8
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+# Resource ids of the android: attributes, used when the attribute names are stripped from the string pool
+ATTRIBUTE_IDS = {0x0101021b: 'versionCode'}
+
+ARCHIVE_EXTENSIONS = ('.xapk', '.apks')
+COPY_BUFFER_SIZE = 1 << 20
+
+ApkInfo = namedtuple('ApkInfo', ['package', 'version_code', 'apks', 'digests'])
+
+
+def _string_pool(data, offset):
+    """Returns the strings of the string pool chunk at offset"""
+    header_size, = struct.unpack_from('<H', data, offset + 2)
+    count, _, flags, strings_start = struct.unpack_from('<IIII', data, offset + 8)
+    offsets = struct.unpack_from('<%dI' % count, data, offset + header_size)
+    strings = []
+    for string_offset in offsets:
+        position = offset + strings_start + string_offset
+        if flags & UTF8_FLAG:
+            # Length in characters, then length in bytes, both 1 or 2 bytes long
+            position += 2 if data[position] & 0x80 else 1
+            length = data[position]
+            if length & 0x80:
+                length = ((length & 0x7f) << 8) | data[position + 1]
+                position += 1
+            position += 1
+            strings.append(data[position:position + length].decode('utf-8', errors='replace'))
+        else:
+            length, = struct.unpack_from('<H', data, position)
+            position += 2
+            if length & 0x8000:
+                length = ((length & 0x7fff) << 16) | struct.unpack_from('<H', data, position)[0]
+                position += 2
+            strings.append(data[position:position + length * 2].decode('utf-16-le', errors='replace'))
+    return strings
+
+
+def read_manifest(data):
+    """ Returns the attributes of the <manifest> element of a binary AndroidManifest.xml as a dict.
+
+        Only the chunks needed for the root element are parsed: the string pool, the resource map (to find
+        attributes by resource id when their names are stripped) and the first start element.
+    """
+    chunk_type, header_size, size = struct.unpack_from('<HHI', data, 0)
+    if chunk_type != RES_XML_TYPE:
+        raise ValueError('Not a binary XML file')
+    strings = []
+    resource_ids = []
+    offset = header_size
+    while offset < min(size, len(data)):
+        chunk_type, header_size, chunk_size = struct.unpack_from('<HHI', data, offset)
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = _string_pool(data, offset)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            resource_ids = struct.unpack_from('<%dI' % ((chunk_size - header_size) // 4), data, offset + header_size)
+        elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+            start = offset + header_size
+            _, name, attribute_start, attribute_size, attribute_count = struct.unpack_from('<IIHHH', data, start)
+            if strings[name] != 'manifest':
+                raise ValueError('Root element is not <manifest>')
+            attributes = {}
+            for index in range(attribute_count):
+                _, name, raw_value, _, _, data_type, value = struct.unpack_from(
+                    '<IIIHBBI', data, start + attribute_start + index * attribute_size)
+                key = strings[name]
+                if name < len(resource_ids) and resource_ids[name] in ATTRIBUTE_IDS:
+                    key = ATTRIBUTE_IDS[resource_ids[name]]
+                if data_type == TYPE_STRING:
+                    attributes[key] = strings[value]
+                elif data_type in (TYPE_INT_DEC, TYPE_INT_HEX):
+                    attributes[key] = value
+                elif raw_value != 0xffffffff:
+                    attributes[key] = strings[raw_value]
+            return attributes
+        if chunk_size <= 0:
+            break
+        offset += chunk_size
+    raise ValueError('No <manifest> element found')
+
+
+def _apk_manifest(apk_file):
+    with zipfile.ZipFile(apk_file) as apk:
+        return read_manifest(apk.read('AndroidManifest.xml'))
+
+
+def _digest(stream):
+    sha256 = hashlib.sha256()
+    for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b''):
+        sha256.update(block)
+    return sha256.hexdigest()
+
+
+class InstallManager(object):
+    """ Installs subject APKs, skipping the install when the device already has the same build.
+
+        The package name and versionCode are read from the manifest of the APK and compared against the package
+        index of the device (Device.package_versions). When they match, the SHA-256 of the APK file(s) is compared
+        with the installed files, so a rebuilt APK with an unchanged versionCode is still installed. A build that
+        was verified (or installed) is not verified again for the rest of the session, until the packages of the
+        device change or the device is recovered (forget). Split APK archives (.xapk, .apks) are streamed from the
+        archive into a pm install session, nothing is extracted to disk.
+
+        The install commands are executed in their own process (not through the shared pyand instance), so devices
+        can be provisioned concurrently from several threads.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        # path -> (mtime, size, ApkInfo)
+        self._infos = {}
+        # (device id, path) -> (ApkInfo, Device.install_count) of the builds known to be installed
+        self._verified = {}
+
+    def info(self, path):
+        """ Returns the ApkInfo (package, versionCode, APK members and their SHA-256) of an APK or APK archive.
+
+            Raises
+            ------
+            ConfigError
+                If the file is not a readable APK or APK archive.
+        """
+        stat = (op.getmtime(path), op.getsize(path))
+        cached = self._infos.get(path)
+        if cached is not None and cached[:2] == stat:
+            return cached[2]
+        try:
+            if op.splitext(path)[1].lower() in ARCHIVE_EXTENSIONS:
+                info = self.archive_info(path)
+            else:
+                manifest = _apk_manifest(path)
+                with open(path, 'rb') as f:
+                    info = ApkInfo(manifest['package'], manifest.get('versionCode'), [], [_digest(f)])
+        except (zipfile.BadZipFile, KeyError, ValueError, struct.error) as e:
+            raise ConfigError('Cannot read the manifest of %s: %s' % (path, e))
+        self._infos[path] = stat + (info,)
+        return info
+
+    @staticmethod
+    def archive_info(path):
+        with zipfile.ZipFile(path) as archive:
+            apks = sorted(name for name in archive.namelist() if name.lower().endswith('.apk'))
+            if not apks:
+                raise ConfigError('No apks found in %s' % path)
+            package = version_code = None
+            for name in apks:
+                with archive.open(name) as member:
+                    manifest = _apk_manifest(member)
+                if 'split' not in manifest:
+                    package, version_code = manifest['package'], manifest.get('versionCode')
+                    break
+            if package is None and 'manifest.json' in archive.namelist():
+                metadata = json.loads(archive.read('manifest.json'))
+                package, version_code = metadata['package_name'], int(metadata['version_code'])
+            if package is None:
+                raise ValueError('no base apk')
+            digests = []
+            for name in apks:
+                with archive.open(name) as member:
+                    digests.append(_digest(member))
+            return ApkInfo(package, version_code, apks, digests)
+
+    @staticmethod
+    @Adb.profiled(lambda args: Adb.command_name(args[1:]), Adb.output_size)
+    def adb(device, *args):
+        """Executes adb args for device and returns its output (stdout and stderr)"""
+        result = subprocess.run(Adb.command(device.id, *args), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, check=False)
+        return result.stdout.decode('utf-8', errors='replace').strip()
+
+    def is_verified(self, device, path, info):
+        """Returns whether the build in info was verified on device and its packages did not change since"""
+        return self._verified.get((device.id, path)) == (info, device.install_count)
+
+    def forget(self, device):
+        """Verifies the builds on device again on their next install, e.g. after the device was recovered"""
+        for key in [key for key in self._verified if key[0] == device.id]:
+            del self._verified[key]
+
+    def is_current(self, device, info, installed):
+        """ Returns whether the build in info is installed on device.
+
+            Parameters
+            ----------
+            installed : dict
+                {package: versionCode} of the device as returned by Device.package_versions.
+        """
+        if info.package not in installed:
+            return False
+        version_code = installed[info.package]
+        if version_code is not None and info.version_code is not None and version_code != info.version_code:
+            return False
+        files = [line.split(':', 1)[1] for line in self.adb(device, 'shell', 'pm path %s' % info.package).splitlines()
+                 if line.startswith('package:')]
+        output = self.adb(device, 'shell', 'sha256sum %s' % ' '.join(files)) if files else ''
+        digests = [line.split()[0] for line in output.splitlines() if re.match(r'^[0-9a-f]{64}\s', line)]
+        if len(digests) != len(files) or not digests:
+            # Hashing is not available on the device, the versionCode has to do
+            return version_code is not None and version_code == info.version_code
+        return sorted(digests) == sorted(info.digests)
+
+    def install(self, device, path):
+        """ Installs the APK or APK archive at path on device unless the same build is already installed.
+
+            Parameters
+            ----------
+            device : Device
+                The device to install on.
+            path : str
+                Path of the .apk, .xapk or .apks file.
+
+            Returns
+            -------
+            str
+                The package name of the APK.
+        """
+        info = self.info(path)
+        if self.is_verified(device, path, info):
+            return info.package
+        if self.is_current(device, info, device.package_versions()):
+            self.logger.info('%s: %s (versionCode %s) is up to date' % (device.id, info.package, info.version_code))
+            self._verified[(device.id, path)] = (info, device.install_count)
+            return info.package
+        self.logger.info('%s: Installing %s (versionCode %s)' % (device.id, info.package, info.version_code))
+        if info.apks:
+            self.install_session(device, path, info.apks)
+        else:
+            output = self.adb(device, 'install', '-r', '-g', '-t', path)
+            if 'Success' not in output:
+                raise AdbError('%s: Failed to install %s: %s' % (device.id, path, output))
+        device.mark_installed(info.package, info.version_code)
+        self._verified[(device.id, path)] = (info, device.install_count)
+        return info.package
+
+    def provision(self, device, paths):
+        """ Installs all APKs in paths on device, the packages are listed again afterwards to check the installs.
+
+            Returns
+            -------
+            list
+                The package names of the APKs, in the order of paths.
+
+            Raises
+            ------
+            AdbError
+                If a package is not installed afterwards.
+        """
+        packages = [self.install(device, path) for path in paths]
+        installed = device.package_versions(refresh=True)
+        missing = [package for package in packages if package not in installed]
+        if missing:
+            raise AdbError('%s: Not installed after provisioning: %s' % (device.id, ', '.join(missing)))
+        return packages
+
+    def install_session(self, device, path, apks):
+        """Streams the APKs in the archive at path into a single pm install session and commits it"""
+        with zipfile.ZipFile(path) as archive:
+            total_size = sum(archive.getinfo(name).file_size for name in apks)
+            output = self.adb(device, 'shell', 'pm install-create -r -g -t -S %d' % total_size)
+            match = re.search(r'\[(\d+)\]', output)
+            if not match:
+                raise AdbError('%s: Failed to create install session: %s' % (device.id, output))
+            session = match.group(1)
+            try:
+                for index, name in enumerate(apks):
+                    with archive.open(name) as member:
+                        self.stream(device, member, 'exec-in', 'pm', 'install-write', '-S',
+                                    str(archive.getinfo(name).file_size), session,
+                                    '%d_%s' % (index, op.basename(name)), '-')
+                output = self.adb(device, 'shell', 'pm install-commit %s' % session)
+            except Exception:
+                self.adb(device, 'shell', 'pm install-abandon %s' % session)
+                raise
+        if 'Success' not in output:
+            raise AdbError('%s: Failed to install %s: %s' % (device.id, path, output))
+
+    @staticmethod
+    @Adb.profiled(lambda args: Adb.command_name(args[2:]))
+    def stream(device, source, *args):
+        """Executes adb args for device with the contents of the file object source on stdin"""
+        process = subprocess.Popen(Adb.command(device.id, *args), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        try:
+            shutil.copyfileobj(source, process.stdin, COPY_BUFFER_SIZE)
+        finally:
+            process.stdin.close()
+        output = process.stdout.read().decode('utf-8', errors='replace')
+        process.wait()
+        if process.returncode != 0 or 'Success' not in output:
+            raise AdbError('%s: adb %s failed: %s' % (device.id, ' '.join(args), output))
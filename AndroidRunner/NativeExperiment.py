@@ -1,8 +1,10 @@
 import os.path as op
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from . import Tests
 from .Experiment import Experiment
+from .InstallManager import InstallManager
 from .util import ConfigError
 
 
@@ -12,7 +14,11 @@ class NativeExperiment(Experiment):
         self.duration = Tests.is_integer(config.get('duration', 0)) / 1000
         self.autostart_subject = config.get('autostart_subject', True)
         self.experiment_args = config.get('experiment_args', [0]) # Just a single argument, if none are specified
+        self.provision_subjects = config.get('provision_subjects', False)
+        Tests.is_valid_option(self.provision_subjects, valid_options=[True, False])
+        self.provisioned = False
         super(NativeExperiment, self).__init__(config, progress, restart)
+        self.install_manager = InstallManager()
         self.pre_installed_apps = config.get('apps', [])
         for apk in config.get('paths', []):
             if not op.isfile(apk):
@@ -20,8 +26,40 @@ class NativeExperiment(Experiment):
 
     def cleanup(self, device):
         super(NativeExperiment, self).cleanup(device)
-        if self.package in device.get_app_list() and self.package not in self.pre_installed_apps:
-            device.uninstall(self.package)
+        packages = [self.package]
+        if self.provisioned:
+            # Provisioned devices have the packages of all subjects installed, not only of the current one
+            packages.extend(self.install_manager.info(path).package for path in self.paths)
+        installed = device.get_app_list()
+        for package in sorted(set(packages) - {None}):
+            if package in installed and package not in self.pre_installed_apps:
+                device.uninstall(package)
+
+    def provision(self):
+        """ Installs the APKs of all subjects on all devices before the first run.
+
+            Devices are provisioned concurrently, the APKs of a device one after the other. Afterwards
+            before_run_subject does not touch the device anymore, so no install time ends up in the experiment.
+        """
+        if not self.provision_subjects or not self.paths:
+            return
+        devices = list(self.devices)
+        for path in self.paths:
+            self.install_manager.info(path)
+        self.logger.info('Provisioning %s APK(s) on %s device(s)' % (len(self.paths), len(devices)))
+        with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+            futures = [executor.submit(self.install_manager.provision, device, self.paths) for device in devices]
+            for future in futures:
+                future.result()
+        self.provisioned = True
+
+    def recover_device(self, device):
+        super(NativeExperiment, self).recover_device(device)
+        # The device may have been reset while it was disconnected
+        self.install_manager.forget(device)
+        if self.provisioned:
+            # before_run_subject does not install on provisioned devices, so the builds are verified here
+            self.install_manager.provision(device, self.paths)
 
     def before_experiment(self, device, *args, **kwargs):
         super(NativeExperiment, self).before_experiment(device)
@@ -30,12 +68,11 @@ class NativeExperiment(Experiment):
         super(NativeExperiment, self).before_run_subject(device, path)
         if path in self.pre_installed_apps:
             self.package = path
+        elif self.provisioned:
+            self.package = self.install_manager.info(path).package
         else:
-            filename = op.basename(path)
-            self.logger.info('APK: %s' % filename)
-            if filename not in device.get_app_list():
-                device.install(path)
-            self.package = op.splitext(op.basename(path))[0]
+            self.logger.info('APK: %s' % op.basename(path))
+            self.package = self.install_manager.install(device, path)
 
     def get_run_count(self):
         return self.repetitions * len(self.experiment_args)
@@ -43,10 +80,13 @@ class NativeExperiment(Experiment):
     def before_run(self, device, path, run, *args, **kwargs):
         super(NativeExperiment, self).before_run(device, path, run, *args, **kwargs)
         if self.autostart_subject:
-            device.configure_settings_device(self.package, enable=True)
-            device.launch_package(self.package)
+            with self.timeline.phase('device_settings'):
+                device.configure_settings_device(self.package, enable=True)
+            with self.timeline.phase('launch_package'):
+                device.launch_package(self.package)
         time.sleep(1)
-        self.after_launch(device, path, run)
+        with self.timeline.phase('after_launch'):
+            self.after_launch(device, path, run)
 
     def start_profiling(self, device, path, run, *args, **kwargs):
         self.profilers.start_profiling(device, app=self.package)
@@ -56,11 +96,14 @@ class NativeExperiment(Experiment):
         time.sleep(self.duration)
 
     def after_run(self, device, path, run, *args, **kwargs):
-        self.before_close(device, path, run)
-        device.force_stop(self.package)
-        if self.clear_cache == True:
-            device.clear_app_data(self.package)
-        device.configure_settings_device(self.package, enable=False)
+        with self.timeline.phase('before_close'):
+            self.before_close(device, path, run)
+        with self.timeline.phase('stop_package'):
+            device.force_stop(self.package)
+            if self.clear_cache == True:
+                device.clear_app_data(self.package)
+        with self.timeline.phase('device_settings'):
+            device.configure_settings_device(self.package, enable=False)
         time.sleep(3)
         super(NativeExperiment, self).after_run(device, path, run)
 
@@ -62,7 +62,7 @@ class PluginHandler(object):
     def collect_results(self, device):
         """Collect the data and clean up extra files on the device"""
         self.logger.debug('%s: %s: Collecting data' % (self.moduleName, device))
-        self.currentProfiler.collect_results(device)
+        return self.currentProfiler.collect_results(device)
 
     def unload(self, device):
         """Stop the profiler, removing configuration files on device"""
@@ -76,6 +76,19 @@ class PluginHandler(object):
         self.logger.debug('%s: Setting output: %s' % (self.moduleName, self.paths['OUTPUT_DIR']))
         self.currentProfiler.set_output(self.paths['OUTPUT_DIR'])
 
+    def set_result_writer(self, result_writer):
+        self.currentProfiler.set_result_writer(result_writer)
+
+    def set_clock_sync(self, enabled):
+        self.currentProfiler.set_clock_sync(enabled)
+
+    def discard_results(self, files):
+        self.currentProfiler.discard_results(files)
+
+    def clock(self):
+        """Returns the clock of the timestamps in the output of the profiler, see ClockSync"""
+        return getattr(self.currentProfiler, 'CLOCK', None)
+
     def aggregate_subject(self):
         aggregate_subject_function = self.pluginParams.get('subject_aggregation', 'default')
         aggregate_subject_function_lower = aggregate_subject_function.lower()
@@ -120,20 +133,50 @@ class PluginHandler(object):
             self.logger.debug('%s: aggregating results')
             aggregate_script.run(None, data_dir, result_file)
 
-    def aggregate_subjects_default(self, data_dir):
+    def default_end_aggregation(self):
+        """Whether aggregate_data_end would use the default aggregation of the profiler"""
+        aggregate_function = self.pluginParams.get('experiment_aggregation', 'default')
+        return aggregate_function.lower() == 'default' and (self.subject_aggregated_default or
+                                                            not self.subject_aggregated)
+
+    def result_file(self, output_dir):
+        return os.path.join(output_dir, 'Aggregated_Results_{}.csv'.format(self.moduleName))
+
+    def subject_dirs(self, data_dir):
+        """Lists the output directories of this profiler of every (browser of every) subject in data_dir"""
+        subject_dirs = []
         for device in self.list_subdir(data_dir):
             device_dir = os.path.join(data_dir, device)
             for subject in self.list_subdir(device_dir):
                 subject_dir = os.path.join(device_dir, subject)
                 if os.path.isdir(os.path.join(subject_dir, self.name)):
-                    self.currentProfiler.set_output(os.path.join(subject_dir, self.name))
-                    self.currentProfiler.aggregate_subject()
+                    subject_dirs.append(os.path.join(subject_dir, self.name))
                 else:
                     for browser in self.list_subdir(subject_dir):
                         browser_dir = os.path.join(subject_dir, browser)
                         if os.path.isdir(os.path.join(browser_dir, self.name)):
-                            self.currentProfiler.set_output(os.path.join(browser_dir, self.name))
-                            self.currentProfiler.aggregate_subject()
+                            subject_dirs.append(os.path.join(browser_dir, self.name))
+        return subject_dirs
+
+    def aggregate_subject_dir(self, subject_dir):
+        self.currentProfiler.set_output(subject_dir)
+        self.currentProfiler.aggregate_subject()
+
+    def aggregate_subjects_default(self, data_dir):
+        for subject_dir in self.subject_dirs(data_dir):
+            self.aggregate_subject_dir(subject_dir)
+
+    def aggregate_end(self, data_dir, output_file):
+        self.currentProfiler.aggregate_end(data_dir, output_file)
+
+    def aggregate_end_shards(self, data_dir):
+        return self.currentProfiler.aggregate_end_shards(data_dir)
+
+    def aggregate_end_shard(self, shard):
+        return self.currentProfiler.aggregate_end_shard(shard)
+
+    def aggregate_end_merge(self, results, output_file):
+        self.currentProfiler.aggregate_end_merge(results, output_file)
 
     @staticmethod
     def list_subdir(a_dir):
@@ -2,6 +2,12 @@ import logging
 
 
 class Profiler(object):
+    # ResultWriter of the current run when the experiment uses a 'result_store', None otherwise
+    result_writer = None
+    # Clock of the timestamps in the output (one of AndroidRunner.ClockSync.CLOCKS), None when it has no timestamps
+    CLOCK = None
+    # Whether the experiment syncs the clocks ('clock_sync'), profilers may record more precise timestamps then
+    clock_sync = False
 
     # noinspection PyUnusedLocal
     def __init__(self, config, paths):
@@ -25,7 +31,10 @@ class Profiler(object):
         raise NotImplementedError
 
     def collect_results(self, device):
-        """Collect the data and clean up extra files on the device, save data in location set by 'set_output' """
+        """Collect the data and clean up extra files on the device, save data in location set by 'set_output'.
+        Optionally return a callable with host-side post-processing that does not use the device anymore, it is
+        executed on a background worker while the next run is prepared when 'pipeline_runs' is enabled.
+        """
         raise NotImplementedError
 
     def unload(self, device):
@@ -36,6 +45,23 @@ class Profiler(object):
         """Set the output directory before the start_profiling is called"""
         raise NotImplementedError
 
+    def set_result_writer(self, result_writer):
+        """Set the ResultWriter the results of the next run can be stored in, besides the files in 'set_output'.
+        Profilers that support the result store keep a reference to the writer in collect_results, it is replaced
+        before every run.
+        """
+        self.result_writer = result_writer
+
+    def set_clock_sync(self, enabled):
+        """Set whether the experiment syncs the host and device clocks around every run, see ClockSync"""
+        self.clock_sync = enabled
+
+    def discard_results(self, files):
+        """Forget the results of a run that was rolled back (rejected or failed), files are the removed result files.
+        Profilers that keep state over the runs of a subject, e.g. for the subject aggregation, drop those runs.
+        """
+        pass
+
     def aggregate_subject(self):
         """Aggregate the data at the end of a subject, collect data and save data to location set by 'set output' """
         raise NotImplementedError
@@ -46,5 +72,21 @@ class Profiler(object):
         """
         raise NotImplementedError
 
+    def aggregate_end_shards(self, data_dir):
+        """Optionally split aggregate_end into independent shards (e.g. one per device and subject) that can be
+        aggregated in parallel when 'aggregation_workers' is set. Returns a list of picklable shards, each one is passed
+        to aggregate_end_shard and the results are combined in the same order by aggregate_end_merge.
+        None (default) means aggregate_end is executed as a whole.
+        """
+        return None
+
+    def aggregate_end_shard(self, shard):
+        """Aggregate one shard returned by aggregate_end_shards, returns a picklable result"""
+        raise NotImplementedError
+
+    def aggregate_end_merge(self, results, output_file):
+        """Combine the results of all shards (in the order of aggregate_end_shards) and save them to output_file"""
+        raise NotImplementedError
+
 class ProfilerException(Exception):
     pass
@@ -9,10 +9,17 @@ from functools import reduce
 
 from AndroidRunner import util
 from AndroidRunner import Tests
+from AndroidRunner.ClockSync import DEVICE_REALTIME
 from AndroidRunner.Plugins.Profiler import Profiler
+from AndroidRunner.RunningStats import RunningStats, SubjectStats
 
 
 class Android(Profiler):
+    CLOCK = DEVICE_REALTIME
+    DATE_COMMAND = 'date -u'
+    # With clock_sync the samples are stamped with sub-second resolution, so they can be mapped to the host clock
+    PRECISE_DATE_COMMAND = 'date -u +%Y-%m-%dT%H:%M:%S.%NZ'
+
     def __init__(self, config, paths):
         super(Android, self).__init__(config, paths)
         self.output_dir = ''
@@ -32,6 +39,7 @@ class Android(Profiler):
                             if dp in set(available_data_points)]
         self.data = [['datetime'] + self.data_points]
         self.lock = threading.Lock()
+        self.subject_stats = SubjectStats()
 
     @staticmethod
     def get_cpu_usage(device):
@@ -74,7 +82,7 @@ class Android(Profiler):
             self.lock.release()
             return
         start = timeit.default_timer()
-        device_time = device.shell('date -u')
+        device_time = device.shell(self.PRECISE_DATE_COMMAND if self.clock_sync else self.DATE_COMMAND)
         row = [device_time]
         if 'cpu' in self.data_points:
             row.append(self.get_cpu_usage(device))
@@ -99,6 +107,22 @@ class Android(Profiler):
             writer = csv.writer(f)
             for row in self.data:
                 writer.writerow(row)
+        # Keep the run means so the subject aggregation does not have to read the run files again
+        self.subject_stats.record(self.output_dir, filename, self.run_means(self.data))
+        if self.result_writer is not None:
+            self.result_writer.write('android', self.data[1:], self.data[0])
+
+    @staticmethod
+    def run_means(rows):
+        """Returns the mean of every data point of a run, None if the run contains non-numeric values"""
+        try:
+            return RunningStats.table_means(rows, skip_columns=('datetime',))
+        except ValueError:
+            return None
+
+    def discard_results(self, files):
+        for filename in files:
+            self.subject_stats.discard(op.dirname(filename), op.basename(filename))
 
     def set_output(self, output_dir):
         self.output_dir = output_dir
@@ -115,7 +139,10 @@ class Android(Profiler):
     def aggregate_subject(self):
         filename = os.path.join(self.output_dir, 'Aggregated.csv')
         subject_rows = list()
-        subject_rows.append(self.aggregate_android_subject(self.output_dir))
+        subject_row = self.subject_stats.means(self.output_dir, prefix='android_')
+        if subject_row is None:
+            subject_row = self.aggregate_android_subject(self.output_dir)
+        subject_rows.append(subject_row)
 
         util.write_to_file(filename, subject_rows)
 
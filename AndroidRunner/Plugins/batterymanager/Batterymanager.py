@@ -5,12 +5,15 @@ import os
 import pandas as pd
 import time
 import re
+from functools import partial
 
+from AndroidRunner.ClockSync import DEVICE_REALTIME
 from AndroidRunner.Plugins.Profiler import Profiler
 
 
 class Batterymanager(Profiler):
 
+    CLOCK = DEVICE_REALTIME
     ANDROID_VERSION_11_API_LEVEL_30 = 30
     BATTERYMANAGER_DEVICE_OUTPUT_FILE = '/storage/emulated/0/Documents/BatteryManager.csv'
     AVAILABLE_DATA_POINTS = ['ACTION_CHARGING', 'ACTION_DISCHARGING',
@@ -92,7 +95,10 @@ class Batterymanager(Profiler):
             self.pull_logcat(device, logcat_file)
 
             header, rows = self.get_logcat(device)
-            self.write_logcat_csv(device, header, rows)
+            logcat_csv_file = op.join(self.output_dir,
+                                      'logcat_{}_{}.csv'.format(device.id, time.strftime('%Y.%m.%d_%H%M%S')))
+            # Parsing the logcat output does not need the device anymore
+            return partial(self.write_logcat_csv, logcat_csv_file, header, rows, self.result_writer)
 
     @staticmethod
     def pull_logcat(device, logcat_file):
@@ -138,16 +144,17 @@ class Batterymanager(Profiler):
         rows.sort(key=lambda x: x[0])
         return header, rows
 
-    def write_logcat_csv(self, device, header, rows):
+    @staticmethod
+    def write_logcat_csv(logcat_csv_file, header, rows, result_writer=None):
         header, rows = Batterymanager.preprocess_logcat(header, rows)
-        logcat_csv_file = op.join(self.output_dir,
-                                  'logcat_{}_{}.csv'.format(device.id, time.strftime('%Y.%m.%d_%H%M%S')))
 
         with open(logcat_csv_file, 'w') as lc_csv_file:
             csv_writer = csv.writer(lc_csv_file)
             csv_writer.writerow(header)
             for row in rows:
                 csv_writer.writerow(row)
+        if result_writer is not None:
+            result_writer.write('batterymanager', rows, header)
 
     def unload(self, device):
         return
@@ -216,18 +223,38 @@ class Batterymanager(Profiler):
 
     @staticmethod
     def aggregate(data_dir):
-        df = pd.DataFrame()
-        for device in Batterymanager.list_subdir(data_dir):
+        shards = Batterymanager.aggregate_end_shards(data_dir)
+        return Batterymanager.merge_subjects([Batterymanager.aggregate_end_shard(shard) for shard in shards])
+
+    @staticmethod
+    def aggregate_end_shards(data_dir):
+        """One shard (device, subject, logs_dir) per subject, sorted so the merged result is deterministic"""
+        shards = []
+        for device in sorted(Batterymanager.list_subdir(data_dir)):
             device_dir = os.path.join(data_dir, device)
-            for subject in Batterymanager.list_subdir(device_dir):
+            for subject in sorted(Batterymanager.list_subdir(device_dir)):
                 subject_dir = os.path.join(device_dir, subject)
                 if os.path.isdir(os.path.join(subject_dir, 'batterymanager')):
-                    runs_df = Batterymanager.aggregate_batterymanager_runs(os.path.join(subject_dir, 'batterymanager'))
-                    runs_df['subject'] = subject
-                    runs_df['device'] = device
-                    df = pd.concat([df, runs_df], ignore_index=True)
+                    shards.append((device, subject, os.path.join(subject_dir, 'batterymanager')))
+        return shards
+
+    @staticmethod
+    def aggregate_end_shard(shard):
+        device, subject, logs_dir = shard
+        runs_df = Batterymanager.aggregate_batterymanager_runs(logs_dir)
+        runs_df['subject'] = subject
+        runs_df['device'] = device
+        return runs_df
+
+    @staticmethod
+    def merge_subjects(subject_dfs):
+        df = pd.concat([pd.DataFrame()] + list(subject_dfs), ignore_index=True)
         return df[df.columns[::-1]]
 
+    def aggregate_end_merge(self, results, output_file):
+        print(('Output file: {}'.format(output_file)))
+        self.merge_subjects(results).to_csv(output_file, index=False)
+
     def aggregate_end(self, data_dir, output_file):
         print(('Output file: {}'.format(output_file)))
         rows = self.aggregate(data_dir)
@@ -5,6 +5,7 @@ import timeit
 import threading
 import csv
 
+from AndroidRunner.ClockSync import DEVICE_MONOTONIC
 from AndroidRunner.Plugins.Profiler import Profiler
 
 
@@ -13,6 +14,9 @@ class ConfigError(Exception):
 
 
 class Frametimes(Profiler):
+    # Vsync and frame completion timestamps of gfxinfo framestats (System.nanoTime)
+    CLOCK = DEVICE_MONOTONIC
+
     def __init__(self, config, paths):
         super(Frametimes, self).__init__(config, paths)
         self.output_dir = ''
@@ -59,20 +63,25 @@ class Frametimes(Profiler):
         times_filename = 'frame_times_{}_{}.csv'.format(device.id, time.strftime('%Y.%m.%d_%H%M%S'))
         delayed_filename = 'delayed_{}_{}.csv'.format(device.id, time.strftime('%Y.%m.%d_%H%M%S'))
         delayed_count = 0
+        header = ['frame_start', 'frame_end', 'frame_time', 'is_delayed']
+        rows = []
 
         with open(op.join(self.output_dir, times_filename), 'w+') as f:
             writer = csv.writer(f)
-            writer.writerow(['frame_start', 'frame_end', 'frame_time', 'is_delayed'])
+            writer.writerow(header)
             for row in self.data:
                 frame_time = row[1] - row[0]
                 # https://developer.android.com/topic/performance/vitals/render
                 # TL;DR; A frame is considered as delayed whenever it took more than 16m to render
                 if row[1] - row[0] > 16000000:
-                    writer.writerow([row[0], row[1], frame_time, True])
+                    rows.append([row[0], row[1], frame_time, True])
                     delayed_count += 1
                 else:
-                    writer.writerow([row[0], row[1], frame_time, False])
+                    rows.append([row[0], row[1], frame_time, False])
+            writer.writerows(rows)
         self.data = set()
+        if self.result_writer is not None:
+            self.result_writer.write('frametimes', rows, header)
 
         with open(op.join(self.output_dir, delayed_filename), 'w+') as f:
             writer = csv.writer(f)
@@ -3,6 +3,7 @@ import os
 import time
 import csv
 
+from AndroidRunner.ClockSync import DEVICE_REALTIME
 from AndroidRunner.Plugins.Profiler import Profiler
 
 
@@ -11,6 +12,9 @@ class ConfigError(Exception):
 
 
 class Garbagecollection(Profiler):
+    # Logcat timestamps, in the time zone of the device
+    CLOCK = DEVICE_REALTIME
+
     def __init__(self, config, paths):
         super(Garbagecollection, self).__init__(config, paths)
         self.output_dir = ''
@@ -9,6 +9,10 @@ from AndroidRunner.Plugins.Profiler import Profiler
 from AndroidRunner.Plugins.monsoon.script.power_device import power_meter
 
 class Monsoon(Profiler):
+    # The output is one energy total per run without timestamps, measured on the host between start_profiling and
+    # stop_profiling
+    CLOCK = None
+
     def __init__(self, config, paths):
         super(Monsoon, self).__init__(config, paths)
         self.output_dir = ''
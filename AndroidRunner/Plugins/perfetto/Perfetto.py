@@ -1,4 +1,5 @@
 from AndroidRunner import Tests
+from AndroidRunner.ClockSync import DEVICE_BOOTTIME
 from AndroidRunner.Plugins.Profiler import Profiler
 from AndroidRunner.Plugins.Profiler import ProfilerException
 import subprocess
@@ -18,6 +19,7 @@ class Perfetto(Profiler):
     """
     PERFETTO_CONFIG_DEVICE_PATH = "/sdcard/perfetto/"
     PERFETTO_TRACES_DEVICE_PATH = "/data/misc/perfetto-traces/"
+    CLOCK = DEVICE_BOOTTIME
 
     def __init__(self, config, paths):
         """ Inits the Perfetto class with config and paths params.
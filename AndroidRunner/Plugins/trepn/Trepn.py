@@ -5,6 +5,7 @@ import os
 import os.path as op
 import time
 from collections import OrderedDict
+from functools import partial
 
 import lxml.etree as et
 from lxml.etree import ElementTree
@@ -12,10 +13,14 @@ from lxml.etree import ElementTree
 from AndroidRunner.Plugins.Profiler import Profiler
 from functools import reduce
 from AndroidRunner import util
+from AndroidRunner.RunningStats import RunningStats, SubjectStats
 
 
 class Trepn(Profiler):
     DEVICE_PATH = '/sdcard/trepn/'
+    # The Time [ms] columns count from the start of the Trepn session on the device, an origin ClockSync cannot
+    # read, so they cannot be mapped to the host clock
+    CLOCK = None
 
     def dependencies(self):
         return ['com.quicinc.trepn']
@@ -27,6 +32,7 @@ class Trepn(Profiler):
         self.pref_dir = None
         self.remote_pref_dir = op.join(Trepn.DEVICE_PATH, 'saved_preferences/')
         self.data_points = []
+        self.subject_stats = SubjectStats()
         self.build_preferences(config)
 
     def override_preferences(self, params: OrderedDict, preferences_file: ElementTree) -> ElementTree:
@@ -140,7 +146,8 @@ class Trepn(Profiler):
             # Delete the originals
             device.shell('rm %s' % op.join(Trepn.DEVICE_PATH, newest_db))
             device.shell('rm %s' % op.join(Trepn.DEVICE_PATH, csv_filename))
-        self.filter_results(op.join(self.output_dir, csv_filename))
+        # Filtering the exported csv does not need the device anymore
+        return partial(self.filter_results, op.join(self.output_dir, csv_filename))
 
     @staticmethod
     def read_csv(filename):
@@ -161,6 +168,21 @@ class Trepn(Profiler):
         wanted_statistics = [system_statistics_dict[data_point] for data_point in self.data_points]
         filtered_data = self.filter_data(wanted_statistics, data)
         self.write_list_to_file(filename, filtered_data)
+        # Keep the run means so the subject aggregation does not have to read the run files again
+        self.subject_stats.record(op.dirname(filename), op.basename(filename), self.run_means(filtered_data))
+
+    @staticmethod
+    def run_means(rows):
+        """Returns the mean of every non-Time column of a filtered run, None if it can not be summarized"""
+        try:
+            time_columns = [name for name in rows[0] if name.split('[')[0].strip() == 'Time']
+            return RunningStats.table_means(rows, skip_columns=time_columns)
+        except (IndexError, TypeError, ValueError):
+            return None
+
+    def discard_results(self, files):
+        for filename in files:
+            self.subject_stats.discard(op.dirname(filename), op.basename(filename))
 
     @staticmethod
     def write_list_to_file(filename, rows):
@@ -209,7 +231,10 @@ class Trepn(Profiler):
     def aggregate_subject(self):
         filename = os.path.join(self.output_dir, 'Aggregated.csv')
         subject_rows = list()
-        subject_rows.append(self.aggregate_trepn_subject(self.output_dir))
+        subject_row = self.subject_stats.means(self.output_dir)
+        if subject_row is None:
+            subject_row = self.aggregate_trepn_subject(self.output_dir)
+        subject_rows.append(subject_row)
         util.write_to_file(filename, subject_rows)
 
     def aggregate_end(self, data_dir, output_file):
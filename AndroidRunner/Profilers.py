@@ -1,7 +1,10 @@
 import logging
+import os
 from itertools import chain
 
+from .AggregationPool import AggregationPool
 from .PluginHandler import PluginHandler
+from .Timeline import Timeline
 
 
 class Profilers(object):
@@ -10,6 +13,7 @@ class Profilers(object):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.profilers = []
         self.loaded_devices = []
+        self.timeline = Timeline('', enabled=False)
         for name, params in list(config.items()):
             try:
                 self.profilers.append(PluginHandler(name, params))
@@ -28,20 +32,40 @@ class Profilers(object):
                 p.load(device)
             self.loaded_devices.append(device.name)
 
+    def reload(self, device):
+        """Loads the profilers on a device again, e.g. after it reconnected, cleaning up what is left first"""
+        self.logger.info('Reloading')
+        for p in self.profilers:
+            try:
+                p.unload(device)
+            except Exception as e:
+                self.logger.debug('%s: Cannot unload %s: %s' % (device.id, p.name, e))
+        if device.name in self.loaded_devices:
+            self.loaded_devices.remove(device.name)
+        self.load(device)
+
     def start_profiling(self, device, **kwargs):
         self.logger.info('Start profiling')
         for p in self.profilers:
-            p.start_profiling(device, **kwargs)
+            with self.timeline.phase('start_profiling %s' % p.name):
+                p.start_profiling(device, **kwargs)
 
     def stop_profiling(self, device, **kwargs):
         self.logger.info('Stop profiling')
         for p in self.profilers:
-            p.stop_profiling(device, **kwargs)
+            with self.timeline.phase('stop_profiling %s' % p.name):
+                p.stop_profiling(device, **kwargs)
 
     def collect_results(self, device):
+        """Collects the results of all profilers, returns the host-side post-processing tasks they handed back"""
         self.logger.info('Collecting results')
+        tasks = []
         for p in self.profilers:
-            p.collect_results(device)
+            with self.timeline.phase('collect_results %s' % p.name):
+                task = p.collect_results(device)
+            if task is not None:
+                tasks.append(task)
+        return tasks
 
     def unload(self, device):
         self.logger.info('Unloading')
@@ -53,12 +77,65 @@ class Profilers(object):
         for p in self.profilers:
             p.set_output()
 
+    def clocks(self):
+        """Returns the clock of the timestamps of every profiler by name"""
+        return {p.name: p.clock() for p in self.profilers}
+
+    def set_timeline(self, timeline):
+        """Sets the Timeline the profiler calls are recorded in"""
+        self.timeline = timeline
+
+    def set_result_writer(self, result_writer):
+        for p in self.profilers:
+            p.set_result_writer(result_writer)
+
+    def set_clock_sync(self, enabled):
+        for p in self.profilers:
+            p.set_clock_sync(enabled)
+
+    def discard_results(self, files):
+        for p in self.profilers:
+            p.discard_results(files)
+
     def aggregate_subject(self):
         self.logger.info('Start subject aggregation')
         for p in self.profilers:
             p.aggregate_subject()
 
-    def aggregate_end(self, output_dir):
+    def aggregate_end(self, output_dir, workers=1):
         self.logger.info('Start final aggregation')
+        if workers <= 1:
+            for p in self.profilers:
+                p.aggregate_data_end(output_dir)
+            return
+        self.aggregate_end_parallel(output_dir, workers)
+
+    def aggregate_end_parallel(self, output_dir, workers):
+        """ Default aggregations are split in shards per (profiler, device, subject) and executed by an
+            AggregationPool, user defined aggregation scripts are still executed one after another in this process.
+        """
+        data_dir = os.path.join(output_dir, 'data')
+        pool = AggregationPool(workers)
+        sharded = [p for p in self.profilers if p.default_end_aggregation()]
         for p in self.profilers:
-            p.aggregate_data_end(output_dir)
+            if p not in sharded:
+                p.aggregate_data_end(output_dir)
+
+        # Subjects that were not aggregated after their last run
+        pool.map(sharded, [(i, 'aggregate_subject_dir', (subject_dir,)) for i, p in enumerate(sharded)
+                           if not p.subject_aggregated for subject_dir in p.subject_dirs(data_dir)])
+
+        shards = []
+        split = {}
+        for i, p in enumerate(sharded):
+            split[i] = p.aggregate_end_shards(data_dir)
+            if split[i] is None:
+                shards.append((i, 'aggregate_end', (data_dir, p.result_file(output_dir))))
+            else:
+                shards.extend((i, 'aggregate_end_shard', (shard,)) for shard in split[i])
+        results = pool.map(sharded, shards)
+
+        for i, p in enumerate(sharded):
+            if split[i] is not None:
+                p.aggregate_end_merge([result for shard, result in zip(shards, results) if shard[0] == i],
+                                      p.result_file(output_dir))
@@ -8,6 +8,7 @@ from random import randint
 import lxml.etree as et
 
 import paths
+from . import RunOrder
 
 
 class Progress(object):
@@ -20,6 +21,8 @@ class Progress(object):
         else:
             self.progress_xml_file = os.path.join(paths.OUTPUT_DIR, 'progress.xml')
             self.progress_xml_content = self.build_progress_xml(config, config_file)
+            if config.get('run_order') is not None:
+                self.apply_run_order(RunOrder.from_config(config['run_order']))
             self.write_progress_to_file()
 
     def get_progress_xml_file(self):
@@ -91,6 +94,23 @@ class Progress(object):
 
         return runs_xml
 
+    def apply_run_order(self, run_order):
+        """Puts the runs to run in the order of the RunOrder strategy and records the strategy and its seed"""
+        runs_to_run = self.progress_xml_content.find('runsToRun')
+        ordered = run_order.order(list(runs_to_run))
+        for el in ordered:
+            runs_to_run.remove(el)
+            runs_to_run.append(el)
+        element = et.Element('runOrder', strategy=run_order.name, seed=str(run_order.seed))
+        runs_to_run.addprevious(element)
+
+    def get_run_order(self):
+        """Returns the strategy and the seed the order of the runs was computed with, None without a strategy"""
+        element = self.progress_xml_content.find('runOrder')
+        if element is None:
+            return None
+        return element.get('strategy'), int(element.get('seed'))
+
     def write_progress_to_file(self):
         xml = self.progress_xml_content.getroottree()
         xml.write(self.progress_xml_file, pretty_print=True)
@@ -160,6 +180,44 @@ class Progress(object):
             runs_to_run.remove(el)
             runs_done.append(el)
 
+    """Puts an unfinished run back at the end of the list to run it again, returns how often it was re-queued"""
+
+    def requeue_run(self, run_id):
+        runs_to_run = self.progress_xml_content.find('runsToRun')
+        retries = self.run_retries(run_id) + 1
+        for el in runs_to_run.findall("run[@runId='{}']".format(run_id)):
+            el.set('retries', str(retries))
+            runs_to_run.remove(el)
+            runs_to_run.append(el)
+        return retries
+
+    """Returns how often a run was re-queued"""
+
+    def run_retries(self, run_id):
+        elements = self.progress_xml_content.xpath("*/run[@runId='{}']".format(run_id))
+        return int(elements[0].get('retries', 0)) if elements else 0
+
+    """Moves the remaining runs of the subject of a finished run to <runsSkipped>, returns how many were skipped"""
+
+    def stop_subject(self, run_id):
+        runs_to_run = self.progress_xml_content.find('runsToRun')
+        runs_skipped = self.progress_xml_content.find('runsSkipped')
+        if runs_skipped is None:
+            runs_skipped = et.SubElement(self.progress_xml_content, 'runsSkipped')
+        finished = self.progress_xml_content.find('runsDone').find("run[@runId='{}']".format(run_id))
+        subject = [finished.findtext(tag) for tag in ('device', 'path', 'browser', 'arg')]
+        skipped = [el for el in runs_to_run
+                   if [el.findtext(tag) for tag in ('device', 'path', 'browser', 'arg')] == subject]
+        for el in skipped:
+            runs_to_run.remove(el)
+            runs_skipped.append(el)
+        return len(skipped)
+
+    """Returns the ids of the finished runs"""
+
+    def done_run_ids(self):
+        return [el.get('runId') for el in self.progress_xml_content.find('runsDone')]
+
     """Check if this subject already had it's first run"""
 
     def subject_first(self, device, path, browser=None):
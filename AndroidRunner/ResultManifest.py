@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import os.path as op
+import threading
+import time
+from os import remove, rmdir
+
+
+class ResultManifest(object):
+    """ Index of the result files (and directories) every finished run created below the output directory.
+
+        Before a run the output directory of that run is snapshotted, when the run is committed everything that
+        appeared in that directory since is recorded as belonging to the run, together with the files the runner
+        recorded while it wrote them (e.g. the result store, which is outside the run directory). The committed
+        entries are kept in a set and every committed run is appended as one line to the manifest next to the
+        progress file, so removing the leftovers of a failed run only looks at the directory and the recorded
+        files of that run instead of the whole result tree.
+
+        The listing of every directory is cached together with its modification time, a snapshot only lists the
+        directories that changed since they were listed, i.e. the directories the previous run wrote to. The
+        listing of a committed run is the snapshot of the next run in the same directory. Entries that appear in
+        that directory between the commit of a run and the begin of the next one count as results of the next run.
+    """
+
+    FILENAME = 'result_manifest.jsonl'
+    # A directory that was modified this close before it was listed is listed again, an entry created in the same
+    # timestamp tick as the listing would not change its modification time
+    RACY_NS = 2 * 10 ** 9
+
+    def __init__(self, base_dir):
+        """ Inits a ResultManifest instance, loading the manifest of a previous session if there is one.
+
+            Parameters
+            ----------
+            base_dir : str
+                The output directory of the experiment, recorded paths are relative to it.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.base_dir = base_dir
+        self.manifest_file = op.join(base_dir, self.FILENAME)
+        self.runs = {}
+        self.files = set()
+        self.unsaved = []
+        self.current_run = None
+        self.run_dir = None
+        self.snapshot = {}
+        self.recorded = set()
+        # directory -> (mtime_ns, listed_ns, names, subdirectories)
+        self.listings = {}
+        # (directory, listing) of the last committed run
+        self.listing = (None, {})
+        self._lock = threading.Lock()
+        if op.isfile(self.manifest_file):
+            self.load()
+
+    def load(self):
+        """Reads the committed runs from the manifest, a line cut off by an interrupted write is skipped"""
+        with open(self.manifest_file, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    self.logger.warning('Skipping incomplete entry in %s' % self.manifest_file)
+                    continue
+                self.runs[entry['run']] = entry['files']
+                self.files.update(entry['files'])
+
+    def listdir(self, directory):
+        """Returns the names of the entries and of the subdirectories of directory, listing it only if it changed"""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            self.listings.pop(directory, None)
+            return frozenset(), ()
+        cached = self.listings.get(directory)
+        if cached is not None and cached[0] == mtime and cached[1] - mtime > self.RACY_NS:
+            return cached[2], cached[3]
+        listed = time.time_ns()
+        names = set()
+        subdirs = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                names.add(entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+        cached = (mtime, listed, frozenset(names), tuple(subdirs))
+        self.listings[directory] = cached
+        return cached[2], cached[3]
+
+    def scan(self, directory):
+        """Returns the entry names of directory and of all directories below it, keyed by directory"""
+        listing = {}
+        pending = [directory]
+        while pending:
+            path = pending.pop()
+            names, subdirs = self.listdir(path)
+            listing[path] = names
+            pending.extend(op.join(path, name) for name in subdirs)
+        return listing
+
+    def begin_run(self, run_id, run_dir):
+        """Marks the start of a run that writes its results in run_dir"""
+        self.current_run = run_id
+        self.run_dir = run_dir
+        directory, listing = self.listing
+        self.snapshot = listing if directory == run_dir else self.scan(run_dir)
+        self.recorded = set()
+
+    def record(self, path):
+        """Records a file the current run wrote, it may be outside of the run directory"""
+        if self.current_run is None:
+            return
+        with self._lock:
+            self.recorded.add(op.relpath(path, self.base_dir))
+
+    def created(self):
+        """Returns the listing of the run directory and the entries the current run created"""
+        listing = self.scan(self.run_dir)
+        created = set()
+        for directory, names in listing.items():
+            before = self.snapshot.get(directory)
+            if before is names:
+                continue
+            new = names if before is None else names - before
+            created.update(op.relpath(op.join(directory, name), self.base_dir) for name in new)
+        with self._lock:
+            recorded = set(self.recorded)
+        return listing, created | recorded
+
+    def commit_run(self):
+        """Records the entries created since begin_run as results of the current run"""
+        if self.current_run is None:
+            return
+        listing, created = self.created()
+        self.runs[self.current_run] = sorted(created)
+        self.files.update(created)
+        self.unsaved.append(self.current_run)
+        self.listing = (self.run_dir, listing)
+        self.reset()
+
+    def rollback(self):
+        """ Removes the files and directories the current, uncommitted, run created.
+
+            Afterwards the run directory and its parents, and the directories of the recorded files, are removed
+            as well when they are left empty.
+
+            Returns
+            -------
+            list
+                The absolute paths that were removed.
+        """
+        if self.current_run is None:
+            return []
+        removed = []
+        created = self.created()[1] - self.files
+        # Deepest paths first so directories are empty when they are removed
+        for entry in sorted(created, key=lambda e: e.count(os.sep), reverse=True):
+            path = op.join(self.base_dir, entry)
+            if op.isfile(path) or op.islink(path):
+                remove(path)
+            elif op.isdir(path) and not os.listdir(path):
+                rmdir(path)
+            else:
+                continue
+            removed.append(path)
+        removed.extend(self.remove_empty(self.run_dir, op.join(self.base_dir, 'data')))
+        with self._lock:
+            recorded = set(self.recorded)
+        for entry in sorted(recorded):
+            removed.extend(self.remove_empty(op.dirname(op.join(self.base_dir, entry)), self.base_dir))
+        self.listing = (None, {})
+        self.reset()
+        return removed
+
+    def remove_empty(self, directory, root):
+        """Removes directory and its parents below root while they are empty and no committed run created them"""
+        removed = []
+        directory = op.normpath(directory)
+        root = op.normpath(root)
+        while directory.startswith(root + os.sep) and op.isdir(directory) and not os.listdir(directory) \
+                and op.relpath(directory, self.base_dir) not in self.files:
+            rmdir(directory)
+            removed.append(directory)
+            directory = op.dirname(directory)
+        return removed
+
+    def reset(self):
+        self.current_run = None
+        self.run_dir = None
+        self.snapshot = {}
+        with self._lock:
+            self.recorded = set()
+
+    def pending_files(self):
+        """Returns the absolute paths of the files the current, uncommitted, run created so far"""
+        if self.current_run is None:
+            return []
+        created = self.created()[1] - self.files
+        return sorted(op.join(self.base_dir, entry) for entry in created if op.isfile(op.join(self.base_dir, entry)))
+
+    def run_files(self, run_id):
+        """Returns the absolute paths of the entries a committed run created"""
+        return [op.join(self.base_dir, entry) for entry in self.runs.get(run_id, [])]
+
+    def save(self):
+        """Appends the runs committed since the last save to the manifest"""
+        if not self.unsaved:
+            return
+        with open(self.manifest_file, 'a') as f:
+            for run_id in self.unsaved:
+                f.write(json.dumps({'run': run_id, 'files': self.runs[run_id]}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.unsaved = []
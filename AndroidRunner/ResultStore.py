@@ -0,0 +1,126 @@
+import logging
+import os
+import os.path as op
+from collections import OrderedDict
+
+from .util import ConfigError, makedirs, slugify_dir
+
+
+class ResultStore(object):
+    """ Columnar store with the results of all runs of an experiment.
+
+        Every table (one per profiler, e.g. 'android') is a Parquet dataset under <root>/<table>, partitioned
+        hive-style by device/subject/browser/arg/run. Each run writes exactly one file, so re-running a run
+        overwrites its previous result. The partition keys are not stored in the files, they come back as
+        columns when the dataset is read, and readers only load the columns they ask for.
+    """
+
+    PARTITION_KEYS = ('device', 'subject', 'browser', 'arg', 'run')
+    FILENAME = 'part-0.parquet'
+
+    def __init__(self, root):
+        """ Inits a ResultStore instance.
+
+            Parameters
+            ----------
+            root : str
+                Directory in which the datasets are created.
+
+            Raises
+            ------
+            ConfigError
+                If pyarrow, which pandas needs to write Parquet files, is not installed.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ConfigError('"result_store" requires the pyarrow package (pip install pyarrow)')
+        self.root = root
+        self.manifest = None
+
+    @staticmethod
+    def partition(current_run):
+        """Returns the partition values of a run as an OrderedDict, keys that do not apply are left out"""
+        values = OrderedDict()
+        values['device'] = current_run['device']
+        values['subject'] = slugify_dir(current_run['path'])
+        if current_run.get('browser') is not None:
+            values['browser'] = current_run['browser']
+        if current_run.get('experimentArg') is not None:
+            values['arg'] = slugify_dir(str(current_run['experimentArg']))
+        values['run'] = current_run['runCount']
+        return values
+
+    def partition_dir(self, table, partition):
+        return op.join(self.root, table, *['%s=%s' % (k, v) for k, v in partition.items()])
+
+    def set_manifest(self, manifest):
+        """Sets the ResultManifest the written files are recorded in, so a failed run can be rolled back"""
+        self.manifest = manifest
+
+    def writer(self, current_run):
+        """Returns a ResultWriter bound to the partition of current_run"""
+        return ResultWriter(self, self.partition(current_run))
+
+    def write(self, table, partition, frame):
+        """ Writes the DataFrame frame as the result of one run to table.
+
+            Returns
+            -------
+            str
+                Path of the written file.
+        """
+        directory = self.partition_dir(table, partition)
+        makedirs(directory)
+        filename = op.join(directory, self.FILENAME)
+        frame.to_parquet(filename, index=False)
+        if self.manifest is not None:
+            self.manifest.record(filename)
+        self.logger.debug('Wrote %s rows to %s' % (len(frame), filename))
+        return filename
+
+    def read(self, table, columns=None, filters=None):
+        """ Loads a table as a DataFrame, only reading the requested columns.
+
+            Parameters
+            ----------
+            table : str
+                Name of the table, e.g. 'android'.
+            columns : list
+                Columns to load (partition keys included), None for all.
+            filters : list
+                pyarrow filters on the partition keys, e.g. [('device', '=', 'nexus6p')].
+        """
+        import pandas as pd
+        return pd.read_parquet(op.join(self.root, table), columns=columns, filters=filters)
+
+    def tables(self):
+        if not op.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if op.isdir(op.join(self.root, name)))
+
+    @staticmethod
+    def to_frame(rows, columns):
+        """Builds a DataFrame from rows, converting columns that only contain numbers to a numeric dtype"""
+        import pandas as pd
+        frame = pd.DataFrame([list(row) for row in rows], columns=list(columns))
+        for column in frame.columns:
+            if not pd.api.types.is_numeric_dtype(frame[column]) and not pd.api.types.is_bool_dtype(frame[column]):
+                try:
+                    frame[column] = pd.to_numeric(frame[column])
+                except (TypeError, ValueError):
+                    pass
+        return frame
+
+
+class ResultWriter(object):
+    """Writes the results of a single run into a ResultStore, handed to the profilers before every run"""
+
+    def __init__(self, store, partition):
+        self.store = store
+        self.partition = partition
+
+    def write(self, table, rows, columns):
+        """ Stores rows (a list of lists) with the given column names as the result of this run in table."""
+        return self.store.write(table, self.partition, self.store.to_frame(rows, columns))
@@ -0,0 +1,143 @@
+import csv
+import logging
+import multiprocessing as mp
+import os
+import os.path as op
+import threading
+from collections import OrderedDict
+
+from .util import makedirs
+
+RUN_KEYS = ('runId', 'device', 'path', 'browser', 'experimentArg', 'runCount')
+
+
+class MetricsRecorder(object):
+    """ Handed to the interaction scripts as kwargs['metrics'] to report key/value metrics of the current run.
+
+        The scripts run in a child process, so the metrics are sent to the experiment over a pipe. Every record
+        call is written to the pipe right away; nothing is lost when the script process is terminated afterwards.
+    """
+
+    def __init__(self, connection, lock):
+        self.connection = connection
+        self.lock = lock
+
+    def record(self, key, value):
+        """Records one metric, recording the same key twice in a run keeps the last value"""
+        with self.lock:
+            self.connection.send((key, value))
+
+    def update(self, metrics):
+        """Records all items of the dict metrics"""
+        for key, value in metrics.items():
+            self.record(key, value)
+
+
+class RunMetrics(object):
+    """ Collects the metrics the scripts record during a run and writes them to the output of the experiment.
+
+        A reader thread buffers the metrics while the run executes. When the run finished they are written to
+        run_metrics/<runId>.csv in the output directory of the run and added to run_metrics.csv in the output
+        directory of the experiment. Both files are written to a temporary file first and then moved into place,
+        so an interrupted experiment never leaves a partially written file behind.
+    """
+
+    FILENAME = 'run_metrics.csv'
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, output_root):
+        """ Inits a RunMetrics instance.
+
+            Parameters
+            ----------
+            output_root : str
+                The output directory of the experiment, rows of a previous session in its run_metrics.csv are kept.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.experiment_file = op.join(output_root, self.FILENAME)
+        self._receiver, sender = mp.Pipe(duplex=False)
+        self._recorder = MetricsRecorder(sender, mp.Lock())
+        self.current_run = None
+        self.metrics = OrderedDict()
+        self._stop = threading.Event()
+        self._reader = None
+        self.rows = OrderedDict()
+        if op.isfile(self.experiment_file):
+            with open(self.experiment_file, 'r', newline='') as f:
+                for row in csv.DictReader(f):
+                    self.rows[row['runId']] = row
+
+    def recorder(self):
+        return self._recorder
+
+    def begin_run(self, current_run):
+        """Starts buffering the metrics of current_run, metrics of a run that was not ended are dropped"""
+        self.stop_reader()
+        self.current_run = current_run
+        self.metrics = OrderedDict()
+        self._stop.clear()
+        self._reader = threading.Thread(target=self.read, name='RunMetricsReader', daemon=True)
+        self._reader.start()
+
+    def read(self):
+        while not self._stop.is_set():
+            if self._receiver.poll(self.POLL_INTERVAL):
+                self.receive()
+
+    def receive(self):
+        key, value = self._receiver.recv()
+        self.metrics[key] = value
+
+    def stop_reader(self):
+        if self._reader is not None:
+            self._stop.set()
+            self._reader.join()
+            self._reader = None
+        while self._receiver.poll():
+            self.receive()
+
+    def end_run(self, output_dir):
+        """ Stops buffering and writes the metrics of the run, nothing is written when no metric was recorded.
+
+            Returns
+            -------
+            str
+                Path of the file with the metrics of the run, None when nothing was recorded.
+        """
+        self.stop_reader()
+        current_run, metrics = self.current_run, self.metrics
+        self.current_run = None
+        self.metrics = OrderedDict()
+        if current_run is None or not metrics:
+            return None
+        row = OrderedDict((key, current_run[key]) for key in RUN_KEYS if current_run.get(key) is not None)
+        row.update(metrics)
+        run_file = op.join(output_dir, 'run_metrics', '%s.csv' % current_run['runId'])
+        makedirs(op.dirname(run_file))
+        self.write_csv(run_file, [row])
+        self.rows[str(current_run['runId'])] = row
+        self.write_csv(self.experiment_file, list(self.rows.values()))
+        self.logger.debug('Recorded %s metric(s) of run %s' % (len(metrics), current_run['runId']))
+        return run_file
+
+    def discard(self, run_id):
+        """Removes the row of a run that was rolled back from run_metrics.csv"""
+        if self.rows.pop(str(run_id), None) is None:
+            return
+        if self.rows:
+            self.write_csv(self.experiment_file, list(self.rows.values()))
+        elif op.isfile(self.experiment_file):
+            os.remove(self.experiment_file)
+
+    @staticmethod
+    def write_csv(filename, rows):
+        """Writes rows (dicts) with the union of their keys as header, replacing filename atomically"""
+        fieldnames = []
+        for row in rows:
+            fieldnames.extend(key for key in row if key not in fieldnames)
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp_file, filename)
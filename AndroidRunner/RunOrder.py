@@ -0,0 +1,175 @@
+import random
+from collections import OrderedDict
+
+from . import Tests
+from .util import ConfigError
+
+SUBJECT_TAGS = ('device', 'path', 'browser', 'arg')
+
+
+def subject(run):
+    """Returns the subject of a <run> element of the progress file"""
+    return tuple(run.findtext(tag) for tag in SUBJECT_TAGS)
+
+
+def group_by_subject(runs):
+    """Returns the runs of every subject in the order the subjects first appear"""
+    subjects = OrderedDict()
+    for run in runs:
+        subjects.setdefault(subject(run), []).append(run)
+    return subjects
+
+
+class RunOrder(object):
+    """ Strategy that decides in which order the runs of the experiment are executed.
+
+        The order is computed once, when the progress file is created, from a seeded random generator. The progress
+        file keeps the runs in that order together with the strategy and the seed, so a resumed experiment continues
+        with the same order.
+    """
+    name = None
+    options = ()
+
+    def __init__(self, seed, **options):
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    def order(self, runs):
+        """Returns the <run> elements runs in the order they have to be executed"""
+        raise NotImplementedError
+
+
+class SequentialOrder(RunOrder):
+    """Every subject after the other, in the order of the configuration"""
+    name = 'sequential'
+
+    def order(self, runs):
+        return list(runs)
+
+
+class RandomOrder(RunOrder):
+    """All runs shuffled"""
+    name = 'random'
+
+    def order(self, runs):
+        runs = list(runs)
+        self.random.shuffle(runs)
+        return runs
+
+
+class BlockedOrder(RunOrder):
+    """ The runs of a subject are executed in blocks of block_size consecutive runs. Every round executes one block
+        of every subject, the order of the subjects is shuffled in every round. Without block_size all runs of a
+        subject are one block, so each subject is entered once.
+    """
+    name = 'blocked'
+    options = ('block_size',)
+
+    def __init__(self, seed, block_size=None):
+        super(BlockedOrder, self).__init__(seed)
+        self.block_size = Tests.is_integer(block_size, minimum=1) if block_size is not None else None
+
+    def order(self, runs):
+        subjects = list(group_by_subject(runs).values())
+        block_size = self.block_size or max(len(subject_runs) for subject_runs in subjects)
+        ordered = []
+        start = 0
+        while any(len(subject_runs) > start for subject_runs in subjects):
+            blocks = [subject_runs[start:start + block_size] for subject_runs in subjects
+                      if len(subject_runs) > start]
+            self.random.shuffle(blocks)
+            for block in blocks:
+                ordered.extend(block)
+            start += block_size
+        return ordered
+
+
+class CounterbalancedOrder(RunOrder):
+    """ Every round executes one run of every subject, the order of the subjects in the rounds follows a balanced
+        Latin square (Williams design): over the rounds every subject is executed at every position equally often
+        and, for an even number of subjects, directly follows every other subject equally often. Which subject gets
+        which row of the square is shuffled.
+    """
+    name = 'counterbalanced'
+
+    @staticmethod
+    def williams_row(n, row):
+        """Returns row of the balanced Latin square of size n"""
+        sequence = []
+        low, high = 0, n - 1
+        for i in range(n):
+            if i % 2 == 0:
+                sequence.append(low)
+                low += 1
+            else:
+                sequence.append(high)
+                high -= 1
+        square_row = [(value + row) % n for value in sequence]
+        # An odd number of subjects needs the mirrored rows as well to balance the carryover
+        if n % 2 == 1 and (row // n) % 2 == 1:
+            square_row.reverse()
+        return square_row
+
+    def order(self, runs):
+        subjects = list(group_by_subject(runs).values())
+        self.random.shuffle(subjects)
+        ordered = []
+        rounds = max(len(subject_runs) for subject_runs in subjects)
+        for i in range(rounds):
+            for index in self.williams_row(len(subjects), i):
+                if len(subjects[index]) > i:
+                    ordered.append(subjects[index][i])
+        return ordered
+
+
+class MinimalSwitchOrder(RunOrder):
+    """ Keeps the runs that share a device, a path (APK install, model load) and a subject together, so every path
+        is set up once per device. The order of the paths of a device and of the subjects of a path is shuffled.
+    """
+    name = 'min_switch'
+
+    def shuffled_groups(self, items, key):
+        groups = OrderedDict()
+        for item in items:
+            groups.setdefault(key(item), []).append(item)
+        groups = list(groups.values())
+        self.random.shuffle(groups)
+        return groups
+
+    def order(self, runs):
+        ordered = []
+        devices = OrderedDict()
+        for run in runs:
+            devices.setdefault(run.findtext('device'), []).append(run)
+        for device_runs in devices.values():
+            for path_runs in self.shuffled_groups(device_runs, lambda run: run.findtext('path')):
+                for subject_runs in self.shuffled_groups(path_runs, subject):
+                    ordered.extend(subject_runs)
+        return ordered
+
+
+STRATEGIES = OrderedDict((strategy.name, strategy) for strategy in
+                         (SequentialOrder, RandomOrder, BlockedOrder, CounterbalancedOrder, MinimalSwitchOrder))
+
+
+def from_config(config):
+    """ Returns the RunOrder of the 'run_order' configuration, e.g. {"strategy": "blocked", "seed": 42}.
+
+        Without a seed a random one is drawn, it is recorded in the progress file.
+
+        Raises
+        ------
+        ConfigError
+            If the strategy or one of its options is unknown.
+    """
+    config = dict(config)
+    name = config.pop('strategy', SequentialOrder.name)
+    if name not in STRATEGIES:
+        raise ConfigError('Unknown run_order strategy "%s", use one of: %s' % (name, ', '.join(STRATEGIES)))
+    strategy = STRATEGIES[name]
+    seed = config.pop('seed', None)
+    seed = Tests.is_integer(seed) if seed is not None else random.randrange(2 ** 32)
+    unknown = [key for key in config if key not in strategy.options]
+    if unknown:
+        raise ConfigError('Unknown option(s) of run_order strategy "%s": %s' % (name, ', '.join(unknown)))
+    return strategy(seed, **config)
@@ -0,0 +1,67 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RunPipeline(object):
+    """ Executes the host-side work of a run on a background worker so it overlaps with the cooldown
+        and the preparation of the next run.
+
+        Host-side work is everything that does not need the device: post-processing of pulled result files,
+        subject aggregation and writing the progress file. Tasks are executed one at a time in the order
+        they were submitted. Device-exclusive steps never go through the pipeline; the experiment calls
+        wait() before the profilers are used again for the next run.
+
+        When the pipeline is disabled submitted tasks are executed immediately in the calling thread.
+    """
+
+    def __init__(self, enabled=False):
+        """ Inits a RunPipeline instance.
+
+            Parameters
+            ----------
+            enabled : bool
+                Whether tasks are executed on a background worker (True) or inline (False).
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.enabled = enabled
+        self._executor = ThreadPoolExecutor(max_workers=1) if enabled else None
+        self._pending = []
+
+    def submit(self, function, *args, **kwargs):
+        """ Schedules function(*args, **kwargs) on the worker, or runs it right away when the pipeline is disabled."""
+        if self._executor is None:
+            function(*args, **kwargs)
+            return
+        self._pending.append(self._executor.submit(function, *args, **kwargs))
+
+    def wait(self):
+        """ Blocks until all submitted tasks are done.
+
+            Raises
+            ------
+            Exception
+                The first exception that was raised by one of the tasks.
+        """
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        start = time.monotonic()
+        error = None
+        for future in pending:
+            exception = future.exception()
+            if exception is not None and error is None:
+                error = exception
+        self.logger.debug('Waited %.3fs for %s host-side task(s)' % (time.monotonic() - start, len(pending)))
+        if error is not None:
+            raise error
+
+    def shutdown(self):
+        """ Waits for the submitted tasks and stops the worker. Errors of the tasks are logged, not raised."""
+        try:
+            self.wait()
+        except Exception as e:
+            self.logger.error('Host-side task failed: %s: %s' % (e.__class__.__name__, str(e)))
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,167 @@
+import csv
+import logging
+import os
+import os.path as op
+import statistics
+from collections import OrderedDict
+
+from . import Tests
+from .RunMetrics import RUN_KEYS, RunMetrics
+from .util import ConfigError
+
+ACCEPTED = 'accepted'
+REQUEUED = 'requeued'
+KEPT = 'kept'
+
+# Directories of the run output that hold bookkeeping of the runner, not results of the profilers
+BOOKKEEPING_DIRS = ('run_metrics', 'timeline', 'clock_sync')
+# Smallest spread of a metric, relative to its median, so a metric that did not vary yet does not flag every change
+MIN_SPREAD = 0.05
+# Scales the median absolute deviation to the standard deviation of a normal distribution
+MAD_SCALE = 1.4826
+# Number of times the device rebooted or was unreachable during the run (DeviceWatchdog), such a run is always
+# suspicious. The other anomalies (heat, low battery or storage) persist over runs and are only flags.
+WATCHDOG_METRIC = 'watchdog_resets'
+WATCHDOG_FLAGS = ('watchdog_anomalies',)
+
+
+class RunValidator(object):
+    """ Checks every finished run against the previous runs of its subject before it counts as done.
+
+        The metrics of a run are the duration of the interaction, the numeric metrics the scripts recorded and,
+        per profiler, the number of result files and CSV rows the run created. A run is suspicious when a metric
+        is further than threshold robust standard deviations (median and median absolute deviation of the
+        accepted runs of the subject) from the median, or when a metric every accepted run had is missing, e.g.
+        because an adb pull failed. Runs are only judged against the others once min_runs runs of the subject were
+        accepted. A run during which the device rebooted or was unreachable is suspicious as soon as one run was
+        accepted.
+
+        A suspicious run is discarded and scheduled again, at most retries times, after that it is kept. Every
+        verdict is written to run_validation.csv in the output directory of the experiment.
+    """
+
+    FILENAME = 'run_validation.csv'
+    DEFAULTS = OrderedDict([('threshold', 3.5), ('min_runs', 3), ('retries', 2), ('metrics', None)])
+
+    def __init__(self, config, output_root):
+        """ Inits a RunValidator instance.
+
+            Parameters
+            ----------
+            config : dict
+                The 'run_validation' configuration, see DEFAULTS for the keys. metrics lists the metrics that are
+                checked, all metrics when None.
+            output_root : str
+                The output directory of the experiment.
+
+            Raises
+            ------
+            ConfigError
+                If a key is unknown or a value is invalid.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        unknown = [key for key in config if key not in self.DEFAULTS]
+        if unknown:
+            raise ConfigError('Unknown run_validation option(s): %s' % ', '.join(unknown))
+        settings = OrderedDict(self.DEFAULTS)
+        settings.update(config)
+        self.threshold = settings['threshold']
+        if isinstance(self.threshold, bool) or not isinstance(self.threshold, (int, float)) or self.threshold <= 0:
+            raise ConfigError('run_validation threshold must be a positive number, got %s' % self.threshold)
+        # A rejected run never is the first run of its subject, the runner would prepare the subject again
+        self.min_runs = Tests.is_integer(settings['min_runs'], minimum=1)
+        self.retries = Tests.is_integer(settings['retries'])
+        self.metrics = settings['metrics']
+        if self.metrics is not None and not isinstance(self.metrics, list):
+            raise ConfigError('run_validation metrics must be a list of metric names')
+        self.experiment_file = op.join(output_root, self.FILENAME)
+        self.history = {}
+        self.rows = []
+        if op.isfile(self.experiment_file):
+            with open(self.experiment_file, 'r', newline='') as f:
+                self.rows = list(csv.DictReader(f))
+
+    @staticmethod
+    def subject(current_run):
+        return tuple(str(current_run.get(key)) for key in ('device', 'path', 'browser', 'experimentArg'))
+
+    @staticmethod
+    def count_rows(filename):
+        with open(filename, 'rb') as f:
+            return max(0, sum(1 for _ in f) - 1)
+
+    def run_metrics(self, interaction_ms, script_metrics, run_dir, files):
+        """ Returns the metrics of a run.
+
+            Parameters
+            ----------
+            interaction_ms : float
+                Duration of the interaction.
+            script_metrics : dict
+                The metrics the scripts recorded, non-numeric values are left out.
+            run_dir : str
+                The output directory of the run.
+            files : list
+                The result files the run created.
+        """
+        metrics = OrderedDict()
+        if interaction_ms is not None:
+            metrics['interaction_ms'] = interaction_ms
+        for key, value in script_metrics.items():
+            if key in RUN_KEYS or key.startswith('cooldown_') or key in WATCHDOG_FLAGS:
+                continue
+            try:
+                metrics[key] = float(value)
+            except (TypeError, ValueError):
+                continue
+        for filename in files:
+            parts = op.relpath(filename, run_dir).split(os.sep)
+            if parts[0] in BOOKKEEPING_DIRS:
+                continue
+            profiler = parts[0] if len(parts) > 1 else 'output'
+            metrics['files_%s' % profiler] = metrics.get('files_%s' % profiler, 0) + 1
+            if filename.endswith('.csv'):
+                metrics['rows_%s' % profiler] = metrics.get('rows_%s' % profiler, 0) + self.count_rows(filename)
+        if self.metrics is not None:
+            metrics = OrderedDict((key, value) for key, value in metrics.items()
+                                  if key in self.metrics or key == WATCHDOG_METRIC)
+        return metrics
+
+    def check(self, current_run, metrics):
+        """Returns the reasons why the run is suspicious, an empty list when it is not"""
+        history = self.history.get(self.subject(current_run), [])
+        # Like min_runs, so a rejected run never is the first run of its subject
+        if not history:
+            return []
+        reasons = []
+        if metrics.get(WATCHDOG_METRIC):
+            reasons.append('%s=%d' % (WATCHDOG_METRIC, metrics[WATCHDOG_METRIC]))
+        if len(history) < self.min_runs:
+            return reasons
+        for key in history[0]:
+            if all(key in previous for previous in history) and key not in metrics:
+                reasons.append('%s missing' % key)
+        for key, value in metrics.items():
+            if key == WATCHDOG_METRIC:
+                continue
+            values = [previous[key] for previous in history if key in previous]
+            if len(values) < self.min_runs:
+                continue
+            median = statistics.median(values)
+            spread = max(MAD_SCALE * statistics.median(abs(v - median) for v in values), MIN_SPREAD * abs(median),
+                         1e-9)
+            score = (value - median) / spread
+            if abs(score) > self.threshold:
+                reasons.append('%s=%s (median %s, z=%.1f)' % (key, round(value, 3), round(median, 3), score))
+        return reasons
+
+    def accept(self, current_run, metrics):
+        """Adds the metrics of an accepted run to the statistics of its subject"""
+        self.history.setdefault(self.subject(current_run), []).append(metrics)
+
+    def record(self, current_run, verdict, reasons, retries):
+        """Writes the verdict of a run to run_validation.csv"""
+        row = OrderedDict((key, current_run[key]) for key in RUN_KEYS if current_run.get(key) is not None)
+        row.update([('verdict', verdict), ('retries', retries), ('reasons', '; '.join(reasons))])
+        self.rows.append(row)
+        RunMetrics.write_csv(self.experiment_file, self.rows)
@@ -0,0 +1,225 @@
+import math
+import os
+import os.path as op
+from collections import OrderedDict
+
+QUANTILE_ITERATIONS = 100
+
+
+def t_interval_probability(theta, df):
+    """ Returns P(|T| < t) of the Student t distribution with an integer number of degrees of freedom df, where
+        theta = atan(t / sqrt(df)) (Abramowitz and Stegun 26.7.3 and 26.7.4).
+    """
+    cos2 = math.cos(theta) ** 2
+    if df % 2:
+        if df == 1:
+            return 2 * theta / math.pi
+        term = total = math.cos(theta)
+        for k in range(3, df - 1, 2):
+            term *= (k - 1) / k * cos2
+            total += term
+        return 2 / math.pi * (theta + math.sin(theta) * total)
+    term = total = 1.0
+    for k in range(2, df - 1, 2):
+        term *= (k - 1) / k * cos2
+        total += term
+    return math.sin(theta) * total
+
+
+def t_quantile(p, df):
+    """ Returns the p quantile of the Student t distribution with an integer number of degrees of freedom df.
+
+        The closed form of t_interval_probability is inverted by bisection over theta, so the quantile is exact
+        for any df, including the few degrees of freedom of the first runs of a subject.
+    """
+    if p < 0.5:
+        return -t_quantile(1 - p, df)
+    target = 2 * p - 1
+    low, high = 0.0, math.pi / 2
+    for _ in range(QUANTILE_ITERATIONS):
+        middle = (low + high) / 2
+        if t_interval_probability(middle, df) < target:
+            low = middle
+        else:
+            high = middle
+    return math.sqrt(df) * math.tan((low + high) / 2)
+
+
+class RunningStats(object):
+    """ Running statistics per metric, updated one value at a time (Welford's online algorithm).
+
+        For every metric the count, mean, M2 (sum of squared differences from the mean), minimum and maximum
+        are kept, so the mean and (sample) variance are available in O(1) without keeping the values around.
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def update(self, values):
+        """ Adds one observation for every metric in values.
+
+            Parameters
+            ----------
+            values : dict
+                Mapping of metric name to a number (or a string representing a number).
+        """
+        for name, value in values.items():
+            value = float(value)
+            metric = self.metrics.get(name)
+            if metric is None:
+                self.metrics[name] = {'count': 1, 'mean': value, 'M2': 0.0, 'min': value, 'max': value}
+                continue
+            metric['count'] += 1
+            delta = value - metric['mean']
+            metric['mean'] += delta / metric['count']
+            metric['M2'] += delta * (value - metric['mean'])
+            metric['min'] = min(metric['min'], value)
+            metric['max'] = max(metric['max'], value)
+
+    def merge(self, other):
+        """ Combines the statistics of another RunningStats instance into this one (Chan et al.)."""
+        for name, theirs in other.metrics.items():
+            ours = self.metrics.get(name)
+            if ours is None:
+                self.metrics[name] = dict(theirs)
+                continue
+            count = ours['count'] + theirs['count']
+            delta = theirs['mean'] - ours['mean']
+            ours['M2'] += theirs['M2'] + delta ** 2 * ours['count'] * theirs['count'] / count
+            ours['mean'] += delta * theirs['count'] / count
+            ours['count'] = count
+            ours['min'] = min(ours['min'], theirs['min'])
+            ours['max'] = max(ours['max'], theirs['max'])
+
+    def names(self):
+        return list(self.metrics.keys())
+
+    def count(self, name):
+        metric = self.metrics.get(name)
+        return metric['count'] if metric is not None else 0
+
+    def mean(self, name):
+        return self.metrics[name]['mean']
+
+    def variance(self, name):
+        """Returns the sample variance of a metric, 0.0 when there are less than two observations"""
+        metric = self.metrics[name]
+        if metric['count'] < 2:
+            return 0.0
+        return metric['M2'] / (metric['count'] - 1)
+
+    def std(self, name):
+        return math.sqrt(self.variance(name))
+
+    def half_width(self, name, confidence):
+        """Returns the half-width of the confidence interval of the mean of a metric, inf below two observations"""
+        count = self.count(name)
+        if count < 2:
+            return float('inf')
+        return t_quantile((1 + confidence) / 2, count - 1) * math.sqrt(self.variance(name) / count)
+
+    def minimum(self, name):
+        return self.metrics[name]['min']
+
+    def maximum(self, name):
+        return self.metrics[name]['max']
+
+    def means(self):
+        """Returns an OrderedDict with the mean of every metric"""
+        return OrderedDict((name, metric['mean']) for name, metric in self.metrics.items())
+
+    @staticmethod
+    def table_means(table, skip_columns=()):
+        """ Returns the mean of every column of a table, skipping empty cells.
+
+            Parameters
+            ----------
+            table : list
+                List of rows, the first row is the header.
+            skip_columns : iterable
+                Names of columns that are not aggregated (e.g. timestamps).
+
+            Returns
+            -------
+            OrderedDict
+                Column name to mean, columns without values are left out.
+        """
+        header = table[0]
+        totals = OrderedDict()
+        for i, name in enumerate(header):
+            if name in skip_columns:
+                continue
+            values = [float(row[i]) for row in table[1:] if i < len(row) and row[i] != '']
+            if values:
+                totals[name] = sum(values) / len(values)
+        return totals
+
+
+class SubjectStats(object):
+    """ Keeps a RunningStats per subject output directory, fed with the mean of every run.
+
+        A directory that already contained run files before the first run of this session was recorded
+        (e.g. a resumed experiment) is marked as incomplete, so the caller falls back to reading the files.
+        The means of every run are kept by run file as well, so a run that is rolled back can be discarded.
+    """
+
+    IGNORED_FILES = ('Aggregated.csv',)
+
+    def __init__(self):
+        self.subjects = {}
+        # directory -> {run file: means of the run}
+        self.runs = {}
+
+    def record(self, directory, run_file, values):
+        """ Adds the means of one run to the statistics of its subject directory.
+
+            Parameters
+            ----------
+            directory : str
+                Output directory of the subject.
+            run_file : str
+                Name of the file the run was written to, it is not counted as a pre-existing file.
+            values : dict
+                Mapping of metric name to the mean value of the run, None if the run could not be summarized.
+        """
+        key = op.normpath(directory)
+        if key not in self.subjects:
+            existing = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)) and
+                        f != run_file and f not in self.IGNORED_FILES] if os.path.isdir(directory) else []
+            self.subjects[key] = None if existing else RunningStats()
+            self.runs[key] = OrderedDict()
+        stats = self.subjects[key]
+        if stats is None:
+            return
+        if values is None:
+            self.subjects[key] = None
+            return
+        try:
+            stats.update(values)
+        except (TypeError, ValueError):
+            self.subjects[key] = None
+            return
+        self.runs[key][run_file] = values
+
+    def discard(self, directory, run_file):
+        """Removes the means of the run written to run_file, e.g. a rejected run, from the statistics of its subject"""
+        key = op.normpath(directory)
+        runs = self.runs.get(key)
+        if runs is None or runs.pop(run_file, None) is None or self.subjects[key] is None:
+            return
+        # The minimum and maximum cannot be taken back, so the statistics are rebuilt from the remaining runs
+        stats = RunningStats()
+        for values in runs.values():
+            stats.update(values)
+        self.subjects[key] = stats
+
+    def get(self, directory):
+        """Returns the RunningStats of a subject directory or None when the run files have to be read instead"""
+        return self.subjects.get(op.normpath(directory))
+
+    def means(self, directory, prefix=''):
+        """Returns the mean over the runs of every metric, sorted by (prefixed) name, or None if unknown"""
+        stats = self.get(directory)
+        if stats is None or not stats.metrics:
+            return None
+        return OrderedDict(sorted(((prefix + k, v) for k, v in stats.means().items()), key=lambda x: x[0]))
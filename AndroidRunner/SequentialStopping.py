@@ -0,0 +1,124 @@
+import csv
+import logging
+import os.path as op
+from collections import OrderedDict
+
+from . import Tests
+from .RunMetrics import RunMetrics
+from .RunningStats import RunningStats
+from .util import ConfigError
+
+
+class SequentialStopping(object):
+    """ Stops the runs of a subject as soon as the mean of a metric is known precisely enough.
+
+        After every finished run the confidence interval of the mean of metric over the runs of the subject is
+        updated. Once the subject had min_runs runs and the half-width of the interval is at most relative_width
+        of the mean, the remaining runs of the subject are skipped. repetitions is the maximum number of runs of a
+        subject.
+
+        metric is a metric the scripts record (kwargs['metrics']) or interaction_ms, the duration of the
+        interaction. The subjects that were stopped early are written to sequential_stopping.csv in the output
+        directory of the experiment.
+    """
+
+    FILENAME = 'sequential_stopping.csv'
+    DEFAULTS = OrderedDict([('metric', None), ('relative_width', 0.05), ('confidence', 0.95), ('min_runs', 5)])
+
+    def __init__(self, config, output_root):
+        """ Inits a SequentialStopping instance.
+
+            Parameters
+            ----------
+            config : dict
+                The 'sequential_stopping' configuration, see DEFAULTS for the keys, metric is required.
+            output_root : str
+                The output directory of the experiment.
+
+            Raises
+            ------
+            ConfigError
+                If a key is unknown or a value is invalid.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        unknown = [key for key in config if key not in self.DEFAULTS]
+        if unknown:
+            raise ConfigError('Unknown sequential_stopping option(s): %s' % ', '.join(unknown))
+        settings = OrderedDict(self.DEFAULTS)
+        settings.update(config)
+        if settings['metric'] is None:
+            raise ConfigError('sequential_stopping requires a metric')
+        self.metric = Tests.is_string(settings['metric'])
+        self.relative_width = settings['relative_width']
+        if isinstance(self.relative_width, bool) or not isinstance(self.relative_width, (int, float)) \
+                or self.relative_width <= 0:
+            raise ConfigError('sequential_stopping relative_width must be a positive number')
+        self.confidence = settings['confidence']
+        if isinstance(self.confidence, bool) or not isinstance(self.confidence, float) \
+                or not 0 < self.confidence < 1:
+            raise ConfigError('sequential_stopping confidence must be between 0 and 1')
+        self.min_runs = Tests.is_integer(settings['min_runs'], minimum=2)
+        self.experiment_file = op.join(output_root, self.FILENAME)
+        self.stats = {}
+        self.rows = []
+        if op.isfile(self.experiment_file):
+            with open(self.experiment_file, 'r', newline='') as f:
+                self.rows = list(csv.DictReader(f))
+
+    @staticmethod
+    def subject(run):
+        # Keys a run does not have are empty in the rows of run_metrics.csv
+        return tuple(str(run.get(key)) if run.get(key) not in (None, '') else None
+                     for key in ('device', 'path', 'browser', 'experimentArg'))
+
+    def value(self, interaction_ms, run_metrics):
+        """Returns the value of the metric of a run, None when the run did not record it"""
+        value = interaction_ms if self.metric == 'interaction_ms' else run_metrics.get(self.metric)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def load(self, rows):
+        """Adds the metric of runs of a previous session, rows are run_metrics.csv rows of finished runs"""
+        for row in rows:
+            value = self.value(row.get('interaction_ms'), row)
+            if value is not None:
+                self.stats.setdefault(self.subject(row), RunningStats()).update({self.metric: value})
+
+    def add(self, current_run, value):
+        """ Adds the metric of a finished run.
+
+            Returns
+            -------
+            bool
+                Whether the mean of the subject is precise enough and its remaining runs can be skipped.
+        """
+        if value is None:
+            self.logger.warning('Run %s did not record %s' % (current_run['runId'], self.metric))
+            return False
+        stats = self.stats.setdefault(self.subject(current_run), RunningStats())
+        stats.update({self.metric: value})
+        count, mean = stats.count(self.metric), stats.mean(self.metric)
+        if count < self.min_runs:
+            return False
+        half_width = stats.half_width(self.metric, self.confidence)
+        relative = half_width / abs(mean) if mean else float('inf')
+        self.logger.debug('%s: %s = %.4g +- %.4g after %s runs' % (current_run['path'], self.metric, mean, half_width,
+                                                                   count))
+        return relative <= self.relative_width
+
+    def record(self, current_run, skipped):
+        """Writes the subject that was stopped early to sequential_stopping.csv"""
+        stats = self.stats[self.subject(current_run)]
+        count, mean = stats.count(self.metric), stats.mean(self.metric)
+        half_width = stats.half_width(self.metric, self.confidence)
+        self.logger.info('%s: %s = %.4g +- %.4g (%s%%) after %s runs, skipping %s run(s)' %
+                         (current_run['path'], self.metric, mean, half_width, int(self.confidence * 100), count,
+                          skipped))
+        row = OrderedDict((key, current_run[key]) for key in ('device', 'path', 'browser', 'experimentArg')
+                          if current_run.get(key) is not None)
+        row.update([('metric', self.metric), ('runs', count), ('skipped', skipped),
+                    ('mean', mean), ('ci_half_width', half_width), ('confidence', self.confidence)])
+        self.rows.append(row)
+        RunMetrics.write_csv(self.experiment_file, self.rows)
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import os.path as op
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .util import makedirs
+
+MEASURED = 'measured'
+OVERHEAD = 'overhead'
+
+
+class Timeline(object):
+    """ Records the duration of every phase of the experiment (hooks, scripts, profiler calls, sleeps, aggregation)
+        as a trace that can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+        Phases are stamped with the monotonic host clock. The device uptime of a phase is derived from one reading
+        of /proc/uptime at the start of every run, so the timeline adds no adb round-trips to the phases it measures.
+        Phases of the category 'measured' (the interaction) are the time the profilers measure, all other time of a
+        run is overhead.
+
+        The phases of a run are written to timeline/<runId>.json in the output directory of the run when the run
+        ends. All phases together with a summary of measured versus overhead time are written once, to timeline.json
+        in the output directory of the experiment when it finishes. When the timeline is disabled phase() does
+        nothing.
+    """
+
+    FILENAME = 'timeline.json'
+
+    def __init__(self, output_root, enabled=True):
+        """ Inits a Timeline instance.
+
+            Parameters
+            ----------
+            output_root : str
+                The output directory of the experiment.
+            enabled : bool
+                Whether phases are recorded.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.enabled = enabled
+        self.experiment_file = op.join(output_root, self.FILENAME)
+        self.origin = time.monotonic()
+        self.events = []
+        self.runs = OrderedDict()
+        self.current_run = None
+        # Index of the first event of the current run in events
+        self.run_start = 0
+        self.device_offset = None
+        self._lock = threading.Lock()
+        self._pids = OrderedDict()
+        self._tids = OrderedDict()
+
+    def now(self):
+        """Returns the host time since the start of the timeline in microseconds"""
+        return (time.monotonic() - self.origin) * 1e6
+
+    def begin_run(self, current_run, device):
+        """Starts a run, reads the device uptime to map the host time of its phases to device time"""
+        if not self.enabled:
+            return
+        self.current_run = current_run
+        self.device_offset = None
+        try:
+            before = self.now()
+            uptime = float(device.shell('cat /proc/uptime').split()[0])
+            after = self.now()
+            self.device_offset = uptime - (before + after) / 2e6
+        except Exception as e:
+            self.logger.warning('%s: Cannot read the device uptime: %s' % (device.id, e))
+        with self._lock:
+            self.run_start = len(self.events)
+        self.runs[str(current_run['runId'])] = {'begin': self.now()}
+
+    def end_run(self, output_dir):
+        """ Ends the run and writes its timeline, only the events recorded since begin_run are looked at.
+
+            Returns
+            -------
+            str
+                Path of the timeline of the run, None when the timeline is disabled or no run was started.
+        """
+        if not self.enabled or self.current_run is None:
+            return None
+        run_id = str(self.current_run['runId'])
+        self.runs[run_id]['end'] = self.now()
+        self.current_run = None
+        with self._lock:
+            events = [event for event in self.events[self.run_start:] if event['args'].get('runId') == run_id]
+        run_file = op.join(output_dir, 'timeline', '%s.json' % run_id)
+        makedirs(op.dirname(run_file))
+        self.write_trace(run_file, events, self.run_summary(run_id, events))
+        return run_file
+
+    @contextmanager
+    def phase(self, name, category=OVERHEAD, **args):
+        """Records the execution of the with block as a phase of the current run, or of the experiment"""
+        if not self.enabled:
+            yield
+            return
+        begin = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, category, begin, self.now() - begin, args)
+
+    def add(self, name, category, begin, duration, args):
+        args = dict(args)
+        if self.current_run is not None:
+            args.setdefault('runId', str(self.current_run['runId']))
+            args.setdefault('device', self.current_run['device'])
+        if self.device_offset is not None:
+            args['device_uptime'] = round(self.device_offset + begin / 1e6, 6)
+        thread = threading.current_thread().name
+        with self._lock:
+            event = {'name': name, 'cat': category, 'ph': 'X', 'ts': round(begin, 1), 'dur': round(duration, 1),
+                     'pid': self._pids.setdefault(args.get('device', 'host'), len(self._pids) + 1),
+                     'tid': self._tids.setdefault(thread, len(self._tids) + 1),
+                     'args': args}
+            self.events.append(event)
+
+    def run_summary(self, run_id, events):
+        run = self.runs[run_id]
+        total = run['end'] - run['begin']
+        measured = sum(event['dur'] for event in events if event['cat'] == MEASURED)
+        total_ms, measured_ms = round(total / 1e3, 3), round(measured / 1e3, 3)
+        # The overhead is derived from the rounded times, so the three always add up
+        return OrderedDict([('runId', run_id), ('total_ms', total_ms), ('measured_ms', measured_ms),
+                            ('overhead_ms', round(total_ms - measured_ms, 3)),
+                            ('phases_ms', self.phase_totals(events))])
+
+    @staticmethod
+    def phase_totals(events):
+        totals = OrderedDict()
+        for event in events:
+            totals[event['name']] = totals.get(event['name'], 0) + event['dur']
+        return OrderedDict((name, round(total / 1e3, 3)) for name, total in totals.items())
+
+    def summary(self):
+        """ Returns the time since the start of the timeline split in measured and overhead time, and the time of
+            every phase.
+        """
+        with self._lock:
+            events = list(self.events)
+        total = self.now() / 1e3
+        measured = sum(event['dur'] for event in events if event['cat'] == MEASURED) / 1e3
+        runs = sum(1 for run in self.runs.values() if 'end' in run)
+        total_ms, measured_ms = round(total, 3), round(measured, 3)
+        return OrderedDict([('runs', runs), ('total_ms', total_ms), ('measured_ms', measured_ms),
+                            ('overhead_ms', round(total_ms - measured_ms, 3)),
+                            ('overhead_fraction', round((total - measured) / total, 4) if total else None),
+                            ('phases_ms', self.phase_totals(events))])
+
+    def save(self):
+        """Writes all phases and the summary to timeline.json of the experiment"""
+        if not self.enabled:
+            return
+        with self._lock:
+            events = list(self.events)
+        self.write_trace(self.experiment_file, events, self.summary())
+
+    def write_trace(self, filename, events, summary):
+        """Writes events in the Chrome trace event format, replacing filename atomically"""
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}}
+                    for name, pid in self._pids.items()]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                     for pid in self._pids.values() for name, tid in self._tids.items()]
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms', 'otherData': summary}, f, indent=1)
+        os.replace(tmp_file, filename)
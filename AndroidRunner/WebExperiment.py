@@ -12,7 +12,11 @@ from AndroidRunner.PrematureStoppableRun import PrematureStoppableRun
 class WebExperiment(Experiment):
     def __init__(self, config, progress, restart):
         super(WebExperiment, self).__init__(config, progress, restart)
+        # Restore a snapshot of the browser data taken at the start of the experiment instead of clearing it
+        self.browser_profile_snapshot = config.get('browser_profile_snapshot', False)
+        Tests.is_valid_option(self.browser_profile_snapshot, valid_options=[True, False])
         self.browsers = [BrowserFactory.get_browser(b)() for b in config.get('browsers', ['chrome'])]
+        self.configure_browsers()
         Tests.check_dependencies(self.devices, [b.package_name for b in self.browsers])
         self.duration = Tests.is_integer(config.get('duration', 0)) / 1000
         self.config = config
@@ -21,6 +25,11 @@ class WebExperiment(Experiment):
     def regenerate_browsers(self, device):
         # Regenerate browsers based on device version
         self.browsers = [BrowserFactory.get_browser(b)(device) for b in self.config.get('browsers', ['chrome'])]
+        self.configure_browsers()
+
+    def configure_browsers(self):
+        for browser in self.browsers:
+            browser.restore_snapshot = self.browser_profile_snapshot
 
     def run(self, device, path, run, browser_name):
         browser = None
@@ -31,28 +40,36 @@ class WebExperiment(Experiment):
             'browser': browser,
             'app': browser.package_name
         }
-        self.before_run(device, path, run, **kwargs)
-        self.after_launch(device, path, run, **kwargs)
+        with self.timeline.phase('before_run'):
+            self.before_run(device, path, run, **kwargs)
+        with self.timeline.phase('after_launch'):
+            self.after_launch(device, path, run, **kwargs)
 
         self.usb_handler.disable_usb()
-        self.start_profiling(device, path, run, **kwargs)
-
-        if self.run_stopping_condition_config:
-            self.queue = mp.Queue()
-            premature_stoppable_run = PrematureStoppableRun(self.run_stopping_condition_config, self.queue, self.interaction, device, path, run, **kwargs)
-            premature_stoppable_run.run()
-        else:
-            self.interaction(device, path, run, **kwargs)
-
-        self.stop_profiling(device, path, run, **kwargs)
+        with self.timeline.phase('start_profiling'):
+            self.start_profiling(device, path, run, **kwargs)
+
+        with self.interaction_phase():
+            if self.run_stopping_condition_config:
+                self.queue = mp.Queue()
+                premature_stoppable_run = PrematureStoppableRun(self.run_stopping_condition_config, self.queue, self.interaction, device, path, run, **kwargs)
+                premature_stoppable_run.run()
+            else:
+                self.interaction(device, path, run, **kwargs)
+
+        with self.timeline.phase('stop_profiling'):
+            self.stop_profiling(device, path, run, **kwargs)
         self.usb_handler.enable_usb()
 
-        self.before_close(device, path, run, **kwargs)
-        self.after_run(device, path, run, **kwargs)
+        with self.timeline.phase('before_close'):
+            self.before_close(device, path, run, **kwargs)
+        with self.timeline.phase('after_run'):
+            self.after_run(device, path, run, **kwargs)
 
     def last_run_subject(self, current_run):
         if self.progress.subject_finished(current_run['device'], current_run['path'], current_run['browser']):
             self.after_last_run(self.devices.get_device(current_run['device']), current_run['path'])
+            self.leave_subject()
             self.aggregate_subject()
 
     def prepare_output_dir(self, current_run):
@@ -68,12 +85,16 @@ class WebExperiment(Experiment):
     def before_run(self, device, path, run, *args, **kwargs):
         super(WebExperiment, self).before_run(device, path, run, *args, **kwargs)
         device.shell('logcat -c')
-        kwargs['browser'].start(device)
+        with self.timeline.phase('browser_start'):
+            kwargs['browser'].start(device)
         time.sleep(5)
 
     def before_experiment(self, device, *args, **kwargs):
         super().before_experiment(self, device, *args, **kwargs)
         self.regenerate_browsers(device)
+        if self.browser_profile_snapshot:
+            for browser in self.browsers:
+                browser.take_snapshot(device)
 
     def interaction(self, device, path, run, *args, **kwargs):
         kwargs['browser'].load_url(device, path)
@@ -83,7 +104,8 @@ class WebExperiment(Experiment):
         time.sleep(self.duration)
 
     def after_run(self, device, path, run, *args, **kwargs):
-        kwargs['browser'].stop(device, self.clear_cache)
+        with self.timeline.phase('browser_stop'):
+            kwargs['browser'].stop(device, self.clear_cache)
         time.sleep(3)
         super(WebExperiment, self).after_run(device, path, run, *args, **kwargs)
 
@@ -94,3 +116,5 @@ class WebExperiment(Experiment):
         super(WebExperiment, self).cleanup(device)
         for browser in self.browsers:
             browser.stop(device, clear_data=True)
+            if self.browser_profile_snapshot:
+                browser.delete_snapshot(device)
@@ -0,0 +1,70 @@
+import paths
+from AndroidRunner.Device import Device
+from Experiment_OnDevice.Scripts.llm_runner import LLMRunner, LLMServer, load_llm_config, write_token_times
+from Experiment_OnDevice.Scripts.prompt_schedule import PromptSchedule, load_prompts
+
+
+def load_schedule():
+    """Returns the llm config of the experiment and the prompt schedule built from it"""
+    llm_config = load_llm_config()
+    return llm_config, PromptSchedule(load_prompts(llm_config['prompt_file'], llm_config['big_prompt_words']),
+                                      strategy=llm_config['schedule'], seed=llm_config['seed'])
+
+
+# Loaded once when the experiment loads its scripts, every run executes main in a fork of that process
+config, schedule = load_schedule() if paths.ORIGINAL_CONFIG_DIR is not None else (None, None)
+
+
+def main(device: Device, *args: tuple, **kwargs: dict):
+    current_run_data = kwargs.get("current_run")
+    run_id = current_run_data.get("runId")
+
+    # experiment_args that name a prompt category make the category a factor of the experiment
+    stratum = current_run_data.get("experimentArg")
+    selected = schedule.prompt(current_run_data.get("runCount"),
+                               stratum if stratum in schedule.strata else None)
+    prompt = selected.text
+    prompt_words = selected.words
+    prompt_size_category = selected.category
+    input_size_kb = len(prompt.encode("utf-8")) / 1024.0
+
+    server_info = {}
+    if config['mode'] == 'warm':
+        server = LLMServer(config, device_id=device.id)
+        result = server.complete(prompt)
+        server_info = server.run_info()
+    else:
+        runner = LLMRunner(config, device_id=device.id)
+        result = runner.run(prompt)
+
+    output_text = result.text.strip()
+    output_size_kb = len(output_text.encode("utf-8")) / 1024.0
+    if not result.marker_found:
+        print("Warning: end marker not received, the run timed out or adb disconnected")
+
+    timings = result.timings
+    print(f"Process exited with code {result.return_code}")
+    print(f"Input size: {input_size_kb:.6f} KB, Prompt size: {prompt_words} words, "
+          f"Execution Time: {result.duration:.2f}s, TTFT: {result.time_to_first_token}, "
+          f"Output size: {output_size_kb:.2f} KB")
+    print(f"Load: {timings['load_ms']} ms, Prefill: {timings['prefill_ms']} ms, "
+          f"Decode: {timings['decode_tokens_per_sec']} tokens/s, Peak RSS: {timings['peak_rss_kb']} KiB")
+
+    run_data = {
+        "prompt_id": selected.id,
+        "input_size_kb": input_size_kb,
+        "output_size_kb": output_size_kb,
+        "prompt_size": prompt_size_category,
+        "model": config['model_name'],
+        "mode": config['mode'],
+        "api": "no",
+        "mobile": "yes"
+    }
+    run_data.update(server_info)
+    run_data.update(result.as_dict())
+
+    # Written by AndroidRunner to run_metrics/<run id>.csv and to run_metrics.csv of the experiment
+    kwargs["metrics"].update(run_data)
+
+    # Arrival time of every streamed chunk, next to the profiler output of this run
+    write_token_times(paths.OUTPUT_DIR, run_id, result)
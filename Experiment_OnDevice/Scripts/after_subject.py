@@ -0,0 +1,10 @@
+from AndroidRunner.Device import Device
+from Experiment_OnDevice.Scripts.llm_runner import LLMServer, load_llm_config
+
+
+# noinspection PyUnusedLocal
+def main(device: Device, *args: tuple, **kwargs: dict):
+    config = load_llm_config()
+    if config['mode'] != 'warm':
+        return
+    LLMServer(config, device_id=device.id).stop()
@@ -0,0 +1,11 @@
+from AndroidRunner.Device import Device
+from Experiment_OnDevice.Scripts.llm_runner import LLMServer, load_llm_config
+
+
+# noinspection PyUnusedLocal
+def main(device: Device, *args: tuple, **kwargs: dict):
+    config = load_llm_config()
+    if config['mode'] != 'warm':
+        return
+    startup_sec = LLMServer(config, device_id=device.id).start()
+    print(f"llama-server loaded {config['model_name']} in {startup_sec:.2f}s")
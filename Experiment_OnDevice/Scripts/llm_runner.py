@@ -0,0 +1,544 @@
+"""Runs llama.cpp inference on an Android device over adb and streams the generated text back.
+
+The generated text is read from a pseudo terminal with select() and large non-blocking reads, every chunk is
+timestamped on arrival. The end of the run is detected with a rolling search for the end marker, so a marker
+that is split over two reads is still found. Nothing is echoed to the host terminal unless asked for.
+The marker carries the exit status of llama-cli, after it the device sends the stderr of llama-cli, whose timing
+report is parsed into per-run metrics.
+
+In warm mode the model is loaded once per subject by llama-server, which listens on a device-local port that is
+forwarded with adb forward, and every run sends its prompt over HTTP. Cold start (server start-up and the first
+request) and steady-state throughput are then recorded as separate metrics.
+"""
+import codecs
+import csv
+import http.client
+import json
+import os
+import os.path as op
+import pty
+import re
+import select
+import subprocess
+import sys
+import time
+
+import paths
+
+DEFAULT_CONFIG = {
+    'adb': 'adb',
+    'workdir': '/data/local/tmp',
+    'binary': '/data/local/tmp/llama-cli',
+    'model': None,
+    'model_name': None,
+    'context': 2048,
+    'n_predict': 800,
+    'extra_args': '',
+    'prompt_file': 'Prompts.txt',
+    # Assignment of prompts to runs, see prompt_schedule.py
+    'schedule': 'stratified',
+    'seed': 0,
+    'big_prompt_words': 50,
+    'marker': 'RUN_DONE',
+    'timeout': 600,
+    'echo': False,
+    # Wrap llama-cli in 'toybox time -v' to measure the peak resident set size
+    'peak_rss': True,
+    # 'cold' starts llama-cli for every run, 'warm' sends the prompts to a llama-server started once per subject
+    'mode': 'cold',
+    'server_binary': '/data/local/tmp/llama-server',
+    'port': 8080,
+    'server_args': '',
+    'server_timeout': 300,
+}
+MODES = ('cold', 'warm')
+
+# llama_perf_context_print (current llama.cpp) and llama_print_timings (older versions)
+TIMING_PATTERNS = {
+    'load': re.compile(r'load time\s*=\s*([\d.]+) ms'),
+    'prompt_eval': re.compile(r'prompt eval time\s*=\s*([\d.]+) ms\s*/\s*(\d+) (?:tokens|runs)'),
+    'eval': re.compile(r'(?<!prompt )eval time\s*=\s*([\d.]+) ms\s*/\s*(\d+) (?:tokens|runs)'),
+    'total': re.compile(r'total time\s*=\s*([\d.]+) ms'),
+}
+# toybox 'time -v' and GNU time
+PEAK_RSS_PATTERN = re.compile(r'(?:Max RSS \(KiB\)|Maximum resident set size \(kbytes\)):\s*(\d+)')
+# The exit status of llama-cli, printed right after the end marker
+EXIT_STATUS_PATTERN = re.compile(r' *(-?\d+)\r?\n?')
+
+
+def parse_timings(report):
+    """ Parses the timing report llama-cli prints on exit and the peak RSS printed by 'time -v'.
+
+        Returns
+        -------
+        dict
+            load_ms, prefill_ms, prompt_tokens, prefill_tokens_per_sec, decode_ms, decode_tokens,
+            decode_ms_per_token, decode_tokens_per_sec, total_ms and peak_rss_kb, None when not reported.
+    """
+    timings = dict.fromkeys(['load_ms', 'prefill_ms', 'prompt_tokens', 'prefill_tokens_per_sec', 'decode_ms',
+                             'decode_tokens', 'decode_ms_per_token', 'decode_tokens_per_sec', 'total_ms',
+                             'peak_rss_kb'])
+    match = TIMING_PATTERNS['load'].search(report)
+    if match:
+        timings['load_ms'] = float(match.group(1))
+    match = TIMING_PATTERNS['prompt_eval'].search(report)
+    if match:
+        timings['prefill_ms'] = float(match.group(1))
+        timings['prompt_tokens'] = int(match.group(2))
+        if timings['prefill_ms'] > 0:
+            timings['prefill_tokens_per_sec'] = timings['prompt_tokens'] / timings['prefill_ms'] * 1000
+    match = TIMING_PATTERNS['eval'].search(report)
+    if match:
+        timings['decode_ms'] = float(match.group(1))
+        timings['decode_tokens'] = int(match.group(2))
+        if timings['decode_tokens'] > 0:
+            timings['decode_ms_per_token'] = timings['decode_ms'] / timings['decode_tokens']
+        if timings['decode_ms'] > 0:
+            timings['decode_tokens_per_sec'] = timings['decode_tokens'] / timings['decode_ms'] * 1000
+    match = TIMING_PATTERNS['total'].search(report)
+    if match:
+        timings['total_ms'] = float(match.group(1))
+    match = PEAK_RSS_PATTERN.search(report)
+    if match:
+        timings['peak_rss_kb'] = int(match.group(1))
+    return timings
+
+
+def parse_server_timings(server_timings):
+    """ Converts the timings llama-server returns with the last chunk of a completion to the keys of parse_timings.
+
+        The model is already loaded, so load_ms stays None.
+    """
+    timings = parse_timings('')
+    timings['prefill_ms'] = server_timings.get('prompt_ms')
+    timings['prompt_tokens'] = server_timings.get('prompt_n')
+    timings['prefill_tokens_per_sec'] = server_timings.get('prompt_per_second')
+    timings['decode_ms'] = server_timings.get('predicted_ms')
+    timings['decode_tokens'] = server_timings.get('predicted_n')
+    timings['decode_ms_per_token'] = server_timings.get('predicted_per_token_ms')
+    timings['decode_tokens_per_sec'] = server_timings.get('predicted_per_second')
+    if timings['prefill_ms'] is not None and timings['decode_ms'] is not None:
+        timings['total_ms'] = timings['prefill_ms'] + timings['decode_ms']
+    return timings
+
+
+def load_llm_config(config_file=None):
+    """ Returns the "llm" section of the experiment config merged with the defaults.
+
+        Parameters
+        ----------
+        config_file : str
+            Path of the experiment config, the config the experiment was started with by default.
+    """
+    config_file = config_file or paths.ORIGINAL_CONFIG_DIR
+    with open(config_file, 'r') as f:
+        section = json.load(f).get('llm', {})
+    config = dict(DEFAULT_CONFIG, **section)
+    if not config['model']:
+        raise ValueError('"llm.model" is required in %s' % config_file)
+    if config['mode'] not in MODES:
+        raise ValueError('"llm.mode" must be one of %s in %s' % (', '.join(MODES), config_file))
+    if not config['model_name']:
+        config['model_name'] = op.splitext(op.basename(config['model']))[0]
+    if not op.isabs(config['prompt_file']):
+        config['prompt_file'] = op.join(op.dirname(op.abspath(config_file)), config['prompt_file'])
+    return config
+
+
+def shell_quote(text):
+    """Quotes text for the device shell"""
+    return "'" + text.replace("'", "'\\''") + "'"
+
+
+class MarkerSearch(object):
+    """Finds a marker in a stream of chunks, also when the marker is split over two chunks"""
+
+    def __init__(self, marker):
+        self.marker = marker.encode('utf-8')
+        self.tail = b''
+        self.found = False
+        # Bytes of the marker that were already returned before the marker was complete
+        self.leaked = 0
+        # Bytes that came after the marker in the chunk that completed it
+        self.after = b''
+
+    def feed(self, chunk):
+        """ Feeds the next chunk, returns the part of the chunk that comes before the marker.
+
+            Once the marker has been found nothing is returned anymore.
+        """
+        if self.found:
+            return b''
+        window = self.tail + chunk
+        index = window.find(self.marker)
+        if index != -1:
+            self.found = True
+            self.after = window[index + len(self.marker):]
+            if index >= len(self.tail):
+                return window[len(self.tail):index]
+            self.leaked = len(self.tail) - index
+            return b''
+        self.tail = window[-(len(self.marker) - 1):] if len(self.marker) > 1 else b''
+        return chunk
+
+
+class LLMRunResult(object):
+    """The output and timing of one inference run"""
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.start_time = None
+        self.end_time = None
+        self.first_token_time = None
+        # (seconds since start, text) of every chunk of generated text
+        self.chunks = []
+        self.return_code = None
+        self.marker_found = False
+        # Everything the device sent after the end marker (the stderr of llama-cli)
+        self.report = ''
+        self.timings = parse_timings('')
+
+    @property
+    def text(self):
+        return ''.join(text for _, text in self.chunks)
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_time is None:
+            return None
+        return self.first_token_time - self.start_time
+
+    @property
+    def streamed_tokens_per_sec(self):
+        """Chunks per second after the first one, llama.cpp flushes its output once per token"""
+        if len(self.chunks) < 2:
+            return None
+        elapsed = self.chunks[-1][0] - self.chunks[0][0]
+        return (len(self.chunks) - 1) / elapsed if elapsed > 0 else None
+
+    def as_dict(self):
+        metrics = {
+            'execution_time_sec': self.duration,
+            'time_to_first_token_sec': self.time_to_first_token,
+            'streamed_chunks': len(self.chunks),
+            'streamed_tokens_per_sec': self.streamed_tokens_per_sec,
+            'return_code': self.return_code,
+        }
+        metrics.update(self.timings)
+        return metrics
+
+
+def write_token_times(output_dir, run_id, result):
+    """ Writes the arrival time of every streamed chunk of a run to <output_dir>/llm/tokens_<run_id>.csv.
+
+        The run metrics themselves are recorded through kwargs['metrics'] of the interaction script, the token
+        times allow deriving decode throughput over time and energy per token.
+
+        Returns
+        -------
+        str
+            Path of the written file.
+    """
+    llm_dir = op.join(output_dir, 'llm')
+    os.makedirs(llm_dir, exist_ok=True)
+    tokens_file = op.join(llm_dir, 'tokens_{}.csv'.format(run_id))
+    with open(tokens_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['elapsed_sec', 'chars'])
+        for elapsed, text in result.chunks:
+            writer.writerow([elapsed, len(text)])
+    return tokens_file
+
+
+class LLMRunner(object):
+    """Runs prompts with llama-cli on a device and streams the generated text"""
+
+    READ_SIZE = 65536
+
+    def __init__(self, config, device_id=None):
+        """ Inits a LLMRunner instance.
+
+            Parameters
+            ----------
+            config : dict
+                The llm config as returned by load_llm_config.
+            device_id : str
+                Serial of the device, adb picks the only connected device when None.
+        """
+        self.config = config
+        self.device_id = device_id
+
+    def adb_command(self, *args):
+        command = [self.config['adb']]
+        if self.device_id:
+            command += ['-s', self.device_id]
+        return command + list(args)
+
+    def device_command(self, prompt):
+        """ Returns the shell command that generates the completion of prompt on the device.
+
+            stderr (logs, timing report and the output of 'time -v') goes to a file on the device that is sent
+            after the end marker, so it does not interleave with the streamed tokens. The marker is followed by the
+            exit status of llama-cli, the exit status of adb shell is the one of the last command.
+        """
+        config = self.config
+        log_file = op.join(config['workdir'], 'llm_stderr.txt')
+        return ('cd {workdir} && LD_LIBRARY_PATH={workdir} {time}{binary} -m {model} -c {context} -no-cnv '
+                '--n-predict {n_predict} --no-display-prompt {extra_args} --prompt {prompt} 2>{log}; '
+                'echo {marker} $?; cat {log}; rm -f {log}').format(
+            workdir=config['workdir'], time='toybox time -v ' if config['peak_rss'] else '', binary=config['binary'],
+            model=config['model'], context=config['context'], n_predict=config['n_predict'],
+            extra_args=config['extra_args'], prompt=shell_quote(prompt), log=log_file, marker=config['marker'])
+
+    def run(self, prompt):
+        """ Generates the completion of prompt and returns a LLMRunResult."""
+        return self.stream(self.adb_command('shell', self.device_command(prompt)), LLMRunResult(prompt))
+
+    def stream(self, command, result):
+        """Executes command on a pseudo terminal and collects the timestamped output in result"""
+        marker = MarkerSearch(self.config['marker'])
+        exit_status = None
+        deadline = None
+        master_fd, slave_fd = pty.openpty()
+        result.start_time = time.monotonic()
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=slave_fd, stderr=slave_fd,
+                                   close_fds=True)
+        os.close(slave_fd)
+        if self.config['timeout']:
+            deadline = result.start_time + self.config['timeout']
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        try:
+            while not marker.found:
+                chunk = self.read(master_fd, deadline)
+                if not chunk:
+                    break
+                now = time.monotonic()
+                text = decoder.decode(marker.feed(chunk))
+                if text.strip():
+                    if result.first_token_time is None:
+                        result.first_token_time = now
+                    result.chunks.append((now - result.start_time, text))
+                    if self.config['echo']:
+                        sys.stdout.write(text)
+                        sys.stdout.flush()
+            result.end_time = time.monotonic()
+            # The timing report is not part of the measured run
+            report = [marker.after]
+            while marker.found:
+                chunk = self.read(master_fd, deadline)
+                if not chunk:
+                    break
+                report.append(chunk)
+            result.report = b''.join(report).decode('utf-8', errors='ignore')
+            match = EXIT_STATUS_PATTERN.match(result.report) if marker.found else None
+            if match:
+                exit_status = int(match.group(1))
+                result.report = result.report[match.end():]
+            result.timings = parse_timings(result.report)
+        finally:
+            if result.end_time is None:
+                result.end_time = time.monotonic()
+            os.close(master_fd)
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        result.return_code = exit_status if exit_status is not None else process.returncode
+        result.marker_found = marker.found
+        self.trim_chunks(result.chunks, marker.leaked)
+        return result
+
+    def read(self, fd, deadline):
+        """Returns the next chunk of output, b'' at the end of the output or when the deadline passed"""
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        readable, _, _ = select.select([fd], [], [], timeout)
+        if not readable:
+            return b''
+        try:
+            return os.read(fd, self.READ_SIZE)
+        except OSError:
+            # EIO: the process closed the terminal
+            return b''
+
+    @staticmethod
+    def trim_chunks(chunks, count):
+        """Removes the last count characters (the start of the end marker) from the collected chunks"""
+        while count > 0 and chunks:
+            elapsed, text = chunks[-1]
+            if len(text) > count:
+                chunks[-1] = (elapsed, text[:-count])
+                return
+            count -= len(text)
+            chunks.pop()
+
+
+class LLMServer(object):
+    """ Keeps llama-server running on a device for the runs of a subject and sends prompts to it over HTTP.
+
+        The scripts of an experiment run in separate processes, so the server state (pid, port, start-up time and
+        number of served requests) is kept in <output_dir>/llm/server.json, where the next script picks it up.
+    """
+
+    STATE_FILE = 'server.json'
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, config, device_id=None, output_dir=None):
+        """ Inits a LLMServer instance.
+
+            Parameters
+            ----------
+            config : dict
+                The llm config as returned by load_llm_config.
+            device_id : str
+                Serial of the device, adb picks the only connected device when None.
+            output_dir : str
+                Output directory of the subject, the state file is kept below it.
+        """
+        self.config = config
+        self.runner = LLMRunner(config, device_id)
+        self.state_file = op.join(output_dir or paths.OUTPUT_DIR, 'llm', self.STATE_FILE)
+        self.state = {}
+        if op.isfile(self.state_file):
+            with open(self.state_file, 'r') as f:
+                self.state = json.load(f)
+
+    @property
+    def running(self):
+        return bool(self.state.get('pid')) and not self.state.get('stopped')
+
+    def save_state(self):
+        os.makedirs(op.dirname(self.state_file), exist_ok=True)
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.state_file)
+
+    def adb(self, *args, timeout=60):
+        return subprocess.run(self.runner.adb_command(*args), stdin=subprocess.DEVNULL, capture_output=True,
+                              text=True, timeout=timeout, check=False)
+
+    def start_command(self):
+        """Returns the shell command that starts llama-server in the background on the device and prints its pid"""
+        config = self.config
+        return ('cd {workdir} && LD_LIBRARY_PATH={workdir} nohup {binary} -m {model} -c {context} '
+                '--host 127.0.0.1 --port {port} {server_args} >{log} 2>&1 </dev/null & echo $!').format(
+            workdir=config['workdir'], binary=config['server_binary'], model=config['model'],
+            context=config['context'], port=config['port'], server_args=config['server_args'],
+            log=op.join(config['workdir'], 'llama_server.log'))
+
+    def start(self):
+        """ Starts llama-server, forwards its port and waits until the model is loaded.
+
+            Returns
+            -------
+            float
+                Seconds from starting the server until it accepted requests (the cold start of the model).
+        """
+        if self.running:
+            self.stop()
+        port = self.config['port']
+        start_time = time.monotonic()
+        output = self.adb('shell', self.start_command()).stdout.split()
+        if not output or not output[-1].isdigit():
+            raise RuntimeError('llama-server did not start: %s' % ' '.join(output))
+        self.state = {'pid': int(output[-1]), 'port': port, 'requests': 0, 'start_time': time.time()}
+        self.save_state()
+        self.adb('forward', 'tcp:%s' % port, 'tcp:%s' % port)
+        self.wait_until_ready(start_time + self.config['server_timeout'])
+        self.state['startup_sec'] = time.monotonic() - start_time
+        self.save_state()
+        return self.state['startup_sec']
+
+    def wait_until_ready(self, deadline):
+        """Polls /health until the server reports the model is loaded (it answers 503 while loading)"""
+        while True:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', self.state['port'], timeout=5)
+                connection.request('GET', '/health')
+                status = connection.getresponse().status
+                connection.close()
+                if status == 200:
+                    return
+            except (OSError, http.client.HTTPException):
+                pass
+            if time.monotonic() > deadline:
+                log = self.adb('shell', 'tail -n 20 %s' % op.join(self.config['workdir'], 'llama_server.log'))
+                self.stop()
+                raise RuntimeError('llama-server was not ready within %ss:\n%s' % (self.config['server_timeout'],
+                                                                                    log.stdout))
+            time.sleep(self.POLL_INTERVAL)
+
+    def complete(self, prompt):
+        """ Streams the completion of prompt from the server and returns a LLMRunResult.
+
+            The prompt cache is disabled so a repeated prompt is evaluated again, like it is in cold mode.
+        """
+        if not self.running:
+            raise RuntimeError('llama-server is not running, add Scripts/before_subject.py to the "before_subject" '
+                               'scripts of the config')
+        config = self.config
+        result = LLMRunResult(prompt)
+        body = json.dumps({'prompt': prompt, 'n_predict': config['n_predict'], 'stream': True,
+                           'cache_prompt': False})
+        connection = http.client.HTTPConnection('127.0.0.1', self.state['port'], timeout=config['timeout'] or None)
+        result.start_time = time.monotonic()
+        try:
+            connection.request('POST', '/completion', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            result.return_code = response.status
+            for line in response:
+                if not line.startswith(b'data: '):
+                    continue
+                now = time.monotonic()
+                data = json.loads(line[len(b'data: '):])
+                text = data.get('content', '')
+                if text:
+                    if result.first_token_time is None:
+                        result.first_token_time = now
+                    result.chunks.append((now - result.start_time, text))
+                    if config['echo']:
+                        sys.stdout.write(text)
+                        sys.stdout.flush()
+                if data.get('stop'):
+                    result.marker_found = True
+                    result.report = json.dumps(data.get('timings', {}))
+                    result.timings = parse_server_timings(data.get('timings', {}))
+                    break
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            sys.stderr.write('Request to llama-server failed: %s\n' % e)
+        finally:
+            result.end_time = time.monotonic()
+            connection.close()
+        if config['peak_rss']:
+            result.timings['peak_rss_kb'] = self.peak_rss()
+        self.state['requests'] += 1
+        self.save_state()
+        return result
+
+    def peak_rss(self):
+        """Returns the peak RSS (VmHWM) of the server since it started, in KiB"""
+        output = self.adb('shell', 'cat /proc/%s/status' % self.state['pid']).stdout
+        match = re.search(r'VmHWM:\s*(\d+) kB', output)
+        return int(match.group(1)) if match else None
+
+    def run_info(self):
+        """ Returns the server metrics of the request that was sent last.
+
+            server_request is 1 for the first request after the model was loaded, later requests are steady state.
+        """
+        return {'server_startup_sec': self.state.get('startup_sec'), 'server_request': self.state.get('requests')}
+
+    def stop(self):
+        """Stops the server and removes the port forward"""
+        if not self.state.get('pid'):
+            return
+        self.adb('shell', 'kill %s' % self.state['pid'])
+        self.adb('forward', '--remove', 'tcp:%s' % self.state['port'])
+        self.state['stopped'] = True
+        self.state['stop_time'] = time.time()
+        self.save_state()
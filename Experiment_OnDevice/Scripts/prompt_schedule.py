@@ -0,0 +1,84 @@
+"""Assigns the prompts of Prompts.txt to the runs of an experiment, reproducibly for a given seed.
+
+The prompts are split in strata by size (small/big). The prompt of a run only depends on the seed, the stratum and
+the run count of the subject (which Progress keeps across restarts), so a resumed or repeated experiment gets the
+same prompts, and every model gets the same prompt for the same run.
+
+- stratified: the strata take turns and every prompt of a stratum is used once before any prompt is used again.
+- latin_square: like stratified, but each pass over a stratum is a rotation of the first pass, so over as many passes
+  as there are prompts every prompt takes every position once (balancing drift over the course of a subject).
+- random: an independent seeded choice per run.
+
+When the experiment_args of the config are stratum names (e.g. ["small", "big"]) each argument is a separate
+subject that only gets prompts of its stratum.
+"""
+import random
+from collections import OrderedDict, namedtuple
+
+STRATEGIES = ('stratified', 'latin_square', 'random')
+
+Prompt = namedtuple('Prompt', ['id', 'text', 'words', 'category'])
+
+
+def load_prompts(filepath, big_prompt_words=50):
+    """ Reads one prompt per non-empty line, the id of a prompt is its line number.
+
+        Prompts of more than big_prompt_words words are in the 'big' category, the others in 'small'.
+    """
+    prompts = []
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            text = line.strip()
+            if not text:
+                continue
+            words = len(text.split())
+            prompts.append(Prompt(line_number, text, words, 'big' if words > big_prompt_words else 'small'))
+    if not prompts:
+        raise ValueError('No prompts in %s' % filepath)
+    return prompts
+
+
+class PromptSchedule(object):
+    """Maps (stratum, run count) to a prompt"""
+
+    def __init__(self, prompts, strategy='stratified', seed=0):
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown prompt schedule "%s", expected one of %s' % (strategy, ', '.join(STRATEGIES)))
+        self.strategy = strategy
+        self.seed = seed
+        self.strata = OrderedDict()
+        for prompt in prompts:
+            self.strata.setdefault(prompt.category, []).append(prompt)
+        self.strata = OrderedDict(sorted(self.strata.items()))
+
+    def order(self, stratum, block):
+        """Returns the order in which the prompts of stratum are used in pass block over the stratum"""
+        prompts = list(self.strata[stratum])
+        if self.strategy == 'latin_square':
+            random.Random('%s:%s' % (self.seed, stratum)).shuffle(prompts)
+            shift = block % len(prompts)
+            return prompts[shift:] + prompts[:shift]
+        random.Random('%s:%s:%s' % (self.seed, stratum, block)).shuffle(prompts)
+        return prompts
+
+    def prompt(self, run_count, stratum=None):
+        """ Returns the Prompt of a run.
+
+            Parameters
+            ----------
+            run_count : int
+                Number of the run within its subject, starting at 1.
+            stratum : str
+                Only use prompts of this category, the strata take turns when None.
+        """
+        index = int(run_count) - 1
+        if stratum is None:
+            categories = list(self.strata.keys())
+            stratum = categories[index % len(categories)]
+            index //= len(categories)
+        elif stratum not in self.strata:
+            raise ValueError('No prompts in stratum "%s"' % stratum)
+        if self.strategy == 'random':
+            return random.Random('%s:%s:%s' % (self.seed, stratum, run_count)).choice(self.strata[stratum])
+        block, position = divmod(index, len(self.strata[stratum]))
+        return self.order(stratum, block)[position]
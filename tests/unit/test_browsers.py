@@ -1,6 +1,7 @@
 import pytest
 from mock import Mock, patch
 
+from AndroidRunner.Adb import AdbError
 from AndroidRunner.BrowserFactory import BrowserFactory
 from AndroidRunner.Browsers import Browser, Chrome, Firefox, Opera
 
@@ -86,11 +87,76 @@ class TestBrowsers(object):
     def test_stop_clear_data(self, mock, browser):
         mock_device = Mock()
         mock_device.id = "fake_device"
+        mock_device.shell.return_value = 'Success'
         browser.stop(mock_device, True)
-        mock.assert_called_once_with('fake_device: Stop')
-        mock_device.force_stop.assert_called_once_with(browser.package_name)
-        mock_device.clear_app_data.assert_called_once_with(browser.package_name)
-        assert mock_device.clear_app_data.call_count == 1
+        mock.assert_any_call('fake_device: Stop')
+        mock_device.shell.assert_called_once_with('am force-stop com.example; pm clear com.example')
+        assert mock_device.force_stop.call_count == 0
+        assert mock_device.clear_app_data.call_count == 0
+
+    def test_stop_clear_data_twice(self, browser):
+        mock_device = Mock()
+        mock_device.id = "fake_device"
+        mock_device.shell.return_value = 'Success'
+        browser.stop(mock_device, True)
+        browser.stop(mock_device, True)
+
+        assert mock_device.shell.call_count == 1
+
+        mock_device.get_version.return_value = "10"
+        browser.start(mock_device)
+        browser.stop(mock_device, True)
+
+        assert mock_device.shell.call_count == 2
+
+    def test_stop_clear_data_per_device(self, browser):
+        first_device, second_device = Mock(), Mock()
+        first_device.id, second_device.id = 'first', 'second'
+        first_device.shell.return_value = second_device.shell.return_value = 'Success'
+        browser.stop(first_device, True)
+        browser.stop(second_device, True)
+
+        assert first_device.shell.call_count == 1
+        assert second_device.shell.call_count == 1
+
+    def test_stop_clear_data_fail(self, browser):
+        mock_device = Mock()
+        mock_device.id = "fake_device"
+        mock_device.shell.return_value = 'Failed'
+        with pytest.raises(AdbError):
+            browser.stop(mock_device, True)
+        with pytest.raises(AdbError):
+            browser.stop(mock_device, True)
+        assert mock_device.shell.call_count == 2
+
+    def test_reset_command_restore_snapshot(self, browser):
+        browser.restore_snapshot = True
+        command = browser.reset_command()
+
+        assert command.startswith('am force-stop com.example; if [ -f /data/local/tmp/android-runner/com.example.tar ]')
+        assert "run-as com.example sh -c" in command
+        assert "tar -xf -' < /data/local/tmp/android-runner/com.example.tar && echo Success" in command
+        assert command.endswith('else pm clear com.example; fi')
+
+    def test_take_snapshot(self, browser):
+        mock_device = Mock()
+        mock_device.id = "fake_device"
+        mock_device.shell.return_value = 'Success'
+        browser.take_snapshot(mock_device)
+
+        command = mock_device.shell.call_args[0][0]
+        assert 'run-as com.example tar -cf - --exclude=./lib . > /data/local/tmp/android-runner/com.example.tar' \
+            in command
+        browser.stop(mock_device, True)
+        assert mock_device.shell.call_count == 1
+
+    def test_take_snapshot_fail(self, browser):
+        mock_device = Mock()
+        mock_device.id = "fake_device"
+        mock_device.shell.return_value = 'run-as: package not debuggable: com.example'
+        with pytest.raises(AdbError):
+            browser.take_snapshot(mock_device)
+        mock_device.shell.assert_called_with('rm -f /data/local/tmp/android-runner/com.example.tar')
 
     @patch('logging.Logger.info')
     def test_stop(self, mock, browser):
@@ -1,11 +1,22 @@
+import io
+import json
 import os
+import struct
+import threading
+import time
+import zipfile
 
 import pytest
 from mock import MagicMock, Mock, call, patch
 
 import AndroidRunner.Adb as Adb
+from AndroidRunner.AdbProfiler import AdbProfiler, caller_name
+from AndroidRunner.AsyncAdb import AsyncAdb
+from AndroidRunner.Adb import AdbError
 from AndroidRunner.Device import Device
+from AndroidRunner.DeviceWatchdog import DeviceWatchdog, WatchdogError
 from AndroidRunner.Devices import Devices
+from AndroidRunner.InstallManager import InstallManager, read_manifest
 from AndroidRunner.util import ConfigError
 from tests.unit.fixtures.FakeDevice import FakeDevice
 
@@ -44,7 +55,8 @@ class TestDevice(object):
         adb_shell.return_value = None
         name = 'fake_device'
         device_id = 123456789
-        device_settings = {"device_settings_reqs": {"app1": ["setting_1"], "app2": ["setting_1", "setting_2"]}}
+        device_settings = {"device_settings_reqs": {"app1": ["location_gps_only"],
+                                                    "app2": {"brightness": 10, "animations": 0, "wifi": False}}}
 
         return Device(name, device_id, device_settings)
 
@@ -83,20 +95,68 @@ class TestDevice(object):
         adb_connect.assert_called_once_with(device_id)
         adb_shell.assert_called_once_with(device_id, f"logcat -G {logcat_buffer_size}K")
 
-    @patch('AndroidRunner.Adb.configure_settings')
-    @patch('logging.Logger.info')
-    def test_configure_settings_device(self, logger, configure_settings, device_with_app_settings):
+    @patch('AndroidRunner.Adb.shell')
+    def test_configure_settings_device(self, adb_shell, device_with_app_settings):
+        adb_shell.return_value = '__setting__brightness=120\n__setting__window_animation_scale=1.0\n' \
+                                 '__setting__transition_animation_scale=null\n' \
+                                 '__setting__animator_duration_scale=1.0\n__setting__wifi=1'
+        device_with_app_settings.configure_settings_device("app2")
+
+        assert adb_shell.call_count == 1
+        command = adb_shell.call_args[0][1]
+        assert command.index('echo "__setting__brightness=$(settings get system screen_brightness)"') < \
+            command.index("settings put system screen_brightness '10'")
+        assert "settings put global animator_duration_scale '0'" in command
+        assert 'svc wifi disable' in command
+
+        device_with_app_settings.configure_settings_device("app2", enable=False)
+
+        assert adb_shell.call_count == 2
+        restore = adb_shell.call_args[0][1].split('; ')
+        assert "settings put system screen_brightness '120'" in restore
+        assert 'settings delete global transition_animation_scale' in restore
+        assert 'svc wifi enable' in restore
+
+    @patch('AndroidRunner.Adb.shell')
+    def test_configure_settings_device_legacy_names(self, adb_shell, device_with_app_settings):
+        adb_shell.return_value = '__setting__location_providers=network'
         device_with_app_settings.configure_settings_device("app1")
-        logger.assert_called_with('Enabling setting_1')
-        configure_settings.assert_called_with(device_with_app_settings.id, "setting_1",True)
+        device_with_app_settings.configure_settings_device("app1", enable=False)
 
-        device_with_app_settings.configure_settings_device("app2")
-        logger.assert_called_with('Enabling setting_2')
+        assert "settings put secure location_providers_allowed '+gps'" in adb_shell.call_args_list[0][0][1]
+        assert adb_shell.call_args_list[1][0] == (device_with_app_settings.id,
+                                                  "settings put secure location_providers_allowed '-gps'")
 
+    @patch('AndroidRunner.Adb.shell')
+    def test_configure_settings_device_location_restore(self, adb_shell, device_with_app_settings):
+        device_with_app_settings.device_settings_reqs['app3'] = ['location_high_accuracy']
+        adb_shell.return_value = '__setting__location_providers=null'
+        device_with_app_settings.configure_settings_device("app3")
+        device_with_app_settings.configure_settings_device("app3", enable=False)
+        adb_shell.return_value = '__setting__location_providers=gps,network'
+        device_with_app_settings.configure_settings_device("app3")
+        device_with_app_settings.configure_settings_device("app3", enable=False)
+
+        assert adb_shell.call_args_list[1][0][1] == "settings put secure location_providers_allowed '-gps'; " \
+                                                    "settings put secure location_providers_allowed '-network'"
+        # Both providers were enabled before, there is nothing to restore
+        assert adb_shell.call_count == 3
+
+    @patch('AndroidRunner.Adb.shell')
+    def test_configure_settings_device_no_profile(self, adb_shell, device_with_app_settings):
         device_with_app_settings.configure_settings_device(None)
         device_with_app_settings.configure_settings_device("app3")
+        device_with_app_settings.configure_settings_device("app1", enable=False)
 
-        assert configure_settings.call_count == 3
+        assert adb_shell.call_count == 0
+
+    @patch('AndroidRunner.Adb.shell')
+    def test_configure_settings_device_unknown_setting(self, adb_shell, device_with_app_settings):
+        device_with_app_settings.device_settings_reqs['app3'] = {'volume': 3}
+
+        with pytest.raises(ConfigError):
+            device_with_app_settings.configure_settings_device("app3")
+        assert adb_shell.call_count == 0
 
     @patch('AndroidRunner.Adb.shell')
     def test_get_version(self, adb_shell, device):
@@ -123,28 +183,97 @@ class TestDevice(object):
         assert 'app4' in result_installed and not result_installed['app4']
         assert 'installed_app' in result_installed and result_installed['installed_app']
 
-    @patch('AndroidRunner.Adb.list_apps')
-    def test_get_app_list(self, adb_list_apps, device):
-        adb_list_apps.return_value = ['app1', 'app2', 'app3']
+    @patch('AndroidRunner.Adb.list_package_versions')
+    def test_get_app_list(self, list_package_versions, device):
+        list_package_versions.return_value = {'app1': None, 'app2': None, 'app3': None}
         app_list = device.get_app_list()
 
         assert app_list == ['app1', 'app2', 'app3']
 
-    @patch('AndroidRunner.Adb.install')
-    def test_install_file_not_exist(self, adb_install, device):
+    @patch('AndroidRunner.Adb.list_package_versions')
+    def test_package_index_listed_once(self, list_package_versions, device):
+        list_package_versions.return_value = {'app1': 3, 'app2': 7}
+
+        device.get_app_list()
+        result_installed = device.is_installed(['app1', 'app3'])
+
+        assert result_installed == {'app1': True, 'app3': False}
+        assert 'app2' in device.package_index()
+        assert device.package_versions() == {'app1': 3, 'app2': 7}
+        list_package_versions.assert_called_once_with(123456789)
+
+    @patch('AndroidRunner.Adb.list_package_versions')
+    def test_package_index_refresh(self, list_package_versions, device):
+        list_package_versions.side_effect = [{'app1': None}, {'app1': None, 'app2': None}]
+
+        device.get_app_list()
+        install_count = device.install_count
+
+        assert device.get_app_list(refresh=True) == ['app1', 'app2']
+        assert list_package_versions.call_count == 2
+        assert device.install_count == install_count + 1
+
+    @patch('AndroidRunner.Adb.list_package_versions')
+    def test_package_index_refresh_unchanged(self, list_package_versions, device):
+        list_package_versions.return_value = {'app1': None}
+
+        device.get_app_list()
+        install_count = device.install_count
+        device.get_app_list(refresh=True)
+
+        assert device.install_count == install_count
+
+    @patch('AndroidRunner.Adb.list_package_versions')
+    def test_mark_installed_updates_package_index(self, list_package_versions, device):
+        list_package_versions.return_value = {'app1': None}
+        device.get_app_list()
+        install_count = device.install_count
+
+        device.mark_installed('com.test.app', 4)
+
+        assert device.package_versions() == {'app1': None, 'com.test.app': 4}
+        assert device.install_count == install_count + 1
+        list_package_versions.assert_called_once_with(123456789)
+
+    @patch('AndroidRunner.Adb.uninstall')
+    @patch('AndroidRunner.Adb.list_package_versions')
+    def test_uninstall_updates_package_index(self, list_package_versions, adb_uninstall, device):
+        list_package_versions.return_value = {'app1': None, 'fake_app': None}
+        device.get_app_list()
+        install_count = device.install_count
+
+        device.uninstall('fake_app')
+
+        assert device.get_app_list() == ['app1']
+        assert device.install_count == install_count + 1
+        list_package_versions.assert_called_once_with(123456789)
+
+    def test_install_file_not_exist(self, device):
+        install_manager = Mock()
+
         with pytest.raises(Adb.AdbError):
-            device.install('fake.apk')
+            device.install('fake.apk', install_manager)
+
+        assert install_manager.install.call_count == 0
+
+    @patch('os.path.isfile')
+    def test_install_file_exist(self, os_isfile, device):
+        os_isfile.return_value = True
+        install_manager = Mock()
+        install_manager.install.return_value = 'com.test.app'
+
+        assert device.install('fake.apk', install_manager) == 'com.test.app'
 
-        assert adb_install.call_count == 0
+        install_manager.install.assert_called_once_with(device, 'fake.apk')
 
+    @patch('AndroidRunner.InstallManager.InstallManager.install')
     @patch('os.path.isfile')
-    @patch('AndroidRunner.Adb.install')
-    def test_install_file_exist(self, adb_install, os_isfile, device):
+    def test_install_default_install_manager(self, os_isfile, install, device):
         os_isfile.return_value = True
 
         device.install('fake.apk')
 
-        adb_install.assert_called_once_with(123456789, 'fake.apk')
+        install.assert_called_once_with(device, 'fake.apk')
 
     @patch("AndroidRunner.Adb.shell")
     @pytest.mark.parametrize('size', [Device.LOGCAT_BUFFER_SIZE_MIN,
@@ -688,47 +817,73 @@ class TestAdb(object):
 
         mock_adb.get_devices.assert_called_once()
 
-    def test_shell_succes(self):
+    @patch('AndroidRunner.Adb.connect')
+    @patch('subprocess.run')
+    def test_wait_for_device(self, run, connect):
         mock_adb = Mock()
-        mock_adb.shell_command.return_value = "succes         "
+        mock_adb._ADB__adb_path = 'adb'
         Adb.adb = mock_adb
-        result = Adb.shell(123, "test_command")
 
-        expected_calls = [call.set_target_by_name(123), call.shell_command('test_command')]
-        assert mock_adb.mock_calls == expected_calls
-        assert result == 'succes'
+        Adb.wait_for_device('123', 30)
+
+        assert run.call_args[0][0] == ['adb', '-s', '123', 'wait-for-device']
+        assert run.call_args[1]['timeout'] == 30
+        connect.assert_called_once_with('123')
 
-    def test_shell_error(self):
+    @patch('AndroidRunner.Adb.connect')
+    @patch('subprocess.run')
+    def test_wait_for_device_timeout(self, run, connect):
         mock_adb = Mock()
-        mock_adb.shell_command.return_value = "error"
+        mock_adb._ADB__adb_path = 'adb'
         Adb.adb = mock_adb
+        run.side_effect = Adb.subprocess.TimeoutExpired('adb', 30)
+
+        with pytest.raises(Adb.ConnectionError):
+            Adb.wait_for_device('123', 30)
+        connect.assert_not_called()
+
+    @staticmethod
+    def shell_adb(run, output):
+        mock_adb = Mock()
+        mock_adb._ADB__adb_path = 'adb'
+        Adb.adb = mock_adb
+        run.return_value = Mock(stdout=output)
+        return mock_adb
+
+    @patch('subprocess.run')
+    def test_shell_succes(self, run):
+        mock_adb = self.shell_adb(run, b"succes         ")
+        result = Adb.shell(123, "test_command")
+
+        assert run.call_args[0][0] == ['adb', '-s', 123, 'shell', 'test_command']
+        assert mock_adb.mock_calls == []
+        assert result == 'succes'
+
+    @patch('subprocess.run')
+    def test_shell_error(self, run):
+        self.shell_adb(run, b"error")
 
         with pytest.raises(Adb.AdbError):
             Adb.shell(123, "test_command")
 
-        expected_calls = [call.set_target_by_name(123), call.shell_command('test_command')]
-        assert mock_adb.mock_calls == expected_calls
+        assert run.call_args[0][0] == ['adb', '-s', 123, 'shell', 'test_command']
 
-    def test_shell_su_succes(self):
-        mock_adb = Mock()
-        mock_adb.shell_command.return_value = "su_succes         "
-        Adb.adb = mock_adb
+    @patch('subprocess.run')
+    def test_shell_su_succes(self, run):
+        self.shell_adb(run, b"su_succes         ")
         result = Adb.shell_su(123, "test_command_su")
 
-        expected_calls = [call.set_target_by_name(123), call.shell_command('su -c \'test_command_su\'')]
-        assert mock_adb.mock_calls == expected_calls
+        assert run.call_args[0][0] == ['adb', '-s', 123, 'shell', 'su -c \'test_command_su\'']
         assert result == 'su_succes'
 
-    def test_shell_su_error(self):
-        mock_adb = Mock()
-        mock_adb.shell_command.return_value = "su_error"
-        Adb.adb = mock_adb
+    @patch('subprocess.run')
+    def test_shell_su_error(self, run):
+        self.shell_adb(run, b"su_error")
 
         with pytest.raises(Adb.AdbError):
             Adb.shell_su(123, "test_command_su")
 
-        expected_calls = [call.set_target_by_name(123), call.shell_command('su -c \'test_command_su\'')]
-        assert mock_adb.mock_calls == expected_calls
+        assert run.call_args[0][0] == ['adb', '-s', 123, 'shell', 'su -c \'test_command_su\'']
 
     @patch('AndroidRunner.Adb.shell')
     def test_list_apps(self, adb_shell):
@@ -742,49 +897,42 @@ class TestAdb(object):
         assert 'com.app.2' in result
         assert 'com.app.3' in result
 
-    def test_install_default(self):
-        mock_adb = Mock()
-        mock_adb._ADB__output = 'succes'
-        Adb.adb = mock_adb
-        device_id = 123
-        apk = 'test_apk.apk'
+    @patch('AndroidRunner.Adb.shell')
+    def test_list_package_versions(self, adb_shell):
+        adb_shell.return_value = 'package:com.app.1 versionCode:12\npackage:com.app.2 versionCode:3'
 
-        result = Adb.install(device_id, apk)
+        result = Adb.list_package_versions(123)
 
-        assert result == 'succes'
-        expected_calls = [call.set_target_by_name(device_id), call.run_cmd(['install', '-r', '-g', '-t', apk])]
-        assert mock_adb.mock_calls == expected_calls
+        adb_shell.assert_called_once_with(123, 'pm list packages --show-versioncode')
+        assert result == {'com.app.1': 12, 'com.app.2': 3}
 
-    @patch("zipfile.ZipFile")
-    def test_install_multiple_default(self, zipfile, tmpdir):
-        xapk_file = tmpdir.mkdir("xapk").join("test_apk.xapk")
-        apk_file = tmpdir.mkdir("xapk/test_apk/").join("test_apk.apk")
+    @patch('AndroidRunner.Adb.list_apps')
+    @patch('AndroidRunner.Adb.shell')
+    def test_list_package_versions_unsupported(self, adb_shell, list_apps):
+        adb_shell.return_value = 'Error: Unknown option: --show-versioncode'
+        list_apps.return_value = ['com.app.1']
 
-        xapk_file.write("This is an xapk file")
-        apk_file.write("This is an apk file")
-        device_id = 123
+        assert Adb.list_package_versions(123) == {'com.app.1': None}
 
+    def test_command(self):
         mock_adb = Mock()
-        mock_adb._ADB__output = 'succes'
+        mock_adb._ADB__adb_path = '/usr/bin/adb'
         Adb.adb = mock_adb
-        result = Adb.install(device_id, xapk_file)
 
-        assert result == 'succes'
-        expected_calls = [call.set_target_by_name(device_id), call.run_cmd(['install-multiple', '-r', '-g', '-t', apk_file])]
-        assert mock_adb.mock_calls == expected_calls
-
-    @patch("zipfile.ZipFile")
-    def test_install_multiple_no_apks_in_xapk_file(self, zipfile, tmpdir):
-        xapk_file = tmpdir.mkdir("xapk").join("test_apk.xapk")
-        xapk_file.write("This is an xapk file")
-        device_id = 123
+        assert Adb.command('123', 'exec-in', 'cat') == ['/usr/bin/adb', '-s', '123', 'exec-in', 'cat']
 
+    def test_install_default(self):
         mock_adb = Mock()
         mock_adb._ADB__output = 'succes'
         Adb.adb = mock_adb
+        device_id = 123
+        apk = 'test_apk.apk'
 
-        with pytest.raises(ConfigError):
-            Adb.install(device_id, xapk_file)
+        result = Adb.install(device_id, apk)
+
+        assert result == 'succes'
+        expected_calls = [call.set_target_by_name(device_id), call.run_cmd(['install', '-r', '-g', '-t', apk])]
+        assert mock_adb.mock_calls == expected_calls
 
     def test_install_no_replace(self):
         mock_adb = Mock()
@@ -1011,3 +1159,569 @@ class TestAdb(object):
         shell.assert_called_with(123, "settings put secure location_providers_allowed +gps,network")
         Adb.configure_settings(device_id, setting2, enable=False)
         shell.assert_called_with(123, "settings put secure location_providers_allowed -gps")
+
+    def test_command_name(self):
+        assert Adb.command_name(['shell', 'dumpsys gfxinfo com.app framestats']) == 'shell dumpsys'
+        assert Adb.command_name(['shell', 'su', '-c', "'cat /sys/class/power_supply/usb/online'"]) == 'shell cat'
+        assert Adb.command_name(['exec-in', 'pm', 'install-write', '-S', '10']) == 'exec-in pm'
+        assert Adb.command_name(['install', '-r', '-g', 'app.apk']) == 'install'
+
+    def test_profiled_push(self, tmpdir):
+        local_file = tmpdir.join('file.bin')
+        local_file.write_binary(b'x' * 128)
+        Adb.adb = Mock()
+        Adb.adb._ADB__output = 'pushed'
+        Adb.profiler = AdbProfiler()
+        try:
+            Adb.push('123', str(local_file), '/sdcard/file.bin')
+            Adb.push('123', str(local_file), '/sdcard/file.bin')
+        finally:
+            profiler, Adb.profiler = Adb.profiler, None
+
+        report = profiler.report()
+        assert report['calls'] == 2
+        assert report['bytes'] == 256
+        assert report['commands']['push']['count'] == 2
+        assert list(report['callers'].keys()) == ['TestAdb.test_profiled_push']
+        assert report['heaviest'][0]['caller'] == 'TestAdb.test_profiled_push'
+        assert report['heaviest'][0]['command'] == 'push'
+
+    def test_profiled_error(self):
+        profiler = AdbProfiler()
+
+        @Adb.profiled(lambda args: 'shell %s' % args[1])
+        def failing(device_id, name):
+            raise AdbError('error: closed')
+
+        Adb.profiler = profiler
+        try:
+            with pytest.raises(AdbError):
+                failing('123', 'ls')
+        finally:
+            Adb.profiler = None
+        assert profiler.report()['commands']['shell ls']['errors'] == 1
+
+    def test_profiled_disabled(self):
+        function = Mock(return_value='output')
+        wrapper = Adb.profiled(lambda args: 'shell')(function)
+        Adb.profiler = None
+
+        assert wrapper('123', 'ls') == 'output'
+        function.assert_called_once_with('123', 'ls')
+
+
+
+def binary_manifest(attributes, stripped_names=False):
+    """Builds a binary AndroidManifest.xml with a <manifest> root element with the given (name, value) attributes"""
+    strings = ['' if stripped_names else 'versionCode', 'manifest']
+    for name, value in attributes:
+        if name != 'versionCode':
+            strings.append(name)
+        if isinstance(value, str):
+            strings.append(value)
+    pool = b''.join(struct.pack('<H', len(string)) + string.encode('utf-16-le') + b'\0\0' for string in strings)
+    pool += b'\0' * (-len(pool) % 4)
+    offsets, offset = [], 0
+    for string in strings:
+        offsets.append(offset)
+        offset += 4 + 2 * len(string)
+    header_size = 28 + 4 * len(strings)
+    string_chunk = struct.pack('<HHIIIIII', 0x0001, 28, header_size + len(pool), len(strings), 0, 0, header_size, 0)
+    string_chunk += struct.pack('<%dI' % len(strings), *offsets) + pool
+    resource_map = struct.pack('<HHII', 0x0180, 8, 12, 0x0101021b)
+    packed_attributes = b''
+    for name, value in attributes:
+        name_index = 0 if name == 'versionCode' else strings.index(name)
+        if isinstance(value, str):
+            packed_attributes += struct.pack('<IIIHBBI', 0xffffffff, name_index, strings.index(value), 8, 0, 0x03,
+                                             strings.index(value))
+        else:
+            packed_attributes += struct.pack('<IIIHBBI', 0xffffffff, name_index, 0xffffffff, 8, 0, 0x10, value)
+    element_chunk = struct.pack('<HHI', 0x0102, 16, 16 + 20 + len(packed_attributes)) + \
+        struct.pack('<IIIIHHHHHH', 1, 0xffffffff, 0xffffffff, 1, 20, 20, len(attributes), 0, 0, 0) + packed_attributes
+    body = string_chunk + resource_map + element_chunk
+    return struct.pack('<HHI', 0x0003, 8, 8 + len(body)) + body
+
+
+def write_apk(path, package, version_code, split=None):
+    attributes = [('versionCode', version_code), ('package', package)]
+    if split is not None:
+        attributes.append(('split', split))
+    with zipfile.ZipFile(path if isinstance(path, io.BytesIO) else str(path), 'w') as apk:
+        apk.writestr('AndroidManifest.xml', binary_manifest(attributes))
+        apk.writestr('classes.dex', 'dex of %s' % package)
+
+
+class TestAdbProfiler(object):
+    def test_report(self):
+        profiler = AdbProfiler(heaviest=2)
+        for seconds in (0.0005, 0.003, 0.003, 0.1):
+            profiler.record('shell dumpsys', seconds, 100, caller='plugin android: get_data')
+        profiler.record('pull', 0.2, 5000, caller='Experiment.after_run')
+        profiler.record('shell logcat', 0.001, 10, caller='WebExperiment.before_run')
+
+        report = profiler.report()
+
+        assert report['calls'] == 6
+        assert report['bytes'] == 5410
+        assert list(report['commands'].keys()) == ['pull', 'shell dumpsys', 'shell logcat']
+        dumpsys = report['commands']['shell dumpsys']
+        assert dumpsys['count'] == 4
+        assert dumpsys['p50_ms'] == 3.0
+        assert dumpsys['max_ms'] == 100.0
+        assert dumpsys['histogram_ms'] == {'<=1': 1, '<=4': 2, '<=128': 1}
+        assert [(site['caller'], site['command']) for site in report['heaviest']] == \
+            [('Experiment.after_run', 'pull'), ('plugin android: get_data', 'shell dumpsys')]
+
+    def test_caller_name_plugin(self):
+        code = compile('def get_data():\n    return caller_name(1)\n',
+                       os.path.join('AndroidRunner', 'Plugins', 'android', 'Android.py'), 'exec')
+        namespace = {'caller_name': caller_name}
+        exec(code, namespace)
+
+        assert namespace['get_data']() == 'plugin android: get_data'
+
+    def test_save(self, tmpdir):
+        profiler = AdbProfiler()
+        profiler.record('push', 0.01, 10, caller='Experiment.before_run')
+
+        filename = profiler.save(str(tmpdir))
+
+        assert filename == os.path.join(str(tmpdir), 'adb_profile.json')
+        with open(filename) as f:
+            assert json.load(f)['commands']['push']['bytes'] == 10
+
+
+class TestAsyncAdb(object):
+    @staticmethod
+    def fake_adb(tmpdir, body='echo "$@"'):
+        path = os.path.join(str(tmpdir), 'adb')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n%s\n' % body)
+        os.chmod(path, 0o755)
+        return path
+
+    def test_shell(self, tmpdir):
+        aio = AsyncAdb('123', adb_path=self.fake_adb(tmpdir))
+
+        assert AsyncAdb.run(aio.shell('dumpsys battery')) == ['-s 123 shell dumpsys battery']
+
+    def test_shell_error(self, tmpdir):
+        aio = AsyncAdb('123', adb_path=self.fake_adb(tmpdir, 'echo "error: device offline"'))
+
+        with pytest.raises(AdbError):
+            AsyncAdb.run(aio.shell('ls'))
+
+    def test_commands(self, tmpdir):
+        aio = AsyncAdb('123', adb_path=self.fake_adb(tmpdir))
+
+        results = AsyncAdb.run(aio.push('a.txt', '/sdcard/'), aio.pull('/sdcard/b.txt', 'b.txt'),
+                               aio.shell_su('ls /data'), aio.logcat('ActivityManager'))
+
+        assert results == ['-s 123 push a.txt /sdcard/\n', '-s 123 pull /sdcard/b.txt b.txt\n',
+                           "-s 123 shell su -c 'ls /data'", '-s 123 shell logcat -d | grep "ActivityManager"']
+
+    def test_concurrent(self, tmpdir):
+        adb_path = self.fake_adb(tmpdir, 'sleep 0.5; echo "$2"')
+        start = time.monotonic()
+
+        results = AsyncAdb.run(*(AsyncAdb(device_id, adb_path=adb_path).shell('ls') for device_id in '1234'))
+
+        assert results == ['1', '2', '3', '4']
+        assert time.monotonic() - start < 1.5
+
+    def test_profiled(self, tmpdir):
+        aio = AsyncAdb('123', adb_path=self.fake_adb(tmpdir))
+        Adb.profiler = AdbProfiler()
+        try:
+            AsyncAdb.run(aio.shell('dumpsys battery'))
+            commands = Adb.profiler.report()['commands']
+        finally:
+            Adb.profiler = None
+
+        assert commands['shell dumpsys']['count'] == 1
+
+    def test_push_profiled_bytes(self, tmpdir):
+        aio = AsyncAdb('123', adb_path=self.fake_adb(tmpdir))
+        local = tmpdir.join('a.txt')
+        local.write('x' * 100)
+        Adb.profiler = AdbProfiler()
+        try:
+            AsyncAdb.run(aio.push(str(local), '/sdcard/'))
+            commands = Adb.profiler.report()['commands']
+        finally:
+            Adb.profiler = None
+
+        assert list(commands) == ['push']
+        assert (commands['push']['count'], commands['push']['bytes']) == (1, 100)
+
+    def test_pull_profiled_bytes(self, tmpdir):
+        local = tmpdir.join('b.txt')
+        aio = AsyncAdb('123', adb_path=self.fake_adb(tmpdir, 'printf "%%0100d" 0 > %s' % local))
+        Adb.profiler = AdbProfiler()
+        try:
+            AsyncAdb.run(aio.pull('/sdcard/b.txt', str(local)))
+            commands = Adb.profiler.report()['commands']
+        finally:
+            Adb.profiler = None
+
+        assert (commands['pull']['count'], commands['pull']['bytes']) == (1, 100)
+
+    @patch('AndroidRunner.Adb.adb')
+    @patch('subprocess.run')
+    def test_sync_shell_serialized_per_device(self, run, adb):
+        adb._ADB__adb_path = 'adb'
+        active = []
+        overlaps = []
+
+        def run_command(args, **kwargs):
+            active.append(args[2])
+            overlaps.append(sorted(active))
+            time.sleep(0.1)
+            active.remove(args[2])
+            return Mock(stdout=b'output')
+        run.side_effect = run_command
+        threads = [threading.Thread(target=Adb.shell_su, args=(device_id, 'ls')) for device_id in '1122']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Commands of different devices overlap, the commands of one device do not
+        assert any(len(active_devices) > 1 for active_devices in overlaps)
+        assert all(len(set(active_devices)) == len(active_devices) for active_devices in overlaps)
+
+    def test_reset_lock(self):
+        lock = Adb.lock
+        device_lock = Adb.device_lock('123')
+
+        Adb.reset_lock()
+
+        assert Adb.lock is not lock
+        assert Adb.device_lock('123') is not device_lock
+
+
+class TestDeviceWatchdog(object):
+    @staticmethod
+    def output(battery=80, boot_id='abc', temperature=35000, free_kb=2048000):
+        return ('battery {}\nboot_id {}\nthermal {}\nthermal -1\n'
+                'storage /sdcard /dev/fuse 10000000 100 {} 1% /storage/emulated\n'
+                'storage /data/misc/perfetto-traces\n').format(battery, boot_id, temperature, free_kb)
+
+    @staticmethod
+    def device(*outputs):
+        mock_device = Mock()
+        mock_device.id = 'dev'
+        mock_device.shell.side_effect = list(outputs)
+        return mock_device
+
+    def test_parse(self):
+        readings = DeviceWatchdog.parse(self.output())
+
+        assert readings == {'battery': 80, 'boot_id': 'abc', 'temperature': 35.0, 'storage_mb': {'/sdcard': 2000}}
+
+    def test_invalid_config(self):
+        with pytest.raises(ConfigError):
+            DeviceWatchdog({'battery': 10}, Mock())
+        with pytest.raises(ConfigError):
+            DeviceWatchdog({'min_battery': 50, 'resume_battery': 40}, Mock())
+
+    def test_check_anomalies(self):
+        watchdog = DeviceWatchdog({}, Mock())
+        mock_device = self.device(self.output(), self.output(battery=10, boot_id='def', temperature=50000,
+                                                             free_kb=1024))
+
+        watchdog.check(mock_device)
+        watchdog.check(mock_device)
+
+        assert [description for _, description in watchdog.anomalies['dev']] == \
+            ['battery 10%', '/sdcard 1 MB free', 'temperature 50.0 C', 'rebooted']
+
+    def test_check_unreachable(self):
+        watchdog = DeviceWatchdog({}, Mock())
+        mock_device = self.device(AdbError('error: device offline'))
+
+        assert watchdog.check(mock_device) == {}
+        assert watchdog.anomalies['dev'][0][1].startswith('unreachable')
+
+    @patch('AndroidRunner.DeviceWatchdog.time.sleep')
+    def test_begin_run_charges(self, sleep):
+        mock_usb_handler = Mock()
+        watchdog = DeviceWatchdog({'interval': 0, 'min_battery': 20, 'resume_battery': 50}, mock_usb_handler)
+        mock_device = self.device(self.output(battery=15), self.output(battery=30), self.output(battery=55))
+
+        watchdog.begin_run(mock_device)
+
+        mock_usb_handler.enable_usb.assert_called_once()
+        mock_device.plug.assert_called_once()
+        mock_device.unplug.assert_called_once_with(True)
+        assert sleep.mock_calls == [call(60), call(60)]
+        assert watchdog.end_run(self.device(self.output())) == []
+
+    @patch('AndroidRunner.DeviceWatchdog.time.monotonic')
+    @patch('AndroidRunner.DeviceWatchdog.time.sleep')
+    def test_charge_timeout(self, sleep, monotonic):
+        monotonic.side_effect = [0, 0, 30, 61]
+        watchdog = DeviceWatchdog({'interval': 30, 'charge_timeout': 60}, Mock())
+        mock_device = self.device(self.output(battery=30), self.output(battery=40))
+
+        with pytest.raises(WatchdogError):
+            watchdog.charge(mock_device, 25)
+
+        assert sleep.mock_calls == [call(30), call(30)]
+        mock_device.unplug.assert_not_called()
+
+    def test_background_checks_pause_during_run(self):
+        watchdog = DeviceWatchdog({'interval': 1}, Mock())
+        mock_device = self.device(self.output(), self.output())
+        watchdog._stop = Mock()
+        watchdog._stop.wait.side_effect = [False, True]
+
+        watchdog.begin_run(mock_device)
+        watchdog.watch(mock_device)
+
+        assert mock_device.shell.call_count == 1
+        watchdog.end_run(mock_device)
+        assert mock_device.shell.call_count == 2
+
+    def test_end_run(self):
+        watchdog = DeviceWatchdog({'interval': 0}, Mock())
+        mock_device = self.device(self.output(), self.output(boot_id='def', temperature=50000))
+        watchdog.begin_run(mock_device)
+
+        assert watchdog.end_run(mock_device) == ['temperature 50.0 C', 'rebooted']
+        assert 'dev' not in watchdog.anomalies
+
+    def test_is_transient(self):
+        assert DeviceWatchdog.is_transient('rebooted')
+        assert DeviceWatchdog.is_transient('unreachable (error: device offline)')
+        assert not DeviceWatchdog.is_transient('temperature 50.0 C')
+        assert not DeviceWatchdog.is_transient('/sdcard 100 MB free')
+
+    def test_start_stop(self):
+        watchdog = DeviceWatchdog({'interval': 1}, Mock())
+        watchdog.start([self.device()])
+
+        assert len(watchdog._threads) == 1
+        watchdog.stop()
+        assert watchdog._threads == []
+
+
+class TestInstallManager(object):
+    @pytest.fixture()
+    def device(self):
+        device = Mock()
+        device.id = '123'
+        device.install_count = 0
+        device.package_versions.return_value = {}
+        return device
+
+    def test_read_manifest(self):
+        manifest = read_manifest(binary_manifest([('package', 'com.test.app'), ('versionCode', 42)]))
+
+        assert manifest == {'package': 'com.test.app', 'versionCode': 42}
+
+    def test_read_manifest_stripped_attribute_names(self):
+        manifest = read_manifest(binary_manifest([('versionCode', 7), ('package', 'com.test.app')],
+                                                 stripped_names=True))
+
+        assert manifest['versionCode'] == 7
+
+    def test_read_manifest_not_binary_xml(self):
+        with pytest.raises(ValueError):
+            read_manifest(b'<manifest package="com.test.app"/>')
+
+    def test_info_apk(self, tmpdir):
+        apk = tmpdir.join('app-release.apk')
+        write_apk(apk, 'com.test.app', 3)
+
+        info = InstallManager().info(str(apk))
+
+        assert (info.package, info.version_code, info.apks) == ('com.test.app', 3, [])
+        assert len(info.digests) == 1
+
+    def test_info_xapk(self, tmpdir):
+        base, split = io.BytesIO(), io.BytesIO()
+        write_apk(base, 'com.test.app', 5)
+        write_apk(split, 'com.test.app', 5, split='config.arm64_v8a')
+        xapk = tmpdir.join('app.xapk')
+        with zipfile.ZipFile(str(xapk), 'w') as archive:
+            archive.writestr('config.arm64_v8a.apk', split.getvalue())
+            archive.writestr('com.test.app.apk', base.getvalue())
+
+        info = InstallManager().info(str(xapk))
+
+        assert (info.package, info.version_code) == ('com.test.app', 5)
+        assert info.apks == ['com.test.app.apk', 'config.arm64_v8a.apk']
+
+    def test_info_not_an_apk(self, tmpdir):
+        apk = tmpdir.join('broken.apk')
+        apk.write('not a zip file')
+
+        with pytest.raises(ConfigError):
+            InstallManager().info(str(apk))
+
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_skips_same_build(self, adb, device, tmpdir):
+        apk = tmpdir.join('app.apk')
+        write_apk(apk, 'com.test.app', 3)
+        manager = InstallManager()
+        digest = manager.info(str(apk)).digests[0]
+        adb.side_effect = ['package:/data/app/com.test.app/base.apk', '%s  /data/app/com.test.app/base.apk' % digest]
+        device.package_versions.return_value = {'com.test.app': 3}
+
+        package = manager.install(device, str(apk))
+
+        assert package == 'com.test.app'
+        assert adb.mock_calls == [call(device, 'shell', 'pm path com.test.app'),
+                                  call(device, 'shell', 'sha256sum /data/app/com.test.app/base.apk')]
+
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_verified_once(self, adb, device, tmpdir):
+        apk = tmpdir.join('app.apk')
+        write_apk(apk, 'com.test.app', 3)
+        manager = InstallManager()
+        digest = manager.info(str(apk)).digests[0]
+        adb.side_effect = ['package:/data/app/com.test.app/base.apk', '%s  /data/app/com.test.app/base.apk' % digest]
+        device.package_versions.return_value = {'com.test.app': 3}
+
+        manager.install(device, str(apk))
+        package = manager.install(device, str(apk))
+
+        assert package == 'com.test.app'
+        assert adb.call_count == 2
+        assert device.package_versions.call_count == 1
+
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_verified_again_after_package_change(self, adb, device, tmpdir):
+        apk = tmpdir.join('app.apk')
+        write_apk(apk, 'com.test.app', 3)
+        manager = InstallManager()
+        digest = manager.info(str(apk)).digests[0]
+        adb.side_effect = ['package:/data/app/com.test.app/base.apk',
+                           '%s  /data/app/com.test.app/base.apk' % digest] * 2
+        device.package_versions.return_value = {'com.test.app': 3}
+
+        manager.install(device, str(apk))
+        device.install_count += 1
+        manager.install(device, str(apk))
+
+        assert adb.call_count == 4
+
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_verified_again_after_forget(self, adb, device, tmpdir):
+        apk = tmpdir.join('app.apk')
+        write_apk(apk, 'com.test.app', 3)
+        manager = InstallManager()
+        digest = manager.info(str(apk)).digests[0]
+        adb.side_effect = ['package:/data/app/com.test.app/base.apk',
+                           '%s  /data/app/com.test.app/base.apk' % digest] * 2
+        device.package_versions.return_value = {'com.test.app': 3}
+        other_device = Mock()
+        other_device.id = '456'
+
+        manager.install(device, str(apk))
+        manager.forget(other_device)
+        manager.install(device, str(apk))
+        assert adb.call_count == 2
+        manager.forget(device)
+        manager.install(device, str(apk))
+
+        assert adb.call_count == 4
+
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_same_version_other_content(self, adb, device, tmpdir):
+        apk = tmpdir.join('app.apk')
+        write_apk(apk, 'com.test.app', 3)
+        device.package_versions.return_value = {'com.test.app': 3}
+        adb.side_effect = ['package:/data/app/com.test.app/base.apk',
+                           '%s  /data/app/com.test.app/base.apk' % ('0' * 64), 'Success']
+
+        InstallManager().install(device, str(apk))
+
+        assert adb.mock_calls[-1] == call(device, 'install', '-r', '-g', '-t', str(apk))
+
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_same_version_without_sha256sum(self, adb, device, tmpdir):
+        apk = tmpdir.join('app.apk')
+        write_apk(apk, 'com.test.app', 3)
+        device.package_versions.return_value = {'com.test.app': 3}
+        adb.side_effect = ['package:/data/app/com.test.app/base.apk', '/system/bin/sh: sha256sum: not found']
+
+        InstallManager().install(device, str(apk))
+
+        assert adb.call_count == 2
+
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_other_version(self, adb, device, tmpdir):
+        apk = tmpdir.join('app.apk')
+        write_apk(apk, 'com.test.app', 4)
+        device.package_versions.return_value = {'com.test.app': 3}
+        adb.return_value = 'Performing Streamed Install\nSuccess'
+
+        InstallManager().install(device, str(apk))
+
+        adb.assert_called_once_with(device, 'install', '-r', '-g', '-t', str(apk))
+        device.mark_installed.assert_called_once_with('com.test.app', 4)
+
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_failed(self, adb, device, tmpdir):
+        apk = tmpdir.join('app.apk')
+        write_apk(apk, 'com.test.app', 4)
+        adb.return_value = 'Failure [INSTALL_FAILED_OLDER_SDK]'
+
+        with pytest.raises(Adb.AdbError):
+            InstallManager().install(device, str(apk))
+
+    @patch('AndroidRunner.InstallManager.InstallManager.stream')
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_session(self, adb, stream, device, tmpdir):
+        base = io.BytesIO()
+        write_apk(base, 'com.test.app', 5)
+        xapk = tmpdir.join('app.xapk')
+        with zipfile.ZipFile(str(xapk), 'w') as archive:
+            archive.writestr('com.test.app.apk', base.getvalue())
+        adb.side_effect = ['Success: created install session [77]', 'Success']
+
+        package = InstallManager().install(device, str(xapk))
+
+        assert package == 'com.test.app'
+        assert adb.mock_calls == [call(device, 'shell', 'pm install-create -r -g -t -S %d' % len(base.getvalue())),
+                                  call(device, 'shell', 'pm install-commit 77')]
+        assert stream.call_args[0][2:] == ('exec-in', 'pm', 'install-write', '-S', str(len(base.getvalue())), '77',
+                                           '0_com.test.app.apk', '-')
+
+    @patch('AndroidRunner.InstallManager.InstallManager.stream')
+    @patch('AndroidRunner.InstallManager.InstallManager.adb')
+    def test_install_session_abandoned_on_error(self, adb, stream, device, tmpdir):
+        base = io.BytesIO()
+        write_apk(base, 'com.test.app', 5)
+        xapk = tmpdir.join('app.xapk')
+        with zipfile.ZipFile(str(xapk), 'w') as archive:
+            archive.writestr('com.test.app.apk', base.getvalue())
+        adb.side_effect = ['Success: created install session [77]', 'Success']
+        stream.side_effect = Adb.AdbError('write failed')
+
+        with pytest.raises(Adb.AdbError):
+            InstallManager().install(device, str(xapk))
+
+        assert adb.mock_calls[-1] == call(device, 'shell', 'pm install-abandon 77')
+
+    @patch('AndroidRunner.InstallManager.InstallManager.install')
+    def test_provision(self, install, device):
+        device.package_versions.return_value = {'com.app.a': 1, 'com.app.b': 2}
+        install.side_effect = ['com.app.a', 'com.app.b']
+
+        packages = InstallManager().provision(device, ['a.apk', 'b.apk'])
+
+        assert packages == ['com.app.a', 'com.app.b']
+        assert install.mock_calls == [call(device, 'a.apk'), call(device, 'b.apk')]
+        device.package_versions.assert_called_once_with(refresh=True)
+
+    @patch('AndroidRunner.InstallManager.InstallManager.install')
+    def test_provision_missing_package(self, install, device):
+        device.package_versions.return_value = {'com.app.a': 1}
+        install.side_effect = ['com.app.a', 'com.app.b']
+
+        with pytest.raises(Adb.AdbError):
+            InstallManager().provision(device, ['a.apk', 'b.apk'])
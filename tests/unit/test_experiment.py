@@ -1,4 +1,6 @@
 import filecmp
+import json
+import multiprocessing as mp
 import os
 from collections import OrderedDict
 from http.server import HTTPServer
@@ -8,15 +10,27 @@ from AndroidRunner.StopRunWebserver import StopRunWebserver
 import pytest
 import psutil
 from mock import MagicMock, Mock, call, patch
+from AndroidRunner import Adb
+from AndroidRunner.Adb import AdbError
 from AndroidRunner.util import ConfigError 
 import paths
+from AndroidRunner import ClockSync as clock_sync
+from AndroidRunner.ClockSync import ClockSync
+from AndroidRunner.Cooldown import MAX_WAIT, SETTLED, AdaptiveCooldown
 from AndroidRunner.Devices import Devices
 from AndroidRunner.Experiment import Experiment
 from AndroidRunner.ExperimentFactory import ExperimentFactory
 from AndroidRunner.NativeExperiment import NativeExperiment
 from AndroidRunner.Profilers import Profilers
 from AndroidRunner.Progress import Progress
+from AndroidRunner.RunMetrics import RunMetrics
+from AndroidRunner.RunPipeline import RunPipeline
+from AndroidRunner.RunValidator import RunValidator
+from AndroidRunner.ResultManifest import ResultManifest
+from AndroidRunner.ResultStore import ResultStore, ResultWriter
 from AndroidRunner.Scripts import Scripts
+from AndroidRunner.SequentialStopping import SequentialStopping
+from AndroidRunner.Timeline import MEASURED, Timeline
 from AndroidRunner.WebExperiment import WebExperiment
 from AndroidRunner.util import ConfigError, makedirs
 from tests.PluginTests import PluginTests
@@ -55,6 +69,16 @@ class TestExperiment(object):
         with pytest.raises(ConfigError):
             Experiment(empty_config, None, False)
 
+    @patch('AndroidRunner.Tests.check_dependencies')
+    @patch('AndroidRunner.Devices.Devices.__init__')
+    def test_init_pipeline_runs_with_run_validation(self, mock_devices, mock_test, tmpdir):
+        paths.OUTPUT_DIR = str(tmpdir)
+        mock_devices.return_value = None
+        config = {'devices': 'fake_device', 'pipeline_runs': True, 'run_validation': {}}
+
+        with pytest.raises(ConfigError):
+            Experiment(config, None, False)
+
     @patch('AndroidRunner.Experiment.Experiment.prepare_device')
     @patch('AndroidRunner.Tests.check_dependencies')
     @patch('AndroidRunner.Devices.Devices.__init__')
@@ -76,7 +100,7 @@ class TestExperiment(object):
         assert experiment.time_between_run == 0
         assert experiment.clear_cache == False
         assert experiment.output_root == paths.OUTPUT_DIR
-        assert experiment.result_file_structure is None
+        assert experiment.result_manifest is None
         assert mock_prepare.call_count == 0
 
     @patch('AndroidRunner.Experiment.Experiment.prepare_device')
@@ -102,7 +126,7 @@ class TestExperiment(object):
         assert experiment.time_between_run == 0
         assert experiment.clear_cache == False
         assert experiment.output_root == paths.OUTPUT_DIR
-        assert experiment.result_file_structure is None
+        assert experiment.result_manifest is None
         assert mock_prepare.call_count == 3
         assert mock_prepare.mock_calls[0] == call('dev1', restart=True)
         assert mock_prepare.mock_calls[1] == call('dev2', restart=True)
@@ -136,11 +160,12 @@ class TestExperiment(object):
         assert experiment.time_between_run == 10
         assert experiment.clear_cache == True
         assert experiment.output_root == paths.OUTPUT_DIR
-        assert experiment.result_file_structure is None
+        assert experiment.result_manifest is None
         mock_devices.assert_called_once_with(['dev1', 'dev2'], adb_path='test_adb', devices_spec=None)
         mock_profilers.assert_called_once_with({'fake': {'config1': 1, 'config2': 2}})
         mock_test.assert_called_once_with(experiment.devices, [])
         assert mock_prepare.call_count == 0
+        profiler_instance.set_clock_sync.assert_called_once_with(False)
 
     def test_prepare_device(self, default_experiment):
         mock_profilers = Mock()
@@ -176,92 +201,175 @@ class TestExperiment(object):
         default_experiment.progress = mock_progress
         assert default_experiment.get_progress_xml_file() == xml_path
 
-    def test_update_progress_empty_folder(self, default_experiment, tmpdir):
+    def test_update_progress_no_manifest(self, default_experiment):
         mock_progress = Mock()
         default_experiment.progress = mock_progress
-        paths.BASE_OUTPUT_DIR = str(tmpdir)
-        makedirs(os.path.join(paths.BASE_OUTPUT_DIR, 'data'))
+
         default_experiment.update_progress()
 
         mock_progress.write_progress_to_file.assert_called_once()
-        result_walk_list = list(default_experiment.result_file_structure)
-        expected_walk_list = default_experiment.walk_to_list(os.walk(os.path.join(paths.BASE_OUTPUT_DIR, 'data')))
-        assert result_walk_list == expected_walk_list
 
-    def test_update_progress_non_empty_folder(self, default_experiment, tmpdir):
+    def test_update_progress_commits_run(self, default_experiment, tmpdir):
         mock_progress = Mock()
         default_experiment.progress = mock_progress
-        paths.BASE_OUTPUT_DIR = str(tmpdir)
-        folder_path = os.path.join(paths.BASE_OUTPUT_DIR, 'data', '1', '2')
-        makedirs(folder_path)
-        open(os.path.join(folder_path, "test.txt"), "w+")
+        run_dir = os.path.join(str(tmpdir), 'data', 'device', 'subject')
+        makedirs(run_dir)
+        default_experiment.result_manifest = ResultManifest(str(tmpdir))
+        default_experiment.result_manifest.begin_run('1', run_dir)
+        open(os.path.join(run_dir, "test.txt"), "w+").close()
+
         default_experiment.update_progress()
 
         mock_progress.write_progress_to_file.assert_called_once()
-        result_walk_list = list(default_experiment.result_file_structure)
-        expected_walk_list = default_experiment.walk_to_list(os.walk(os.path.join(paths.BASE_OUTPUT_DIR, 'data')))
-        assert result_walk_list == expected_walk_list
-
-    def test_walk_to_list(self, default_experiment, tmpdir):
-        paths.BASE_OUTPUT_DIR = str(tmpdir)
-        folder_path1 = os.path.join(paths.BASE_OUTPUT_DIR, 'data', '1', '1')
-        folder_path2 = os.path.join(paths.BASE_OUTPUT_DIR, 'data', '2', '1')
-        makedirs(folder_path1), makedirs(folder_path2)
-        open(os.path.join(folder_path1, "test.txt"), "w+")
-        open(os.path.join(folder_path2, "test.txt"), "w+")
-
-        walk_list = default_experiment.walk_to_list(os.walk(paths.BASE_OUTPUT_DIR))
-        print(walk_list)
-        assert len(walk_list) == 7
-
-        files = ['data/1/1/test.txt', 'data/2/1/test.txt']
-        flags = [False]*2
-
-        for item in walk_list:
-            for i, file in enumerate(files):
-                flags[i] |= file in item
-
-        assert(all(flags))
-
-    def test_check_result_files_correct(self, default_experiment, tmpdir):
-        paths.BASE_OUTPUT_DIR = str(tmpdir)
-        folder_path1 = os.path.join(paths.BASE_OUTPUT_DIR, 'data', '1', '1')
-        folder_path2 = os.path.join(paths.BASE_OUTPUT_DIR, 'data', '2', '1')
-        makedirs(folder_path1), makedirs(folder_path2)
-        open(os.path.join(folder_path1, "test.txt"), "w+")
-        open(os.path.join(folder_path2, "test.txt"), "w+")
-        correct_file_structure1 = os.walk(os.path.join(paths.BASE_OUTPUT_DIR, 'data'))
-        correct_file_structure2 = os.walk(os.path.join(paths.BASE_OUTPUT_DIR, 'data'))
-
-        default_experiment.check_result_files(correct_file_structure1)
-
-        current_file_structure = os.walk(os.path.join(paths.BASE_OUTPUT_DIR, 'data'))
-
-        assert list(current_file_structure) == list(correct_file_structure2)
-
-    def test_check_result_files_incorrect(self, default_experiment, tmpdir):
-        paths.BASE_OUTPUT_DIR = str(tmpdir)
-        folder_path1 = os.path.join(paths.BASE_OUTPUT_DIR, 'data', '1', '1')
-        folder_path2 = os.path.join(paths.BASE_OUTPUT_DIR, 'data', '2', '1')
-        folder_path3 = os.path.join(paths.BASE_OUTPUT_DIR, 'data', '3', '1')
-        makedirs(folder_path1), makedirs(folder_path2)
-        open(os.path.join(folder_path1, "test.txt"), "w+")
-        open(os.path.join(folder_path2, "test.txt"), "w+")
-
-        correct_file_structure_list1 = default_experiment.walk_to_list(
-            os.walk(os.path.join(paths.BASE_OUTPUT_DIR, 'data')))
-        correct_file_structure_list2 = list(os.walk(os.path.join(paths.BASE_OUTPUT_DIR, 'data')))
-
-        makedirs(folder_path3)
-        open(os.path.join(folder_path3, "test.txt"), "w+")
-
-        incorrect_file_structure_list = list(os.walk(os.path.join(paths.BASE_OUTPUT_DIR, 'data')))
-        assert not correct_file_structure_list2 == incorrect_file_structure_list
-
-        default_experiment.check_result_files(correct_file_structure_list1)
-
-        current_file_structure_list = list(os.walk(os.path.join(paths.BASE_OUTPUT_DIR, 'data')))
-        assert current_file_structure_list == correct_file_structure_list2
+        assert default_experiment.result_manifest.runs == {'1': [os.path.join('data', 'device', 'subject', 'test.txt')]}
+        assert ResultManifest(str(tmpdir)).runs == default_experiment.result_manifest.runs
+
+    def test_check_result_files_no_manifest(self, default_experiment):
+        default_experiment.check_result_files(None)
+
+    def test_check_result_files_committed(self, default_experiment, tmpdir):
+        run_dir = os.path.join(str(tmpdir), 'data', '1', '1')
+        makedirs(run_dir)
+        manifest = ResultManifest(str(tmpdir))
+        manifest.begin_run('1', run_dir)
+        open(os.path.join(run_dir, "test.txt"), "w+").close()
+        manifest.commit_run()
+        correct_file_structure = list(os.walk(os.path.join(str(tmpdir), 'data')))
+
+        default_experiment.check_result_files(manifest)
+
+        assert list(os.walk(os.path.join(str(tmpdir), 'data'))) == correct_file_structure
+
+    def test_check_result_files_unfinished_run(self, default_experiment, tmpdir):
+        old_run_dir = os.path.join(str(tmpdir), 'data', '1', '1')
+        new_run_dir = os.path.join(str(tmpdir), 'data', '2', '1')
+        makedirs(old_run_dir)
+        open(os.path.join(old_run_dir, "test.txt"), "w+").close()
+        correct_file_structure = list(os.walk(os.path.join(str(tmpdir), 'data')))
+        manifest = ResultManifest(str(tmpdir))
+        makedirs(new_run_dir)
+        manifest.begin_run('2', new_run_dir)
+        makedirs(os.path.join(new_run_dir, 'android'))
+        open(os.path.join(new_run_dir, 'android', "test.txt"), "w+").close()
+
+        default_experiment.check_result_files(manifest)
+
+        assert list(os.walk(os.path.join(str(tmpdir), 'data'))) == correct_file_structure
+
+    def test_check_result_files_discards_run(self, default_experiment, tmpdir):
+        run_dir = os.path.join(str(tmpdir), 'data', '2', '1')
+        makedirs(run_dir)
+        manifest = ResultManifest(str(tmpdir))
+        manifest.begin_run('2', run_dir)
+        open(os.path.join(run_dir, 'test.csv'), 'w').close()
+        default_experiment.profilers = Mock()
+        default_experiment.run_metrics = Mock()
+
+        default_experiment.check_result_files(manifest)
+
+        default_experiment.profilers.discard_results.assert_called_once_with(
+            [os.path.join(run_dir, 'test.csv'), run_dir, os.path.dirname(run_dir)])
+        default_experiment.run_metrics.discard.assert_called_once_with('2')
+
+    def test_check_result_files_no_current_run(self, default_experiment, tmpdir):
+        default_experiment.profilers = Mock()
+        default_experiment.run_metrics = Mock()
+
+        default_experiment.check_result_files(ResultManifest(str(tmpdir)))
+
+        default_experiment.profilers.discard_results.assert_not_called()
+        default_experiment.run_metrics.discard.assert_not_called()
+
+    def test_pending_files(self, tmpdir):
+        run_dir = os.path.join(str(tmpdir), 'data', '1', '1')
+        makedirs(run_dir)
+        open(os.path.join(run_dir, 'old.txt'), 'w').close()
+        manifest = ResultManifest(str(tmpdir))
+        manifest.begin_run('1', run_dir)
+        makedirs(os.path.join(run_dir, 'android'))
+        open(os.path.join(run_dir, 'android', 'new.csv'), 'w').close()
+
+        assert manifest.pending_files() == [os.path.join(run_dir, 'android', 'new.csv')]
+        manifest.commit_run()
+        assert manifest.pending_files() == []
+
+    def test_manifest_recorded_file_outside_run_dir(self, tmpdir):
+        run_dir = os.path.join(str(tmpdir), 'data', '1', '1')
+        store_dir = os.path.join(str(tmpdir), 'results', 'android', 'run=1')
+        makedirs(run_dir)
+        manifest = ResultManifest(str(tmpdir))
+        manifest.begin_run('1', run_dir)
+        makedirs(store_dir)
+        open(os.path.join(store_dir, 'part-0.parquet'), 'w').close()
+        manifest.record(os.path.join(store_dir, 'part-0.parquet'))
+
+        assert manifest.pending_files() == [os.path.join(store_dir, 'part-0.parquet')]
+        manifest.rollback()
+
+        assert not os.path.exists(os.path.join(str(tmpdir), 'results'))
+
+    def test_manifest_reuses_listing_of_committed_run(self, tmpdir):
+        run_dir = os.path.join(str(tmpdir), 'data', '1', '1')
+        makedirs(run_dir)
+        manifest = ResultManifest(str(tmpdir))
+        manifest.begin_run('1', run_dir)
+        open(os.path.join(run_dir, 'first.txt'), 'w').close()
+        manifest.commit_run()
+
+        with patch.object(manifest, 'scan', wraps=manifest.scan) as scan:
+            manifest.begin_run('2', run_dir)
+            open(os.path.join(run_dir, 'second.txt'), 'w').close()
+            manifest.commit_run()
+
+        assert scan.call_count == 1
+        assert manifest.runs['2'] == [os.path.join('data', '1', '1', 'second.txt')]
+
+    def test_manifest_lists_only_changed_directories(self, tmpdir):
+        run_dir = os.path.join(str(tmpdir), 'data', '1', '1')
+        makedirs(os.path.join(run_dir, 'android'))
+        makedirs(os.path.join(run_dir, 'batterystats'))
+        manifest = ResultManifest(str(tmpdir))
+        manifest.begin_run('1', run_dir)
+        manifest.commit_run()
+        # Listed long after their last modification, so the cached listings can be trusted
+        for directory, listing in manifest.listings.items():
+            manifest.listings[directory] = (listing[0], listing[0] + 2 * manifest.RACY_NS) + listing[2:]
+
+        with patch('AndroidRunner.ResultManifest.os.scandir', wraps=os.scandir) as scandir:
+            manifest.begin_run('2', run_dir)
+            open(os.path.join(run_dir, 'android', 'new.csv'), 'w').close()
+            manifest.commit_run()
+
+        assert [c[0][0] for c in scandir.call_args_list] == [os.path.join(run_dir, 'android')]
+        assert manifest.runs['2'] == [os.path.join('data', '1', '1', 'android', 'new.csv')]
+
+    def test_manifest_save_appends_committed_runs(self, tmpdir):
+        run_dir = os.path.join(str(tmpdir), 'data', '1', '1')
+        makedirs(run_dir)
+        manifest = ResultManifest(str(tmpdir))
+        manifest.begin_run('1', run_dir)
+        open(os.path.join(run_dir, 'first.txt'), 'w').close()
+        manifest.commit_run()
+        manifest.save()
+        manifest.begin_run('2', run_dir)
+        open(os.path.join(run_dir, 'second.txt'), 'w').close()
+        manifest.commit_run()
+        manifest.save()
+        manifest.save()
+
+        with open(manifest.manifest_file, 'r') as f:
+            lines = f.readlines()
+        assert len(lines) == 2
+        assert ResultManifest(str(tmpdir)).runs == manifest.runs
+
+    def test_manifest_load_skips_incomplete_entry(self, tmpdir):
+        with open(os.path.join(str(tmpdir), ResultManifest.FILENAME), 'w') as f:
+            f.write('{"run": "1", "files": ["data/1/1/a.txt"]}\n{"run": "2", "fil')
+
+        manifest = ResultManifest(str(tmpdir))
+
+        assert manifest.runs == {'1': ['data/1/1/a.txt']}
+        assert manifest.files == {'data/1/1/a.txt'}
 
     def test_get_experiment(self, default_experiment):
         default_experiment.random = False
@@ -326,6 +434,99 @@ class TestExperiment(object):
 
         before_run_subject.assert_called_once_with(mock_device, fake_dict['path'])
 
+    @patch('AndroidRunner.Experiment.Experiment.before_run_subject')
+    def test_before_every_run_subject_subject_hooks(self, before_run_subject, default_experiment):
+        mock_devices = Mock()
+        mock_device = Mock()
+        mock_devices.get_device.return_value = mock_device
+        default_experiment.devices = mock_devices
+        mock_scripts = Mock()
+        default_experiment.scripts = mock_scripts
+
+        default_experiment.before_every_run_subject({'device': 'fake_device', 'path': 'test/path'})
+        default_experiment.before_every_run_subject({'device': 'fake_device', 'path': 'test/path'})
+        default_experiment.before_every_run_subject({'device': 'fake_device', 'path': 'other/path'})
+
+        assert mock_scripts.run.mock_calls == [call('before_subject', mock_device, 'test/path'),
+                                               call('after_subject', mock_device, 'test/path'),
+                                               call('before_subject', mock_device, 'other/path')]
+        assert default_experiment.active_subject == ('fake_device', 'other/path', None, None)
+        assert before_run_subject.call_count == 3
+
+    @patch('AndroidRunner.Experiment.Experiment.before_run_subject')
+    def test_before_every_run_subject_argument_switch(self, before_run_subject, default_experiment):
+        mock_devices = Mock()
+        mock_device = Mock()
+        mock_devices.get_device.return_value = mock_device
+        default_experiment.devices = mock_devices
+        mock_scripts = Mock()
+        default_experiment.scripts = mock_scripts
+
+        default_experiment.before_every_run_subject({'device': 'fake_device', 'path': 'test/path',
+                                                     'experimentArg': 'small'})
+        default_experiment.before_every_run_subject({'device': 'fake_device', 'path': 'test/path',
+                                                     'experimentArg': 'big'})
+
+        assert mock_scripts.run.mock_calls == [call('before_subject', mock_device, 'test/path'),
+                                               call('after_subject', mock_device, 'test/path'),
+                                               call('before_subject', mock_device, 'test/path')]
+
+    @patch('AndroidRunner.Experiment.Experiment.first_run_device')
+    @patch('AndroidRunner.Experiment.Experiment.before_run_subject')
+    def test_prepare_run_leaves_subject_before_output_dir(self, before_run_subject, first_run_device,
+                                                          default_experiment, tmpdir):
+        paths.BASE_OUTPUT_DIR = str(tmpdir)
+        mock_devices = Mock()
+        mock_device = Mock()
+        mock_devices.get_device.return_value = mock_device
+        default_experiment.devices = mock_devices
+        output_dirs = []
+        mock_scripts = Mock()
+        mock_scripts.run.side_effect = lambda name, *args: output_dirs.append((name, paths.OUTPUT_DIR))
+        default_experiment.scripts = mock_scripts
+
+        default_experiment.prepare_run({'device': 'fake_device', 'path': 'test/path', 'runId': '1'})
+        first_dir = paths.OUTPUT_DIR
+        default_experiment.prepare_run({'device': 'fake_device', 'path': 'other/path', 'runId': '2'})
+
+        assert output_dirs == [('before_subject', first_dir), ('after_subject', first_dir),
+                               ('before_subject', paths.OUTPUT_DIR)]
+        assert first_dir != paths.OUTPUT_DIR
+
+    def test_leave_subject_no_active_subject(self, default_experiment):
+        mock_scripts = Mock()
+        default_experiment.scripts = mock_scripts
+
+        default_experiment.leave_subject()
+
+        assert mock_scripts.run.call_count == 0
+
+    @patch('AndroidRunner.Experiment.Experiment.after_last_run')
+    @patch('AndroidRunner.Experiment.Experiment.aggregate_subject')
+    def test_last_run_subject_leaves_subject(self, aggregate_subject, after_last_run, default_experiment):
+        mock_progress = Mock()
+        mock_progress.subject_finished.return_value = True
+        default_experiment.progress = mock_progress
+        mock_devices = Mock()
+        mock_device = Mock()
+        mock_devices.get_device.return_value = mock_device
+        default_experiment.devices = mock_devices
+        mock_scripts = Mock()
+        default_experiment.scripts = mock_scripts
+        default_experiment.active_subject = ('fake_device', 'test/path', None, None)
+        mock_manager = Mock()
+        mock_manager.attach_mock(after_last_run, "after_last_run_managed")
+        mock_manager.attach_mock(mock_scripts.run, "scripts_run_managed")
+        mock_manager.attach_mock(aggregate_subject, "aggregate_subject_managed")
+
+        default_experiment.last_run_subject({'device': 'fake_device', 'path': 'test/path'})
+
+        expected_calls = [call.after_last_run_managed(mock_device, 'test/path'),
+                          call.scripts_run_managed('after_subject', mock_device, 'test/path'),
+                          call.aggregate_subject_managed()]
+        assert mock_manager.mock_calls == expected_calls
+        assert default_experiment.active_subject is None
+
     @patch('AndroidRunner.Experiment.Experiment.after_experiment')
     def test_last_run_device_false(self, after_experiment, default_experiment):
         mock_progress = Mock()
@@ -529,7 +730,8 @@ class TestExperiment(object):
 
         default_experiment.interaction(mock_device, path, run, *args, **kwargs)
 
-        script_run.assert_called_once_with('interaction', mock_device, default_experiment, *args, **kwargs)
+        script_run.assert_called_once_with('interaction', mock_device, default_experiment, *args,
+                                           metrics=default_experiment.run_metrics.recorder(), **kwargs)
 
     @patch('AndroidRunner.Profilers.Profilers.stop_profiling')
     def test_stop_profiling(self, start_profiling, default_experiment):
@@ -579,11 +781,55 @@ class TestExperiment(object):
 
         expected_calls = [call.script_run_managed('after_run', mock_device, *args, **kwargs),
                           call.collect_results_managed(mock_device),
+                          call.collect_results_managed().__iter__(),
                           call.reset_managed(True),
                           call.sleep_managed(2)
                          ]
         assert mock_manager.mock_calls == expected_calls
 
+    @patch('time.sleep')
+    @patch('AndroidRunner.Adb.reset')
+    @patch('AndroidRunner.Profilers.Profilers.collect_results')
+    @patch('AndroidRunner.Scripts.Scripts.run')
+    def test_after_run_submits_host_tasks(self, script_run, collect_results, reset, sleep, default_experiment):
+        task1 = Mock()
+        task2 = Mock()
+        collect_results.return_value = [task1, task2]
+        mock_pipeline = Mock()
+        default_experiment.pipeline = mock_pipeline
+
+        default_experiment.after_run(Mock(), 'test/path', 1)
+
+        assert mock_pipeline.submit.mock_calls == [call(task1), call(task2)]
+
+    @patch('time.sleep')
+    @patch('AndroidRunner.Adb.reset')
+    @patch('AndroidRunner.Profilers.Profilers.collect_results')
+    @patch('AndroidRunner.Scripts.Scripts.run')
+    def test_after_run_cooldown(self, script_run, collect_results, reset, sleep, default_experiment):
+        mock_cooldown = Mock()
+        mock_cooldown.wait.return_value = OrderedDict([('cooldown_ms', 1500), ('cooldown_reason', SETTLED)])
+        mock_run_metrics = Mock()
+        default_experiment.cooldown = mock_cooldown
+        default_experiment.run_metrics = mock_run_metrics
+        default_experiment.time_between_run = 2000
+        mock_device = Mock()
+
+        default_experiment.after_run(mock_device, 'test/path', 1)
+
+        mock_cooldown.wait.assert_called_once_with(mock_device)
+        mock_run_metrics.recorder().update.assert_called_once_with(mock_cooldown.wait.return_value)
+        sleep.assert_not_called()
+
+    def test_prepare_device_cooldown_baseline(self, default_experiment):
+        default_experiment.profilers = Mock()
+        default_experiment.cooldown = Mock()
+        fake_device = Mock()
+
+        default_experiment.prepare_device(fake_device)
+
+        default_experiment.cooldown.set_baseline.assert_called_once_with(fake_device)
+
     def test_after_last_run(self, default_experiment):
         args = (1, 2, 3)
         kwargs = {'arg1': 1, 'arg2': 2}
@@ -614,14 +860,14 @@ class TestExperiment(object):
 
         default_experiment.aggregate_end()
 
-        aggregate_end.assert_called_once_with(default_experiment.output_root)
+        aggregate_end.assert_called_once_with(default_experiment.output_root, workers=1)
 
     @patch('AndroidRunner.Experiment.Experiment.aggregate_end')
     @patch('AndroidRunner.Experiment.Experiment.cleanup')
     @patch('AndroidRunner.Experiment.Experiment.check_result_files')
     def test_finish_experiment_regular_no_devices(self, check_result_files, cleanup, aggregate_end, default_experiment):
         fake_file_structure = 'test_structure'
-        default_experiment.result_file_structure = fake_file_structure
+        default_experiment.result_manifest = fake_file_structure
         default_experiment.devices = []
         mock_manager = Mock()
         mock_manager.attach_mock(check_result_files, "check_result_files_managed")
@@ -640,7 +886,7 @@ class TestExperiment(object):
     def test_finish_experiment_regular_multiple_devices(self, check_result_files, cleanup, aggregate_end,
                                                         default_experiment):
         fake_file_structure = 'test_structure'
-        default_experiment.result_file_structure = fake_file_structure
+        default_experiment.result_manifest = fake_file_structure
         default_experiment.devices = ['1', '2', '3']
         mock_manager = Mock()
         mock_manager.attach_mock(check_result_files, "check_result_files_managed")
@@ -662,20 +908,32 @@ class TestExperiment(object):
     def test_finish_experiment_error(self, check_result_files, cleanup, aggregate_end, default_experiment):
         fake_file_structure = 'test_structure'
         default_experiment.devices = ['1']
-        default_experiment.result_file_structure = fake_file_structure
+        default_experiment.result_manifest = fake_file_structure
         default_experiment.finish_experiment(True, False)
 
         check_result_files.assert_called_once_with(fake_file_structure)
         cleanup.assert_called_once_with('1')
         assert aggregate_end.call_count == 0
 
+    @patch('AndroidRunner.Experiment.Experiment.aggregate_end')
+    @patch('AndroidRunner.Experiment.Experiment.cleanup')
+    @patch('AndroidRunner.Experiment.Experiment.check_result_files')
+    def test_finish_experiment_saves_adb_profile(self, check_result_files, cleanup, aggregate_end,
+                                                 default_experiment):
+        default_experiment.devices = []
+        mock_profiler = Mock()
+        with patch('AndroidRunner.Adb.profiler', mock_profiler):
+            default_experiment.finish_experiment(True, False)
+
+        mock_profiler.save.assert_called_once_with(default_experiment.output_root)
+
     @patch('AndroidRunner.Experiment.Experiment.aggregate_end')
     @patch('AndroidRunner.Experiment.Experiment.cleanup')
     @patch('AndroidRunner.Experiment.Experiment.check_result_files')
     def test_finish_experiment_interrupted(self, check_result_files, cleanup, aggregate_end, default_experiment):
         fake_file_structure = 'test_structure'
         default_experiment.devices = ['1']
-        default_experiment.result_file_structure = fake_file_structure
+        default_experiment.result_manifest = fake_file_structure
 
         default_experiment.finish_experiment(False, True)
 
@@ -689,13 +947,34 @@ class TestExperiment(object):
     def test_finish_experiment_error_in_cleanup(self, check_result_files, cleanup, aggregate_end, default_experiment):
         fake_file_structure = 'test_structure'
         default_experiment.devices = ['1']
-        default_experiment.result_file_structure = fake_file_structure
+        default_experiment.result_manifest = fake_file_structure
         cleanup.side_effect = Exception
         default_experiment.finish_experiment(True, False)
         check_result_files.assert_called_once_with(fake_file_structure)
         cleanup.assert_called_once_with('1')
         assert aggregate_end.call_count == 0
 
+    @patch('AndroidRunner.Experiment.Experiment.aggregate_end')
+    @patch('AndroidRunner.Experiment.Experiment.cleanup')
+    @patch('AndroidRunner.Experiment.Experiment.check_result_files')
+    def test_finish_experiment_interrupted_leaves_subject(self, check_result_files, cleanup, aggregate_end,
+                                                          default_experiment):
+        mock_devices = MagicMock()
+        mock_device = Mock()
+        mock_devices.get_device.return_value = mock_device
+        mock_devices.__iter__.return_value = iter([mock_device])
+        default_experiment.devices = mock_devices
+        mock_scripts = Mock()
+        mock_scripts.run.side_effect = Exception
+        default_experiment.scripts = mock_scripts
+        default_experiment.active_subject = ('fake_device', 'test/path', None, None)
+
+        default_experiment.finish_experiment(False, True)
+
+        mock_scripts.run.assert_called_once_with('after_subject', mock_device, 'test/path')
+        cleanup.assert_called_once_with(mock_device)
+        assert default_experiment.active_subject is None
+
     @patch('AndroidRunner.Experiment.Experiment.finish_run')
     @patch('AndroidRunner.Experiment.Experiment.run_run')
     @patch('AndroidRunner.Experiment.Experiment.prepare_run')
@@ -730,6 +1009,22 @@ class TestExperiment(object):
                           call.before_every_run_subject_managed(test_run)]
         assert mock_manager.mock_calls == expected_calls
 
+    @patch('AndroidRunner.Experiment.Experiment.before_every_run_subject')
+    @patch('AndroidRunner.Experiment.Experiment.first_run_device')
+    @patch('AndroidRunner.Experiment.Experiment.prepare_output_dir')
+    def test_prepare_run_result_store(self, before_every_run_subject, first_run_device, prepare_output_dir,
+                                      default_experiment):
+        test_run = {'device': 'dev', 'path': 'test/path', 'runCount': '2'}
+        mock_store = Mock()
+        mock_profilers = Mock()
+        default_experiment.result_store = mock_store
+        default_experiment.profilers = mock_profilers
+
+        default_experiment.prepare_run(test_run)
+
+        mock_store.writer.assert_called_once_with(test_run)
+        mock_profilers.set_result_writer.assert_called_once_with(mock_store.writer.return_value)
+
     @patch('AndroidRunner.Experiment.Experiment.run')
     def test_run_run_w_browser(self, run, default_experiment):
         mock_device = Mock()
@@ -770,6 +1065,72 @@ class TestExperiment(object):
                           call.last_run_device_managed(test_run)]
         assert mock_manager.mock_calls == expected_calls
 
+    @patch('AndroidRunner.Experiment.Experiment.last_run_device')
+    @patch('AndroidRunner.Experiment.Experiment.last_run_subject')
+    def test_finish_run_requeues_suspicious_run(self, last_run_subject, last_run_device, default_experiment, tmpdir):
+        paths.OUTPUT_DIR = str(tmpdir)
+        mock_progress = Mock()
+        mock_progress.run_retries.return_value = 0
+        default_experiment.progress = mock_progress
+        default_experiment.run_validator = RunValidator({'min_runs': 2, 'retries': 1}, str(tmpdir))
+        default_experiment.result_manifest = ResultManifest(str(tmpdir))
+        for run_id, interaction_ms in (('1', 1000.0), ('2', 1010.0)):
+            default_experiment.interaction_ms = interaction_ms
+            default_experiment.finish_run({'device': 'dev', 'path': 'app', 'runId': run_id})
+        default_experiment.result_manifest.begin_run('3', str(tmpdir))
+        open(os.path.join(str(tmpdir), 'result.csv'), 'w').close()
+        default_experiment.interaction_ms = 5000.0
+        default_experiment.run_metrics.rows['3'] = {'runId': '3', 'tokens': '10'}
+        default_experiment.profilers = Mock()
+
+        default_experiment.finish_run({'device': 'dev', 'path': 'app', 'runId': '3'})
+
+        assert mock_progress.run_finished.mock_calls == [call('1'), call('2')]
+        mock_progress.requeue_run.assert_called_once_with('3')
+        assert not os.path.exists(os.path.join(str(tmpdir), 'result.csv'))
+        assert '3' not in default_experiment.run_metrics.rows
+        default_experiment.profilers.discard_results.assert_called_once_with([os.path.join(str(tmpdir),
+                                                                                           'result.csv')])
+        assert last_run_subject.call_count == 2
+        with open(os.path.join(str(tmpdir), 'run_validation.csv')) as f:
+            assert [row.split(',')[3] for row in f.read().splitlines()] == ['verdict', 'accepted', 'accepted',
+                                                                            'requeued']
+
+    @patch('AndroidRunner.Experiment.Experiment.last_run_device')
+    @patch('AndroidRunner.Experiment.Experiment.last_run_subject')
+    def test_finish_run_keeps_run_without_retries(self, last_run_subject, last_run_device, default_experiment,
+                                                  tmpdir):
+        mock_progress = Mock()
+        mock_progress.run_retries.return_value = 1
+        default_experiment.progress = mock_progress
+        default_experiment.run_validator = Mock()
+        default_experiment.run_validator.retries = 1
+        default_experiment.run_validator.check.return_value = ['interaction_ms=5000.0 (median 1000.0, z=80.0)']
+
+        default_experiment.finish_run({'device': 'dev', 'path': 'app', 'runId': '3'})
+
+        mock_progress.run_finished.assert_called_once_with('3')
+        mock_progress.requeue_run.assert_not_called()
+        default_experiment.run_validator.accept.assert_not_called()
+
+    @patch('AndroidRunner.Experiment.Experiment.last_run_device')
+    @patch('AndroidRunner.Experiment.Experiment.last_run_subject')
+    def test_finish_run_sequential_stopping(self, last_run_subject, last_run_device, default_experiment, tmpdir):
+        mock_progress = Mock()
+        mock_progress.stop_subject.return_value = 7
+        default_experiment.progress = mock_progress
+        default_experiment.sequential_stopping = SequentialStopping({'metric': 'energy', 'min_runs': 3},
+                                                                    str(tmpdir))
+        default_experiment.run_metrics.rows = {'1': {'energy': '10.0'}, '2': {'energy': '10.1'},
+                                               '3': {'energy': '9.9'}}
+
+        for run_id in ('1', '2', '3'):
+            default_experiment.finish_run({'device': 'dev', 'path': 'app', 'runId': run_id})
+
+        mock_progress.stop_subject.assert_called_once_with('3')
+        assert last_run_subject.call_count == 3
+        assert os.path.isfile(os.path.join(str(tmpdir), 'sequential_stopping.csv'))
+
     @patch('threading.Thread.join')
     @patch('threading.Thread.start')
     @patch('threading.Thread.__init__')
@@ -787,6 +1148,202 @@ class TestExperiment(object):
                           call.mock_threading_join_managed()]
         assert mock_manager.mock_calls == expected_calls
 
+    def test_save_progress_pipelined(self, default_experiment):
+        mock_pipeline = Mock()
+        default_experiment.pipeline = mock_pipeline
+        default_experiment.pipeline_runs = True
+
+        default_experiment.save_progress()
+
+        mock_pipeline.submit.assert_called_once_with(default_experiment.update_progress)
+
+    @patch('AndroidRunner.Experiment.Experiment.prepare_output_dir')
+    @patch('AndroidRunner.Experiment.Experiment.first_run_device')
+    @patch('AndroidRunner.Experiment.Experiment.before_every_run_subject')
+    def test_prepare_run_waits_for_pipeline(self, before_every_run_subject, first_run_device, prepare_output_dir,
+                                            default_experiment):
+        mock_pipeline = Mock()
+        mock_manifest = Mock()
+        mock_manager = Mock()
+        mock_manager.attach_mock(prepare_output_dir, 'prepare_output_dir_managed')
+        mock_manager.attach_mock(mock_pipeline, 'pipeline_managed')
+        mock_manager.attach_mock(mock_manifest, 'result_manifest_managed')
+        mock_manager.attach_mock(first_run_device, 'first_run_device_managed')
+        default_experiment.pipeline = mock_pipeline
+        default_experiment.result_manifest = mock_manifest
+        paths.OUTPUT_DIR = 'output/dir'
+        test_run = {'device': 'test_device', 'path': 'test_path', 'runCount': '1', 'runId': '7'}
+
+        default_experiment.prepare_run(test_run)
+
+        assert mock_manager.mock_calls[:4] == [call.prepare_output_dir_managed(test_run),
+                                               call.pipeline_managed.wait(),
+                                               call.result_manifest_managed.begin_run('7', 'output/dir'),
+                                               call.first_run_device_managed(test_run)]
+
+    @patch('AndroidRunner.Experiment.Experiment.run')
+    def test_run_run_records_run_files(self, run, default_experiment):
+        mock_manifest = Mock()
+        mock_run_metrics = Mock()
+        mock_run_metrics.end_run.return_value = 'output/dir/run_metrics/7.csv'
+        default_experiment.result_manifest = mock_manifest
+        default_experiment.run_metrics = mock_run_metrics
+        default_experiment.devices = Mock()
+        paths.OUTPUT_DIR = 'output/dir'
+        test_run = {'device': 'test_device', 'path': 'test_path', 'runCount': '1', 'runId': '7'}
+
+        default_experiment.run_run(test_run)
+
+        mock_manifest.record.assert_called_once_with('output/dir/run_metrics/7.csv')
+
+    @patch('AndroidRunner.Experiment.Experiment.run')
+    def test_run_run_records_run_metrics(self, run, default_experiment):
+        mock_run_metrics = Mock()
+        mock_manager = Mock()
+        mock_manager.attach_mock(mock_run_metrics, 'run_metrics_managed')
+        mock_manager.attach_mock(run, 'run_managed')
+        default_experiment.run_metrics = mock_run_metrics
+        default_experiment.devices = Mock()
+        paths.OUTPUT_DIR = 'output/dir'
+        test_run = {'device': 'test_device', 'path': 'test_path', 'runCount': '1', 'runId': '7'}
+
+        default_experiment.run_run(test_run)
+
+        assert mock_manager.mock_calls[0] == call.run_metrics_managed.begin_run(test_run)
+        assert mock_manager.mock_calls[1][0] == 'run_managed'
+        assert mock_manager.mock_calls[2] == call.run_metrics_managed.end_run('output/dir')
+
+    @patch('AndroidRunner.Experiment.Experiment.run')
+    def test_run_run_records_interaction_ms_for_resume(self, run, default_experiment, tmpdir):
+        def interaction(*args, **kwargs):
+            default_experiment.interaction_ms = 1500.0
+        run.side_effect = interaction
+        default_experiment.run_metrics = RunMetrics(str(tmpdir))
+        default_experiment.devices = Mock()
+        paths.OUTPUT_DIR = str(tmpdir)
+        test_run = {'device': 'dev', 'path': 'app', 'runCount': '1', 'runId': '7'}
+
+        default_experiment.run_run(test_run)
+
+        # A resumed experiment loads the finished runs from run_metrics.csv
+        stopping = SequentialStopping({'metric': 'interaction_ms'}, str(tmpdir))
+        stopping.load(RunMetrics(str(tmpdir)).rows.values())
+        assert stopping.stats[stopping.subject(test_run)].mean('interaction_ms') == 1500.0
+
+    @patch('AndroidRunner.Scripts.Scripts.run')
+    @patch('AndroidRunner.Experiment.Experiment.after_run')
+    def test_run_run_records_timeline(self, after_run, script_run, default_experiment, tmpdir):
+        mock_device = Mock()
+        mock_device.shell.return_value = '52.10 80.00'
+        default_experiment.devices = Mock()
+        default_experiment.devices.get_device.return_value = mock_device
+        default_experiment.profilers = Mock()
+        default_experiment.timeline = Timeline(str(tmpdir))
+        default_experiment.run_metrics = RunMetrics(str(tmpdir))
+        paths.OUTPUT_DIR = str(tmpdir)
+        test_run = {'device': 'test_device', 'path': 'test_path', 'runCount': '1', 'runId': '7'}
+
+        default_experiment.run_run(test_run)
+
+        with open(os.path.join(str(tmpdir), 'timeline', '7.json')) as f:
+            events = [event for event in json.load(f)['traceEvents'] if event['ph'] == 'X']
+        assert [event['name'] for event in events] == ['before_run', 'start_profiling', 'interaction',
+                                                       'stop_profiling', 'after_run']
+        assert events[2]['cat'] == MEASURED
+
+    def test_record_watchdog(self, default_experiment):
+        default_experiment.watchdog = Mock()
+        default_experiment.watchdog.end_run.return_value = ['battery 10%', 'rebooted']
+        default_experiment.run_metrics = Mock()
+        default_experiment.devices = Mock()
+
+        default_experiment.record_watchdog({'runId': '1', 'device': 'dev'})
+
+        default_experiment.run_metrics.recorder().update.assert_called_once_with(
+            {'watchdog': 'battery 10%; rebooted', 'watchdog_anomalies': 2, 'watchdog_resets': 1})
+
+    @patch('AndroidRunner.Experiment.Experiment.run_experiment')
+    def test_run_experiment_recovering(self, run_experiment, default_experiment):
+        default_experiment.device_recovery = True
+        default_experiment.recovery_timeout = 60
+        default_experiment.recovery_retries = 2
+        default_experiment.progress = Mock()
+        default_experiment.progress.done_run_ids.return_value = []
+        default_experiment.profilers = Mock()
+        default_experiment.usb_handler = Mock()
+        mock_device = Mock()
+        default_experiment.devices = Mock()
+        default_experiment.devices.get_device.return_value = mock_device
+        run_experiment.side_effect = [AdbError('error: device offline'), None]
+        current_run = {'runId': '1', 'device': 'dev'}
+        mock_manager = Mock()
+        mock_manager.attach_mock(run_experiment, 'run_experiment')
+        mock_manager.attach_mock(mock_device, 'device')
+        mock_manager.attach_mock(default_experiment.profilers, 'profilers')
+
+        default_experiment.run_experiment_recovering(current_run)
+
+        assert mock_manager.mock_calls == [call.run_experiment(current_run), call.device.wait_for_device(60),
+                                           call.profilers.reload(mock_device), call.device.unplug(True),
+                                           call.run_experiment(current_run)]
+
+    @patch('AndroidRunner.Experiment.Experiment.run_experiment')
+    def test_run_experiment_recovering_enters_subject_again(self, run_experiment, default_experiment):
+        default_experiment.recovery_timeout = 60
+        default_experiment.recovery_retries = 2
+        default_experiment.progress = Mock()
+        default_experiment.progress.done_run_ids.return_value = []
+        default_experiment.profilers = Mock()
+        default_experiment.usb_handler = Mock()
+        default_experiment.scripts = Mock()
+        default_experiment.scripts.run.side_effect = [None, AdbError('error: device offline'), None]
+        mock_device = Mock()
+        default_experiment.devices = Mock()
+        default_experiment.devices.get_device.return_value = mock_device
+        current_run = {'runId': '1', 'device': 'dev', 'path': 'app'}
+
+        def first_run_fails(run):
+            default_experiment.enter_subject(mock_device, run)
+            if run_experiment.call_count == 1:
+                raise AdbError('error: device offline')
+        run_experiment.side_effect = first_run_fails
+
+        default_experiment.run_experiment_recovering(current_run)
+
+        # after_subject failing on the recovered device does not stop the recovery
+        assert default_experiment.scripts.run.mock_calls == [call('before_subject', mock_device, 'app'),
+                                                             call('after_subject', mock_device, 'app'),
+                                                             call('before_subject', mock_device, 'app')]
+        assert default_experiment.active_subject == default_experiment.subject_key(current_run)
+
+    @patch('AndroidRunner.Experiment.Experiment.recover_device')
+    @patch('AndroidRunner.Experiment.Experiment.run_experiment')
+    def test_run_experiment_recovering_gives_up(self, run_experiment, recover_device, default_experiment):
+        default_experiment.recovery_retries = 1
+        default_experiment.progress = Mock()
+        default_experiment.progress.done_run_ids.return_value = []
+        default_experiment.devices = Mock()
+        run_experiment.side_effect = Adb.ConnectionError('dev: Device not recognized')
+
+        with pytest.raises(Adb.ConnectionError):
+            default_experiment.run_experiment_recovering({'runId': '1', 'device': 'dev'})
+
+        assert run_experiment.call_count == 2
+        recover_device.assert_called_once()
+
+    @patch('AndroidRunner.Experiment.Experiment.recover_device')
+    @patch('AndroidRunner.Experiment.Experiment.run_experiment')
+    def test_run_experiment_recovering_finished_run(self, run_experiment, recover_device, default_experiment):
+        default_experiment.recovery_retries = 2
+        default_experiment.progress = Mock()
+        default_experiment.progress.done_run_ids.return_value = ['1']
+        run_experiment.side_effect = AdbError('error: device offline')
+
+        with pytest.raises(AdbError):
+            default_experiment.run_experiment_recovering({'runId': '1', 'device': 'dev'})
+
+        recover_device.assert_not_called()
+
     @patch('AndroidRunner.Experiment.Experiment.finish_experiment')
     def test_start_error(self, finish_experiment_mock, capsys, default_experiment):
         mock_logger = Mock()
@@ -799,28 +1356,23 @@ class TestExperiment(object):
         finish_experiment_mock.assert_called_once_with(True, False)
         mock_logger.error.assert_called_once_with("TypeError: expected str, bytes or os.PathLike object, not NoneType")
 
-    @patch("AndroidRunner.Experiment.Experiment.walk_to_list")
+    @patch("AndroidRunner.Experiment.ResultManifest")
     @patch('AndroidRunner.Experiment.Experiment.finish_experiment')
-    def test_start_interupt(self, finish_experiment_mock, walk_to_list_mock, default_experiment):
+    def test_start_interupt(self, finish_experiment_mock, result_manifest_mock, default_experiment):
         paths.BASE_OUTPUT_DIR = "test"
-        walk_to_list_mock.side_effect = KeyboardInterrupt
+        result_manifest_mock.side_effect = KeyboardInterrupt
         with pytest.raises(KeyboardInterrupt):
             default_experiment.start()
         finish_experiment_mock.assert_called_once_with(False, True)
 
-    @patch("AndroidRunner.Experiment.walk")
+    @patch("AndroidRunner.Experiment.ResultManifest")
     @patch("AndroidRunner.Experiment.Experiment.get_experiment")
     @patch('AndroidRunner.Experiment.Experiment.run_experiment')
     @patch('AndroidRunner.Experiment.Experiment.save_progress')
-    @patch("AndroidRunner.Experiment.Experiment.walk_to_list")
     @patch('AndroidRunner.Experiment.Experiment.finish_experiment')
-    def test_start_experiment_finished(self, finish_experiment_mock, walk_to_list_mock, save_progress_mock,
-                                       run_experiment_mock, get_experiment_mock, walk_mock, default_experiment):
+    def test_start_experiment_finished(self, finish_experiment_mock, save_progress_mock,
+                                       run_experiment_mock, get_experiment_mock, result_manifest_mock, default_experiment):
         paths.BASE_OUTPUT_DIR = "test"
-        mock_walk_to_list_result = Mock()
-        walk_to_list_mock.return_value = mock_walk_to_list_result
-        mock_walk_result = Mock()
-        walk_mock.return_value = mock_walk_result
         mock_progress = Mock()
         mock_progress.experiment_finished_check.return_value = True
         default_experiment.progress = mock_progress
@@ -828,30 +1380,24 @@ class TestExperiment(object):
         default_experiment.start()
 
         assert get_experiment_mock.call_count == run_experiment_mock.call_count == save_progress_mock.call_count == 0
-        walk_to_list_mock.assert_called_once_with(mock_walk_result)
+        result_manifest_mock.assert_called_once_with("test")
         finish_experiment_mock.assert_called_once_with(False, False)
 
-    @patch("AndroidRunner.Experiment.walk")
+    @patch("AndroidRunner.Experiment.ResultManifest")
     @patch("AndroidRunner.Experiment.Experiment.get_experiment")
     @patch('AndroidRunner.Experiment.Experiment.run_experiment')
     @patch('AndroidRunner.Experiment.Experiment.save_progress')
-    @patch("AndroidRunner.Experiment.Experiment.walk_to_list")
     @patch('AndroidRunner.Experiment.Experiment.finish_experiment')
-    def test_start_experiment_one_run(self, finish_experiment_mock, walk_to_list_mock, save_progress_mock,
-                                      run_experiment_mock, get_experiment_mock, walk_mock, default_experiment):
+    def test_start_experiment_one_run(self, finish_experiment_mock, save_progress_mock,
+                                      run_experiment_mock, get_experiment_mock, result_manifest_mock, default_experiment):
         paths.BASE_OUTPUT_DIR = "test"
-        mock_walk_to_list_result = Mock()
-        walk_to_list_mock.return_value = mock_walk_to_list_result
-        mock_walk_result = Mock()
-        walk_mock.return_value = mock_walk_result
         mock_progress = Mock()
         mock_progress.experiment_finished_check.side_effect = [False, True]
         default_experiment.progress = mock_progress
         mock_get_experiment_result = Mock()
         get_experiment_mock.return_value = mock_get_experiment_result
         mock_manager = Mock()
-        mock_manager.attach_mock(walk_mock, 'walk_mock_managed')
-        mock_manager.attach_mock(walk_to_list_mock, 'walk_to_list_managed')
+        mock_manager.attach_mock(result_manifest_mock, 'result_manifest_managed')
         mock_manager.attach_mock(mock_progress, 'mock_progress_managed')
         mock_manager.attach_mock(get_experiment_mock, 'get_experiment_managed')
         mock_manager.attach_mock(run_experiment_mock, 'run_experiment_managed')
@@ -859,8 +1405,7 @@ class TestExperiment(object):
         mock_manager.attach_mock(finish_experiment_mock, 'finish_experiment_managed')
 
         default_experiment.start()
-        expected_calls = [call.walk_mock_managed(os.path.join('test', 'data')),
-                          call.walk_to_list_managed(mock_walk_result),
+        expected_calls = [call.result_manifest_managed('test'),
                           call.mock_progress_managed.experiment_finished_check(),
                           call.get_experiment_managed(),
                           call.run_experiment_managed(mock_get_experiment_result),
@@ -869,19 +1414,14 @@ class TestExperiment(object):
                           call.finish_experiment_managed(False, False)]
         assert mock_manager.mock_calls == expected_calls
 
-    @patch("AndroidRunner.Experiment.walk")
+    @patch("AndroidRunner.Experiment.ResultManifest")
     @patch("AndroidRunner.Experiment.Experiment.get_experiment")
     @patch('AndroidRunner.Experiment.Experiment.run_experiment')
     @patch('AndroidRunner.Experiment.Experiment.save_progress')
-    @patch("AndroidRunner.Experiment.Experiment.walk_to_list")
     @patch('AndroidRunner.Experiment.Experiment.finish_experiment')
-    def test_start_experiment_multiple_runs(self, finish_experiment_mock, walk_to_list_mock, save_progress_mock,
-                                            run_experiment_mock, get_experiment_mock, walk_mock, default_experiment):
+    def test_start_experiment_multiple_runs(self, finish_experiment_mock, save_progress_mock,
+                                            run_experiment_mock, get_experiment_mock, result_manifest_mock, default_experiment):
         paths.BASE_OUTPUT_DIR = "test"
-        mock_walk_to_list_result = Mock()
-        walk_to_list_mock.return_value = mock_walk_to_list_result
-        mock_walk_result = Mock()
-        walk_mock.return_value = mock_walk_result
         mock_progress = Mock()
         mock_progress.experiment_finished_check.side_effect = [False] * 9 + [True]
         default_experiment.progress = mock_progress
@@ -1206,6 +1746,32 @@ class TestWebExperiment(object):
             assert mock_call == call(mock_device, clear_data=True)
 
 
+    @patch('AndroidRunner.Experiment.Experiment.before_experiment')
+    def test_before_experiment_profile_snapshot(self, before_experiment, web_experiment):
+        mock_device = Mock()
+        mock_device.get_version.return_value = '10'
+        mock_device.shell.return_value = 'Success'
+        web_experiment.browser_profile_snapshot = True
+        web_experiment.before_experiment(mock_device)
+
+        assert web_experiment.browsers[0].restore_snapshot is True
+        assert 'run-as com.android.chrome tar -cf -' in mock_device.shell.call_args[0][0]
+
+    @patch('AndroidRunner.Experiment.Experiment.cleanup')
+    def test_cleanup_profile_snapshot(self, cleanup, web_experiment):
+        mock_device = Mock()
+        mock_browser = Mock()
+        web_experiment.browsers = [mock_browser]
+        web_experiment.browser_profile_snapshot = True
+        mock_manager = Mock()
+        mock_manager.attach_mock(mock_browser, 'mock_browser_managed')
+        web_experiment.cleanup(mock_device)
+
+        expected_calls = [call.mock_browser_managed.stop(mock_device, clear_data=True),
+                          call.mock_browser_managed.delete_snapshot(mock_device)]
+        assert mock_manager.mock_calls == expected_calls
+
+
 class TestNativeExperiment(object):
     @pytest.fixture()
     @patch('AndroidRunner.Tests.check_dependencies')
@@ -1275,6 +1841,22 @@ class TestNativeExperiment(object):
         mock_device.uninstall.assert_called_once_with('com.mock.package2')
         mock_device.get_app_list.assert_called_once()
 
+    @patch('AndroidRunner.Experiment.Experiment.cleanup')
+    def test_cleanup_provisioned_apps(self, cleanup, native_experiment):
+        mock_device = Mock()
+        mock_device.get_app_list.return_value = ['com.mock.package1', 'com.mock.package2', 'com.mock.package3']
+        mock_install_manager = Mock()
+        mock_install_manager.info.side_effect = lambda path: Mock(package=path)
+        native_experiment.install_manager = mock_install_manager
+        native_experiment.paths = ['com.mock.package1', 'com.mock.package2', 'com.mock.package4']
+        native_experiment.pre_installed_apps = ['com.mock.package3']
+        native_experiment.package = 'com.mock.package3'
+        native_experiment.provisioned = True
+
+        native_experiment.cleanup(mock_device)
+
+        assert mock_device.uninstall.mock_calls == [call('com.mock.package1'), call('com.mock.package2')]
+
     @patch('AndroidRunner.Experiment.Experiment.before_experiment')
     def test_before_experiment(self, before_experiment, native_experiment):
         args = (1, 2, 3)
@@ -1304,37 +1886,101 @@ class TestNativeExperiment(object):
         assert native_experiment.package == 'com.test.app'
 
     @patch('AndroidRunner.Experiment.Experiment.before_run_subject')
-    def test_before_run_subject_in_app_list(self, before_run_subject, native_experiment):
+    def test_before_run_subject_install(self, before_run_subject, native_experiment):
         args = (1, 2, 3)
         kwargs = {'arg1': 1, 'arg2': 2}
         mock_device = Mock()
-        test_package = 'com.test.app.apk'
-        path = os.path.join('test', test_package)
-        mock_device.get_app_list.return_value = [test_package]
+        path = os.path.join('test', 'app-release.apk')
+        mock_install_manager = Mock()
+        mock_install_manager.install.return_value = 'com.test.app'
+        native_experiment.install_manager = mock_install_manager
 
         native_experiment.before_run_subject(mock_device, path, *args, **kwargs)
 
         before_run_subject.assert_called_once_with(mock_device, path)
-        mock_device.get_app_list.assert_called_once()
+        mock_install_manager.install.assert_called_once_with(mock_device, path)
         assert mock_device.install.call_count == 0
         assert native_experiment.package == 'com.test.app'
 
     @patch('AndroidRunner.Experiment.Experiment.before_run_subject')
-    def test_before_run_subject_app_not_installed(self, before_run_subject, native_experiment):
-        args = (1, 2, 3)
-        kwargs = {'arg1': 1, 'arg2': 2}
+    def test_before_run_subject_provisioned(self, before_run_subject, native_experiment):
         mock_device = Mock()
-        test_package_file = 'com.test.app.apk'
-        path = os.path.join('test', test_package_file)
-        mock_device.get_app_list.return_value = []
+        path = os.path.join('test', 'app-release.apk')
+        mock_install_manager = Mock()
+        mock_install_manager.info.return_value.package = 'com.test.app'
+        native_experiment.install_manager = mock_install_manager
+        native_experiment.provisioned = True
 
-        native_experiment.before_run_subject(mock_device, path, *args, **kwargs)
+        native_experiment.before_run_subject(mock_device, path)
 
-        before_run_subject.assert_called_once_with(mock_device, path)
-        mock_device.get_app_list.assert_called_once()
-        mock_device.install.assert_called_once_with(path)
+        assert mock_install_manager.install.call_count == 0
         assert native_experiment.package == 'com.test.app'
 
+    def test_provision_disabled(self, native_experiment):
+        mock_install_manager = Mock()
+        native_experiment.install_manager = mock_install_manager
+        native_experiment.paths = ['a.apk']
+        native_experiment.provision_subjects = False
+
+        native_experiment.provision()
+
+        assert mock_install_manager.provision.call_count == 0
+        assert not native_experiment.provisioned
+
+    def test_provision_all_devices(self, native_experiment):
+        mock_install_manager = Mock()
+        native_experiment.install_manager = mock_install_manager
+        native_experiment.paths = ['a.apk', 'b.apk']
+        native_experiment.provision_subjects = True
+        devices = [Mock(), Mock(), Mock()]
+        native_experiment.devices = devices
+
+        native_experiment.provision()
+
+        assert mock_install_manager.info.mock_calls == [call('a.apk'), call('b.apk')]
+        assert sorted(mock_install_manager.provision.mock_calls, key=lambda c: devices.index(c[1][0])) == \
+            [call(device, ['a.apk', 'b.apk']) for device in devices]
+        assert native_experiment.provisioned
+
+    @patch('AndroidRunner.Experiment.Experiment.recover_device')
+    def test_recover_device_forgets_verified_builds(self, recover_device, native_experiment):
+        mock_install_manager = Mock()
+        native_experiment.install_manager = mock_install_manager
+        mock_device = Mock()
+
+        native_experiment.recover_device(mock_device)
+
+        recover_device.assert_called_once_with(mock_device)
+        mock_install_manager.forget.assert_called_once_with(mock_device)
+        assert mock_install_manager.provision.call_count == 0
+
+    @patch('AndroidRunner.Experiment.Experiment.recover_device')
+    def test_recover_device_provisions_again(self, recover_device, native_experiment):
+        mock_manager = Mock()
+        mock_install_manager = Mock()
+        mock_manager.attach_mock(mock_install_manager, 'install_manager')
+        native_experiment.install_manager = mock_install_manager
+        native_experiment.paths = ['a.apk', 'b.apk']
+        native_experiment.provisioned = True
+        mock_device = Mock()
+
+        native_experiment.recover_device(mock_device)
+
+        assert mock_manager.mock_calls == [call.install_manager.forget(mock_device),
+                                           call.install_manager.provision(mock_device, ['a.apk', 'b.apk'])]
+
+    def test_provision_error(self, native_experiment):
+        mock_install_manager = Mock()
+        mock_install_manager.provision.side_effect = AdbError('install failed')
+        native_experiment.install_manager = mock_install_manager
+        native_experiment.paths = ['a.apk']
+        native_experiment.provision_subjects = True
+        native_experiment.devices = [Mock()]
+
+        with pytest.raises(AdbError):
+            native_experiment.provision()
+        assert not native_experiment.provisioned
+
     @patch('AndroidRunner.Experiment.Experiment.after_launch')
     @patch('AndroidRunner.Experiment.Experiment.before_run')
     def test_before_run(self, before_run, after_launch, native_experiment):
@@ -1708,3 +2354,492 @@ class TestPrematureStoppableRun(object):
         proc.children.assert_called_once_with(recursive=True)
         assert proc_a.terminate.call_count == 1
         assert proc_b.terminate.call_count == 1
+
+
+class TestRunPipeline(object):
+    def test_disabled_runs_inline(self):
+        pipeline = RunPipeline(False)
+        task = Mock()
+
+        pipeline.submit(task, 1, key=2)
+
+        task.assert_called_once_with(1, key=2)
+        pipeline.wait()
+
+    def test_enabled_runs_in_order(self):
+        pipeline = RunPipeline(True)
+        results = []
+
+        for i in range(5):
+            pipeline.submit(results.append, i)
+        pipeline.wait()
+        pipeline.shutdown()
+
+        assert results == [0, 1, 2, 3, 4]
+
+    def test_wait_raises_task_error(self):
+        pipeline = RunPipeline(True)
+        task = Mock(side_effect=ValueError('broken'))
+        other_task = Mock()
+
+        pipeline.submit(task)
+        pipeline.submit(other_task)
+        with pytest.raises(ValueError):
+            pipeline.wait()
+        other_task.assert_called_once_with()
+        pipeline.shutdown()
+
+    def test_shutdown_logs_error(self):
+        pipeline = RunPipeline(True)
+        pipeline.logger = Mock()
+
+        pipeline.submit(Mock(side_effect=ValueError('broken')))
+        pipeline.shutdown()
+
+        assert pipeline.logger.error.call_count == 1
+        task = Mock()
+        pipeline.submit(task)
+        task.assert_called_once_with()
+
+
+class TestResultStore(object):
+    @pytest.fixture()
+    def result_store(self, tmpdir):
+        with patch.dict('sys.modules', {'pyarrow': Mock()}):
+            return ResultStore(str(tmpdir))
+
+    def test_init_without_pyarrow(self, tmpdir):
+        with patch.dict('sys.modules', {'pyarrow': None}):
+            with pytest.raises(ConfigError):
+                ResultStore(str(tmpdir))
+
+    def test_partition_native(self):
+        partition = ResultStore.partition({'device': 'nexus6p', 'path': 'com.app.test', 'runCount': '3'})
+
+        assert list(partition.items()) == [('device', 'nexus6p'), ('subject', 'com-app-test'), ('run', '3')]
+
+    def test_partition_web_and_arg(self):
+        partition = ResultStore.partition({'device': 'nexus6p', 'path': 'https://google.com', 'runCount': '1',
+                                           'browser': 'chrome', 'experimentArg': 'fast'})
+
+        assert list(partition.keys()) == ['device', 'subject', 'browser', 'arg', 'run']
+        assert partition['browser'] == 'chrome'
+
+    def test_to_frame_numeric_columns(self):
+        frame = ResultStore.to_frame([['a', '1', '2.5'], ['b', '3', '4']], ['name', 'count', 'value'])
+
+        assert frame['name'].tolist() == ['a', 'b']
+        assert frame['count'].tolist() == [1, 3]
+        assert frame['value'].tolist() == [2.5, 4.0]
+
+    @patch('pandas.DataFrame.to_parquet')
+    def test_writer_write(self, to_parquet, result_store, tmpdir):
+        writer = result_store.writer({'device': 'dev', 'path': 'app', 'runCount': '1'})
+
+        filename = writer.write('android', [['t', '10', '20']], ['datetime', 'cpu', 'mem'])
+
+        expected = os.path.join(str(tmpdir), 'android', 'device=dev', 'subject=app', 'run=1', 'part-0.parquet')
+        assert filename == expected
+        assert os.path.isdir(os.path.dirname(expected))
+        to_parquet.assert_called_once_with(expected, index=False)
+        assert isinstance(writer, ResultWriter)
+        assert result_store.tables() == ['android']
+
+
+def record_metrics(metrics):
+    metrics.record('tokens', 12)
+    metrics.update({'ttft': 0.5, 'tokens': 13})
+
+
+class TestRunMetrics(object):
+    def test_end_run_without_metrics(self, tmpdir):
+        run_metrics = RunMetrics(str(tmpdir))
+        run_metrics.begin_run({'runId': '1', 'device': 'dev', 'path': 'app', 'runCount': 1})
+
+        assert run_metrics.end_run(str(tmpdir)) is None
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_record_from_child_process(self, tmpdir):
+        run_metrics = RunMetrics(str(tmpdir))
+        output_dir = os.path.join(str(tmpdir), 'data', 'dev', 'app')
+        run_metrics.begin_run({'runId': '4', 'device': 'dev', 'path': 'app', 'runCount': 1})
+        process = mp.Process(target=record_metrics, args=(run_metrics.recorder(),))
+        process.start()
+        process.join()
+
+        run_file = run_metrics.end_run(output_dir)
+
+        assert run_file == os.path.join(output_dir, 'run_metrics', '4.csv')
+        with open(run_file) as f:
+            assert f.read().splitlines() == ['runId,device,path,runCount,tokens,ttft', '4,dev,app,1,13,0.5']
+        assert not os.path.exists(run_file + '.tmp')
+
+    def test_experiment_file_keeps_previous_rows(self, tmpdir):
+        with open(os.path.join(str(tmpdir), 'run_metrics.csv'), 'w') as f:
+            f.write('runId,device,path,runCount,tokens\n1,dev,app,1,10\n')
+        run_metrics = RunMetrics(str(tmpdir))
+        run_metrics.begin_run({'runId': '2', 'device': 'dev', 'path': 'app', 'runCount': 2})
+        run_metrics.recorder().record('energy', 3.5)
+
+        run_metrics.end_run(str(tmpdir))
+
+        with open(os.path.join(str(tmpdir), 'run_metrics.csv')) as f:
+            assert f.read().splitlines() == ['runId,device,path,runCount,tokens,energy',
+                                             '1,dev,app,1,10,', '2,dev,app,2,,3.5']
+
+    def test_discard(self, tmpdir):
+        run_metrics = RunMetrics(str(tmpdir))
+        for run_id in ('1', '2'):
+            run_metrics.begin_run({'runId': run_id, 'device': 'dev', 'path': 'app', 'runCount': int(run_id)})
+            run_metrics.recorder().record('tokens', 10)
+            run_metrics.end_run(str(tmpdir))
+
+        run_metrics.discard('2')
+        run_metrics.discard('3')
+
+        assert list(run_metrics.rows) == ['1']
+        with open(os.path.join(str(tmpdir), 'run_metrics.csv')) as f:
+            assert f.read().splitlines() == ['runId,device,path,runCount,tokens', '1,dev,app,1,10']
+        run_metrics.discard('1')
+        assert not os.path.exists(os.path.join(str(tmpdir), 'run_metrics.csv'))
+
+    def test_begin_run_drops_metrics_of_unfinished_run(self, tmpdir):
+        run_metrics = RunMetrics(str(tmpdir))
+        run_metrics.begin_run({'runId': '1', 'device': 'dev', 'path': 'app', 'runCount': 1})
+        run_metrics.recorder().record('tokens', 1)
+
+        run_metrics.begin_run({'runId': '2', 'device': 'dev', 'path': 'app', 'runCount': 2})
+
+        assert run_metrics.end_run(str(tmpdir)) is None
+
+
+class TestTimeline(object):
+    @pytest.fixture()
+    def device(self):
+        mock_device = Mock()
+        mock_device.id = 'dev'
+        mock_device.shell.return_value = '1000.00 3000.00'
+        return mock_device
+
+    def test_disabled(self, tmpdir, device):
+        timeline = Timeline(str(tmpdir), enabled=False)
+        timeline.begin_run({'runId': '1', 'device': 'dev'}, device)
+        with timeline.phase('before_run'):
+            pass
+
+        assert timeline.end_run(str(tmpdir)) is None
+        timeline.save()
+        assert timeline.events == []
+        assert device.shell.call_count == 0
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_run_timeline(self, tmpdir, device):
+        timeline = Timeline(str(tmpdir))
+        output_dir = os.path.join(str(tmpdir), 'data', 'dev', 'app')
+        timeline.begin_run({'runId': '3', 'device': 'dev'}, device)
+        with timeline.phase('after_run'):
+            with timeline.phase('collect_results'):
+                pass
+        with timeline.phase('interaction', MEASURED):
+            pass
+
+        run_file = timeline.end_run(output_dir)
+
+        assert run_file == os.path.join(output_dir, 'timeline', '3.json')
+        with open(run_file) as f:
+            trace = json.load(f)
+        events = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+        assert [event['name'] for event in events] == ['collect_results', 'after_run', 'interaction']
+        assert events[1]['ts'] <= events[0]['ts'] and events[0]['dur'] <= events[1]['dur']
+        assert all(event['args']['runId'] == '3' for event in events)
+        assert all(event['args']['device_uptime'] >= 1000 for event in events)
+        assert trace['otherData']['runId'] == '3'
+        assert trace['otherData']['measured_ms'] == round(events[2]['dur'] / 1e3, 3)
+        assert {'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'dev'}} in trace['traceEvents']
+        # The timeline of the experiment is only written when it finishes
+        assert not os.path.exists(os.path.join(str(tmpdir), 'timeline.json'))
+
+    def test_run_timeline_only_has_run_events(self, tmpdir, device):
+        timeline = Timeline(str(tmpdir))
+        for run_id in ('1', '2'):
+            timeline.begin_run({'runId': run_id, 'device': 'dev'}, device)
+            with timeline.phase('interaction', MEASURED):
+                pass
+            run_file = timeline.end_run(str(tmpdir))
+
+        with open(run_file) as f:
+            trace = json.load(f)
+        events = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+        assert [event['args']['runId'] for event in events] == ['2']
+        assert timeline.run_start == 1
+
+    def test_device_uptime_unavailable(self, tmpdir, device):
+        device.shell.side_effect = AdbError('error: device offline')
+        timeline = Timeline(str(tmpdir))
+        timeline.begin_run({'runId': '1', 'device': 'dev'}, device)
+        with timeline.phase('before_run'):
+            pass
+
+        assert 'device_uptime' not in timeline.events[0]['args']
+
+    def test_summary(self, tmpdir, device):
+        timeline = Timeline(str(tmpdir))
+        for run_id in ('1', '2'):
+            timeline.begin_run({'runId': run_id, 'device': 'dev'}, device)
+            with timeline.phase('interaction', MEASURED):
+                pass
+            timeline.end_run(str(tmpdir))
+        with timeline.phase('aggregate_end'):
+            pass
+        timeline.save()
+
+        with open(os.path.join(str(tmpdir), 'timeline.json')) as f:
+            trace = json.load(f)
+        summary = trace['otherData']
+        assert summary['runs'] == 2
+        assert list(summary['phases_ms'].keys()) == ['interaction', 'aggregate_end']
+        assert summary['overhead_ms'] == pytest.approx(summary['total_ms'] - summary['measured_ms'], abs=1e-9)
+        assert 'runId' not in trace['traceEvents'][-1]['args']
+
+
+class TestClockSync(object):
+    @staticmethod
+    def fake_device(realtime_offset, boottime_offset):
+        """A device whose clocks are the host monotonic clock plus the given offsets"""
+        mock_device = Mock()
+        mock_device.id = 'dev'
+
+        def shell(cmd):
+            now = clock_sync.time.monotonic()
+            # /proc/uptime is truncated to 10 ms
+            uptime = int((now + boottime_offset) * 100) / 100.0
+            return '%.9f %.2f 1234.56' % (now + realtime_offset, uptime)
+        mock_device.shell.side_effect = shell
+        return mock_device
+
+    def test_sync(self):
+        sync = ClockSync(probes=20).sync(self.fake_device(1.7e9, 5000.0))
+
+        assert sync['probes'] == 20
+        assert sync['offsets']['device_realtime'] == pytest.approx(1.7e9, abs=sync['uncertainty']['device_realtime'] + 1e-3)
+        assert sync['offsets']['device_boottime'] == pytest.approx(5000.0, abs=sync['uncertainty']['device_boottime'])
+        assert sync['offsets']['host_monotonic'] == 0.0
+
+    def test_sync_invalid_probes(self):
+        mock_device = Mock()
+        mock_device.id = 'dev'
+        mock_device.shell.return_value = 'date: invalid format'
+        with pytest.raises(ValueError):
+            ClockSync(probes=2).sync(mock_device)
+
+    def test_drift_and_to_timebase(self):
+        begin = {'host_monotonic': 100.0, 'offsets': {'device_realtime': 50.0}}
+        end = {'host_monotonic': 200.0, 'offsets': {'device_realtime': 50.001}}
+
+        assert ClockSync.drift(begin, end)['device_realtime'] == pytest.approx(10.0)
+        # Halfway the run the offset is 50.0005
+        assert ClockSync.to_timebase('device_realtime', 200.0005, begin, end) == pytest.approx(150.0)
+        assert ClockSync.to_timebase('device_realtime', 200.0, begin) == pytest.approx(150.0)
+
+    def test_run(self, tmpdir):
+        mock_device = self.fake_device(10.0, 20.0)
+        syncer = ClockSync(probes=3)
+        syncer.begin_run(mock_device)
+        filename = syncer.end_run(mock_device, str(tmpdir), '5', {'android': 'device_realtime', 'monsoon': None})
+
+        assert filename == os.path.join(str(tmpdir), 'clock_sync', '5.json')
+        with open(filename) as f:
+            data = json.load(f)
+        assert data['runId'] == '5'
+        assert data['timebase'] == 'host_monotonic'
+        assert data['profilers'] == {'android': 'device_realtime', 'monsoon': None}
+        assert set(data['drift_ppm'].keys()) == {'host_monotonic', 'host_realtime', 'device_realtime',
+                                                 'device_boottime'}
+        assert mock_device.shell.call_count == 6
+
+    def test_run_sync_failed(self, tmpdir):
+        mock_device = Mock()
+        mock_device.id = 'dev'
+        mock_device.shell.side_effect = AdbError('error: device offline')
+        syncer = ClockSync(probes=2)
+        syncer.begin_run(mock_device)
+
+        assert syncer.end_run(mock_device, str(tmpdir), '1', {}) is None
+        assert mock_device.shell.call_count == 1
+        assert os.listdir(str(tmpdir)) == []
+
+
+class TestAdaptiveCooldown(object):
+    OUTPUT = 'thermal {}\nthermal -1\ncpu_freq {}\ncpu_freq {}\nbattery_current {}'
+
+    def fake_device(self, *outputs):
+        mock_device = Mock()
+        mock_device.id = 'dev'
+        mock_device.shell.side_effect = [self.OUTPUT.format(*values) for values in outputs]
+        return mock_device
+
+    def test_parse(self):
+        readings = AdaptiveCooldown.parse(self.OUTPUT.format(41500, 1000000, 2000000, -350000) + '\ncpu_freq ')
+
+        assert readings == {'temperature': 41.5, 'cpu_freq': 1500000, 'battery_current': 350000}
+
+    def test_parse_no_readings(self):
+        assert AdaptiveCooldown.parse('thermal \nbattery_current ') == {}
+
+    def test_invalid_config(self):
+        with pytest.raises(ConfigError):
+            AdaptiveCooldown({'thermal': 1.0})
+        with pytest.raises(ConfigError):
+            AdaptiveCooldown({'thermal_band': 'hot'})
+        with pytest.raises(ConfigError):
+            AdaptiveCooldown({'min_wait': 1000, 'max_wait': 500})
+
+    @patch('AndroidRunner.Cooldown.time.sleep')
+    def test_wait_settled(self, sleep):
+        cooldown = AdaptiveCooldown({'min_wait': 1000, 'poll_interval': 500})
+        mock_device = self.fake_device((40000, 1000000, 1000000, 300000), (45000, 1000000, 1000000, 300000),
+                                       (40500, 1100000, 1100000, 300000))
+        cooldown.set_baseline(mock_device)
+
+        result = cooldown.wait(mock_device)
+
+        assert result['cooldown_reason'] == SETTLED
+        assert result['cooldown_temperature'] == 40.5
+        assert sleep.mock_calls == [call(1.0), call(0.5)]
+
+    @patch('AndroidRunner.Cooldown.time.sleep')
+    @patch('AndroidRunner.Cooldown.time.monotonic')
+    def test_wait_max_wait(self, monotonic, sleep):
+        monotonic.side_effect = [0.0, 2.0, 4.0, 4.0]
+        cooldown = AdaptiveCooldown({'max_wait': 3000, 'poll_interval': 2000, 'thermal_band': None})
+        mock_device = self.fake_device((40000, 1000000, 1000000, 300000), (40000, 2000000, 2000000, 300000),
+                                       (40000, 2000000, 2000000, 300000))
+        cooldown.set_baseline(mock_device)
+
+        result = cooldown.wait(mock_device)
+
+        assert result['cooldown_reason'] == MAX_WAIT
+        assert result['cooldown_ms'] == 4000
+        assert sleep.mock_calls == [call(0.0), call(1.0)]
+
+    @patch('AndroidRunner.Cooldown.time.sleep')
+    @patch('AndroidRunner.Cooldown.time.monotonic')
+    def test_wait_read_error(self, monotonic, sleep):
+        monotonic.side_effect = [0.0, 1.0, 1.0]
+        cooldown = AdaptiveCooldown({'max_wait': 1000})
+        mock_device = self.fake_device((40000, 1000000, 1000000, 300000))
+        cooldown.set_baseline(mock_device)
+        mock_device.shell.side_effect = AdbError('error: device offline')
+
+        assert cooldown.wait(mock_device)['cooldown_reason'] == MAX_WAIT
+
+    @patch('AndroidRunner.Cooldown.time.sleep')
+    def test_wait_without_baseline(self, sleep):
+        mock_device = Mock()
+        mock_device.id = 'dev'
+
+        result = AdaptiveCooldown({'min_wait': 200}).wait(mock_device)
+
+        assert result['cooldown_reason'] == SETTLED
+        mock_device.shell.assert_not_called()
+        assert sleep.mock_calls == [call(0.2)]
+
+
+class TestRunValidator(object):
+    RUN = {'device': 'dev', 'path': 'app', 'runId': '1'}
+
+    def test_invalid_config(self, tmpdir):
+        with pytest.raises(ConfigError):
+            RunValidator({'retry': 1}, str(tmpdir))
+        with pytest.raises(ConfigError):
+            RunValidator({'threshold': 0}, str(tmpdir))
+        with pytest.raises(ConfigError):
+            RunValidator({'min_runs': 0}, str(tmpdir))
+
+    def test_run_metrics(self, tmpdir):
+        run_dir = str(tmpdir)
+        makedirs(os.path.join(run_dir, 'android'))
+        makedirs(os.path.join(run_dir, 'run_metrics'))
+        files = [os.path.join(run_dir, 'android', 'a.csv'), os.path.join(run_dir, 'android', 'b.txt'),
+                 os.path.join(run_dir, 'run_metrics', '1.csv')]
+        for filename in files:
+            with open(filename, 'w') as f:
+                f.write('header\n1\n2\n')
+
+        metrics = RunValidator({}, run_dir).run_metrics(
+            1200.0, {'runId': '1', 'energy': '3.5', 'label': 'x', 'cooldown_ms': 100}, run_dir, files)
+
+        assert metrics == {'interaction_ms': 1200.0, 'energy': 3.5, 'files_android': 2, 'rows_android': 2}
+
+    def test_run_metrics_selected(self, tmpdir):
+        metrics = RunValidator({'metrics': ['energy']}, str(tmpdir)).run_metrics(1200.0, {'energy': 3}, str(tmpdir), [])
+
+        assert metrics == {'energy': 3.0}
+
+    def test_check(self, tmpdir):
+        validator = RunValidator({'min_runs': 3}, str(tmpdir))
+        for energy in (10.0, 10.4, 9.8):
+            assert validator.check(self.RUN, {'energy': energy, 'rows_android': 100}) == []
+            validator.accept(self.RUN, {'energy': energy, 'rows_android': 100})
+
+        assert validator.check(self.RUN, {'energy': 10.2, 'rows_android': 101}) == []
+        assert validator.check(self.RUN, {'energy': 14.0, 'rows_android': 100})[0].startswith('energy=14.0')
+        assert validator.check(self.RUN, {'energy': 10.1}) == ['rows_android missing']
+        assert validator.check(dict(self.RUN, path='other'), {'energy': 14.0}) == []
+
+    def test_check_watchdog_resets(self, tmpdir):
+        validator = RunValidator({'min_runs': 3, 'metrics': ['energy']}, str(tmpdir))
+        metrics = validator.run_metrics(1200.0, {'energy': 10.0, 'watchdog_anomalies': '2', 'watchdog_resets': '1'},
+                                        str(tmpdir), [])
+
+        assert metrics == {'energy': 10.0, 'watchdog_resets': 1.0}
+        # The first run of a subject is never rejected
+        assert validator.check(self.RUN, metrics) == []
+        validator.accept(self.RUN, {'energy': 10.0, 'watchdog_resets': 0.0})
+        assert validator.check(self.RUN, metrics) == ['watchdog_resets=1']
+        assert validator.check(self.RUN, {'energy': 10.0, 'watchdog_resets': 0.0}) == []
+        for _ in range(2):
+            validator.accept(self.RUN, {'energy': 10.0, 'watchdog_resets': 0.0})
+        assert validator.check(self.RUN, metrics) == ['watchdog_resets=1']
+
+    def test_check_persistent_watchdog_anomalies(self, tmpdir):
+        validator = RunValidator({'min_runs': 3}, str(tmpdir))
+        for _ in range(3):
+            validator.accept(self.RUN, validator.run_metrics(
+                1200.0, {'energy': 10.0, 'watchdog_anomalies': '0', 'watchdog_resets': '0'}, str(tmpdir), []))
+
+        # A hot device or a low battery is only flagged in run_metrics.csv
+        metrics = validator.run_metrics(1200.0, {'energy': 10.0, 'watchdog_anomalies': '1', 'watchdog_resets': '0'},
+                                        str(tmpdir), [])
+        assert validator.check(self.RUN, metrics) == []
+
+
+class TestSequentialStopping(object):
+    RUN = {'device': 'dev', 'path': 'app', 'runId': '1'}
+
+    def test_invalid_config(self, tmpdir):
+        with pytest.raises(ConfigError):
+            SequentialStopping({}, str(tmpdir))
+        with pytest.raises(ConfigError):
+            SequentialStopping({'metric': 'energy', 'confidence': 95}, str(tmpdir))
+        with pytest.raises(ConfigError):
+            SequentialStopping({'metric': 'energy', 'min_runs': 1}, str(tmpdir))
+
+    def test_add(self, tmpdir):
+        stopping = SequentialStopping({'metric': 'energy', 'min_runs': 3, 'relative_width': 0.05}, str(tmpdir))
+
+        assert not stopping.add(self.RUN, 10.0)
+        assert not stopping.add(self.RUN, 13.0)
+        assert not stopping.add(self.RUN, 8.0)
+        assert not stopping.add(self.RUN, None)
+        for _ in range(20):
+            stopping.add(self.RUN, 10.0)
+        assert stopping.add(self.RUN, 10.0)
+
+    def test_load(self, tmpdir):
+        stopping = SequentialStopping({'metric': 'energy'}, str(tmpdir))
+
+        stopping.load([{'device': 'dev', 'path': 'app', 'browser': '', 'energy': '10.5'},
+                       {'device': 'dev', 'path': 'app', 'browser': '', 'energy': 'n/a'}])
+
+        assert stopping.stats[stopping.subject(self.RUN)].count('energy') == 1
@@ -0,0 +1,361 @@
+import importlib
+import json
+import os.path as op
+from collections import Counter
+
+import pytest
+from mock import MagicMock, Mock, call, patch
+
+import paths
+from Experiment_OnDevice.Scripts import Interactive_LLM, after_subject, before_subject
+from Experiment_OnDevice.Scripts.llm_runner import (DEFAULT_CONFIG, LLMRunner, LLMRunResult, LLMServer, MarkerSearch,
+                                                    load_llm_config, parse_timings)
+from Experiment_OnDevice.Scripts.prompt_schedule import Prompt, PromptSchedule, load_prompts
+
+LLAMA_REPORT = ('llama_perf_context_print:        load time =     812.50 ms\n'
+                'llama_perf_context_print: prompt eval time =     400.00 ms /    20 tokens\n'
+                'llama_perf_context_print:        eval time =    2000.00 ms /    50 runs\n'
+                'llama_perf_context_print:       total time =    2500.00 ms /    70 tokens\n'
+                '\tMax RSS (KiB): 123456\n')
+
+
+class TestMarkerSearch(object):
+    def test_marker_in_one_chunk(self):
+        search = MarkerSearch('RUN_DONE')
+
+        assert search.feed(b'hello ') == b'hello '
+        assert search.feed(b'world RUN_DONE 0\n') == b'world '
+        assert search.found
+        assert search.after == b' 0\n'
+        assert search.feed(b'more') == b''
+
+    def test_marker_split_over_chunks(self):
+        search = MarkerSearch('RUN_DONE')
+
+        assert search.feed(b'text RUN') == b'text RUN'
+        assert search.feed(b'_DONE 1\n') == b''
+        assert search.found
+        assert search.leaked == 3
+        assert search.after == b' 1\n'
+
+    def test_no_marker(self):
+        search = MarkerSearch('RUN_DONE')
+
+        assert search.feed(b'RUN_ ') == b'RUN_ '
+        assert search.feed(b'DONE') == b'DONE'
+        assert not search.found
+
+
+class TestParseTimings(object):
+    def test_llama_cli_report(self):
+        timings = parse_timings(LLAMA_REPORT)
+
+        assert timings['load_ms'] == 812.5
+        assert timings['prefill_ms'] == 400.0
+        assert timings['prompt_tokens'] == 20
+        assert timings['prefill_tokens_per_sec'] == pytest.approx(50.0)
+        assert timings['decode_ms'] == 2000.0
+        assert timings['decode_tokens'] == 50
+        assert timings['decode_ms_per_token'] == pytest.approx(40.0)
+        assert timings['decode_tokens_per_sec'] == pytest.approx(25.0)
+        assert timings['total_ms'] == 2500.0
+        assert timings['peak_rss_kb'] == 123456
+
+    def test_gnu_time_and_old_llama(self):
+        timings = parse_timings('llama_print_timings: eval time = 100.00 ms / 4 runs\n'
+                                'Maximum resident set size (kbytes): 2048\n')
+
+        assert timings['decode_tokens'] == 4
+        assert timings['prefill_ms'] is None
+        assert timings['peak_rss_kb'] == 2048
+
+    def test_empty_report(self):
+        assert set(parse_timings('').values()) == {None}
+
+
+class TestLLMRunner(object):
+    @pytest.fixture()
+    def config(self):
+        return dict(DEFAULT_CONFIG, model='/data/local/tmp/model.gguf', timeout=10)
+
+    def test_device_command(self, config):
+        command = LLMRunner(config, 'serial').device_command("it's")
+
+        assert "--prompt 'it'\\''s' 2>/data/local/tmp/llm_stderr.txt; echo RUN_DONE $?;" in command
+        assert command.startswith('cd /data/local/tmp && LD_LIBRARY_PATH=/data/local/tmp toybox time -v ')
+
+    def test_adb_command(self, config):
+        assert LLMRunner(config, 'serial').adb_command('shell', 'ls') == ['adb', '-s', 'serial', 'shell', 'ls']
+        assert LLMRunner(config).adb_command('shell', 'ls') == ['adb', 'shell', 'ls']
+
+    def test_stream(self, config):
+        script = ('printf "Hello "; sleep 0.1; printf "world RUN_"; sleep 0.1; printf "DONE 3\\n"; '
+                  'printf "%s"' % LLAMA_REPORT.replace('\n', '\\n').replace('\t', '\\t'))
+
+        result = LLMRunner(config).stream(['sh', '-c', script], LLMRunResult('prompt'))
+
+        assert result.marker_found
+        assert result.text == 'Hello world '
+        assert result.return_code == 3
+        assert result.timings['decode_tokens'] == 50
+        assert result.first_token_time is not None
+        assert result.duration > 0
+        assert 'RUN_DONE' not in result.report
+
+    def test_stream_without_marker(self, config):
+        result = LLMRunner(config).stream(['sh', '-c', 'printf "partial"; exit 2'], LLMRunResult('prompt'))
+
+        assert not result.marker_found
+        assert result.text == 'partial'
+        assert result.return_code == 2
+
+
+class TestLLMServer(object):
+    @pytest.fixture()
+    def config(self):
+        return dict(DEFAULT_CONFIG, model='/data/local/tmp/model.gguf', server_timeout=1)
+
+    @pytest.fixture()
+    def server(self, config, tmpdir):
+        server = LLMServer(config, 'serial', str(tmpdir))
+        server.adb = Mock(return_value=Mock(stdout='1234\n'))
+        server.POLL_INTERVAL = 0
+        return server
+
+    @staticmethod
+    def health(*statuses):
+        connections = []
+        for status in statuses:
+            connection = Mock()
+            connection.getresponse.return_value.status = status
+            connections.append(connection)
+        return connections
+
+    def test_start(self, server, tmpdir):
+        with patch('http.client.HTTPConnection', side_effect=self.health(503, 200)) as connection:
+            startup_sec = server.start()
+
+        assert startup_sec >= 0
+        assert connection.call_count == 2
+        assert server.adb.call_args_list[1] == call('forward', 'tcp:8080', 'tcp:8080')
+        assert server.running
+        with open(op.join(str(tmpdir), 'llm', 'server.json')) as f:
+            state = json.load(f)
+        assert state['pid'] == 1234
+        assert state['requests'] == 0
+        assert state['startup_sec'] == startup_sec
+
+    def test_start_fails(self, server):
+        server.adb.return_value = Mock(stdout='not found\n')
+
+        with pytest.raises(RuntimeError):
+            server.start()
+
+    def test_start_not_ready(self, server):
+        with patch('http.client.HTTPConnection', side_effect=OSError('refused')):
+            with patch('time.monotonic', side_effect=[0, 0, 2, 2]):
+                with pytest.raises(RuntimeError):
+                    server.start()
+
+        assert call('shell', 'kill 1234') in server.adb.call_args_list
+        assert not server.running
+
+    def test_state_is_shared(self, server, config, tmpdir):
+        with patch('http.client.HTTPConnection', side_effect=self.health(200)):
+            server.start()
+
+        other = LLMServer(config, 'serial', str(tmpdir))
+
+        assert other.running
+        assert other.state['pid'] == 1234
+
+    def test_stop(self, server, config, tmpdir):
+        with patch('http.client.HTTPConnection', side_effect=self.health(200)):
+            server.start()
+        server.adb.reset_mock()
+
+        server.stop()
+
+        assert server.adb.call_args_list == [call('shell', 'kill 1234'), call('forward', '--remove', 'tcp:8080')]
+        assert not LLMServer(config, 'serial', str(tmpdir)).running
+
+    def test_stop_not_started(self, server):
+        server.stop()
+
+        assert server.adb.call_count == 0
+
+    def test_start_stops_running_server(self, server):
+        with patch('http.client.HTTPConnection', side_effect=self.health(200, 200)):
+            server.start()
+            server.start()
+
+        assert call('shell', 'kill 1234') in server.adb.call_args_list
+
+
+class TestLLMScripts(object):
+    @pytest.fixture()
+    def config_file(self, tmpdir):
+        with open(op.join(str(tmpdir), 'Prompts.txt'), 'w') as f:
+            f.write('A small prompt\n' + ' '.join(['word'] * 60) + '\n')
+        config_file = op.join(str(tmpdir), 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump({'llm': {'model': '/data/local/tmp/model.gguf', 'mode': 'warm'}}, f)
+        paths.ORIGINAL_CONFIG_DIR = config_file
+        paths.OUTPUT_DIR = op.join(str(tmpdir), 'output')
+        return config_file
+
+    @pytest.fixture()
+    def interactive_llm(self, config_file):
+        # The experiment loads its scripts after the config is known
+        return importlib.reload(Interactive_LLM)
+
+    @staticmethod
+    def completion(*contents):
+        connection = MagicMock()
+        response = connection.getresponse.return_value
+        response.status = 200
+        lines = [('data: %s\n' % json.dumps({'content': content})).encode() for content in contents]
+        lines.append(('data: %s\n' % json.dumps({'content': '', 'stop': True,
+                                                  'timings': {'prompt_ms': 10.0, 'prompt_n': 3,
+                                                              'predicted_ms': 20.0, 'predicted_n': 2}})).encode())
+        response.__iter__.return_value = lines
+        return connection
+
+    @patch('Experiment_OnDevice.Scripts.llm_runner.subprocess.run')
+    def test_warm_runs_reuse_server(self, adb, interactive_llm):
+        adb.return_value = Mock(stdout='1234\n')
+        device = Mock(id='serial')
+        with patch('http.client.HTTPConnection', return_value=self.completion()):
+            before_subject.main(device)
+        adb.reset_mock()
+        adb.return_value = Mock(stdout='VmHWM:    2048 kB\n')
+        metrics = [{}, {}]
+
+        for i, run_metrics in enumerate(metrics):
+            with patch('http.client.HTTPConnection', return_value=self.completion('Hi', '!')):
+                interactive_llm.main(device, current_run={'runId': str(i + 1), 'runCount': str(i + 1)},
+                                     metrics=run_metrics)
+
+        assert [run_metrics['server_request'] for run_metrics in metrics] == [1, 2]
+        assert metrics[0]['server_startup_sec'] == metrics[1]['server_startup_sec']
+        assert metrics[1]['decode_tokens'] == 2
+        assert metrics[1]['peak_rss_kb'] == 2048
+        assert metrics[0]['prompt_size'] != metrics[1]['prompt_size']
+        # Only the peak RSS is read, the server is not started again
+        assert all(c[0][0][-2:] == ['shell', 'cat /proc/1234/status'] for c in adb.call_args_list)
+        assert op.isfile(op.join(paths.OUTPUT_DIR, 'llm', 'tokens_2.csv'))
+
+    @patch('Experiment_OnDevice.Scripts.Interactive_LLM.load_prompts')
+    @patch('Experiment_OnDevice.Scripts.Interactive_LLM.load_llm_config')
+    @patch('Experiment_OnDevice.Scripts.llm_runner.subprocess.run')
+    def test_schedule_loaded_once(self, adb, load_llm_config_mock, load_prompts_mock, interactive_llm):
+        schedule = interactive_llm.schedule
+        adb.return_value = Mock(stdout='1234\n')
+        device = Mock(id='serial')
+        with patch('http.client.HTTPConnection', return_value=self.completion()):
+            before_subject.main(device)
+
+        with patch('http.client.HTTPConnection', return_value=self.completion('Hi')):
+            interactive_llm.main(device, current_run={'runId': '1', 'runCount': '1'}, metrics={})
+
+        assert interactive_llm.schedule is schedule
+        load_llm_config_mock.assert_not_called()
+        load_prompts_mock.assert_not_called()
+
+    @patch('Experiment_OnDevice.Scripts.llm_runner.subprocess.run')
+    def test_after_subject_stops_server(self, adb, config_file):
+        adb.return_value = Mock(stdout='1234\n')
+        device = Mock(id='serial')
+        with patch('http.client.HTTPConnection', return_value=self.completion()):
+            before_subject.main(device)
+        adb.reset_mock()
+
+        after_subject.main(device)
+
+        assert [c[0][0][-2:] for c in adb.call_args_list] == [['shell', 'kill 1234'], ['--remove', 'tcp:8080']]
+        assert not LLMServer(load_llm_config(config_file), 'serial').running
+        with pytest.raises(RuntimeError):
+            LLMServer(load_llm_config(config_file), 'serial').complete('prompt')
+
+    @patch('Experiment_OnDevice.Scripts.llm_runner.subprocess.run')
+    def test_cold_mode_does_not_start_server(self, adb, config_file):
+        with open(config_file, 'w') as f:
+            json.dump({'llm': {'model': '/data/local/tmp/model.gguf'}}, f)
+
+        before_subject.main(Mock(id='serial'))
+        after_subject.main(Mock(id='serial'))
+
+        assert adb.call_count == 0
+
+
+class TestPromptSchedule(object):
+    @pytest.fixture()
+    def prompts(self):
+        return [Prompt(i, 'prompt %s' % i, 5 if i <= 4 else 80, 'small' if i <= 4 else 'big') for i in range(1, 9)]
+
+    @staticmethod
+    def schedule_ids(schedule, runs, stratum=None):
+        return [schedule.prompt(run, stratum).id for run in range(1, runs + 1)]
+
+    def test_load_prompts(self, tmpdir):
+        prompt_file = op.join(str(tmpdir), 'Prompts.txt')
+        with open(prompt_file, 'w') as f:
+            f.write('one two three\n\n%s\n' % ' '.join(['word'] * 51))
+
+        prompts = load_prompts(prompt_file, big_prompt_words=50)
+
+        assert [(p.id, p.words, p.category) for p in prompts] == [(1, 3, 'small'), (3, 51, 'big')]
+
+    def test_load_prompts_empty(self, tmpdir):
+        prompt_file = op.join(str(tmpdir), 'Prompts.txt')
+        open(prompt_file, 'w').close()
+
+        with pytest.raises(ValueError):
+            load_prompts(prompt_file)
+
+    @pytest.mark.parametrize('strategy', ['stratified', 'latin_square', 'random'])
+    def test_seed_reproducible(self, prompts, strategy):
+        first = self.schedule_ids(PromptSchedule(prompts, strategy, seed=7), 24)
+        again = self.schedule_ids(PromptSchedule(list(prompts), strategy, seed=7), 24)
+        other = self.schedule_ids(PromptSchedule(prompts, strategy, seed=8), 24)
+
+        assert first == again
+        assert first != other
+
+    def test_run_only_depends_on_run_count(self, prompts):
+        schedule = PromptSchedule(prompts, seed=3)
+        in_order = self.schedule_ids(schedule, 10)
+
+        assert [schedule.prompt(run).id for run in range(10, 0, -1)] == in_order[::-1]
+
+    def test_stratified_balance(self, prompts):
+        schedule = PromptSchedule(prompts, 'stratified', seed=1)
+
+        selected = [schedule.prompt(run) for run in range(1, 17)]
+
+        # The strata take turns, every prompt of a stratum is used once per pass over the stratum
+        assert [prompt.category for prompt in selected] == ['big', 'small'] * 8
+        assert set(Counter(prompt.id for prompt in selected[:8]).values()) == {1}
+        assert set(Counter(prompt.id for prompt in selected).values()) == {2}
+
+    def test_latin_square_positions(self, prompts):
+        schedule = PromptSchedule(prompts, 'latin_square', seed=1)
+
+        ids = self.schedule_ids(schedule, 16, 'small')
+        passes = [ids[i:i + 4] for i in range(0, 16, 4)]
+
+        for position in range(4):
+            assert sorted(p[position] for p in passes) == [1, 2, 3, 4]
+        for block in passes:
+            assert sorted(block) == [1, 2, 3, 4]
+
+    def test_stratum_argument(self, prompts):
+        schedule = PromptSchedule(prompts, 'random', seed=1)
+
+        assert {schedule.prompt(run, 'big').category for run in range(1, 20)} == {'big'}
+        with pytest.raises(ValueError):
+            schedule.prompt(1, 'medium')
+
+    def test_unknown_strategy(self, prompts):
+        with pytest.raises(ValueError):
+            PromptSchedule(prompts, 'round_robin')
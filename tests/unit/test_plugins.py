@@ -1,5 +1,6 @@
 import copy
 import csv
+import os
 import os.path as op
 
 import pytest
@@ -209,6 +210,19 @@ class TestAndroidPlugin(object):
         assert android_plugin.data[1] == ['device_time', 'cpu_usage', 'mem_usage']
         timer_mock.assert_called_once_with(100, android_plugin.get_data, args=(mock_device, 'app'))
         mock_timer_result.start.assert_called_once()
+        mock_device.shell.assert_called_once_with('date -u')
+
+    @patch('threading.Timer')
+    def test_get_data_clock_sync(self, timer_mock, android_plugin, mock_device):
+        mock_device.shell.return_value = '2026-10-19T18:20:13.123456789Z'
+        android_plugin.data_points = []
+        android_plugin.profile = True
+        android_plugin.set_clock_sync(True)
+
+        android_plugin.get_data(mock_device, 'app')
+
+        assert android_plugin.data[1] == ['2026-10-19T18:20:13.123456789Z']
+        mock_device.shell.assert_called_once_with('date -u +%Y-%m-%dT%H:%M:%S.%NZ')
 
     def test_get_data_race(self, android_plugin, mock_device):
         android_plugin.profile = False
@@ -257,6 +271,14 @@ class TestAndroidPlugin(object):
 
         assert android_plugin.profile is False
 
+    def test_discard_results(self, android_plugin, tmpdir):
+        android_plugin.subject_stats.record(str(tmpdir), 'run1.csv', {'cpu': 10.0})
+        android_plugin.subject_stats.record(str(tmpdir), 'run2.csv', {'cpu': 30.0})
+
+        android_plugin.discard_results([op.join(str(tmpdir), 'run2.csv'), str(tmpdir)])
+
+        assert android_plugin.subject_stats.means(str(tmpdir)) == {'cpu': 10.0}
+
     @patch('time.strftime')
     def test_collect_results(self, time_mock, android_plugin, mock_device, tmpdir, fixture_dir):
         test_output_dir = str(tmpdir)
@@ -275,6 +297,19 @@ class TestAndroidPlugin(object):
         file_content_original = self.get_dataset(op.join(fixture_dir, 'test_android_output.csv'))
         assert file_content_created == file_content_original
 
+    @patch('time.strftime')
+    def test_collect_results_result_writer(self, time_mock, android_plugin, mock_device, tmpdir, fixture_dir):
+        time_mock.return_value = 'experiment_time'
+        mock_device.id = 'device_id'
+        android_plugin.data = self.csv_reader_to_table(op.join(fixture_dir, 'test_android_output.csv'))
+        android_plugin.output_dir = str(tmpdir)
+        result_writer = Mock()
+        android_plugin.set_result_writer(result_writer)
+
+        android_plugin.collect_results(mock_device)
+
+        result_writer.write.assert_called_once_with('android', android_plugin.data[1:], android_plugin.data[0])
+
     def test_set_output(self, android_plugin):
         test_output_dir = "asdfgbfsdgbf/hjbdsfavav"
         android_plugin.set_output(test_output_dir)
@@ -326,6 +361,44 @@ class TestAndroidPlugin(object):
         assert test_logs_aggregated['android_cpu'] == 32.94186117467583
         assert test_logs_aggregated['android_mem'] == 1131976.3141113652
 
+    @patch('AndroidRunner.util.write_to_file')
+    @patch('time.strftime')
+    def test_aggregate_subject_running_stats(self, time_mock, write_to_file_mock, android_plugin, mock_device,
+                                             tmpdir, fixture_dir):
+        test_subject_log_dir = op.join(fixture_dir, 'android_subject_result')
+        run_files = sorted(os.listdir(test_subject_log_dir))
+        time_mock.side_effect = ['run_%s' % i for i in range(len(run_files))]
+        mock_device.id = 'device_id'
+        android_plugin.output_dir = str(tmpdir)
+        for run_file in run_files:
+            android_plugin.data = self.csv_reader_to_table(op.join(test_subject_log_dir, run_file))
+            android_plugin.collect_results(mock_device)
+
+        with patch.object(Android, 'aggregate_android_subject') as aggregate_mock:
+            android_plugin.aggregate_subject()
+        assert aggregate_mock.call_count == 0
+
+        subject_row = write_to_file_mock.call_args[0][1][0]
+        assert list(subject_row.keys()) == ['android_cpu', 'android_mem']
+        assert subject_row['android_cpu'] == pytest.approx(32.94186117467583)
+        assert subject_row['android_mem'] == pytest.approx(1131976.3141113652)
+
+    @patch('AndroidRunner.util.write_to_file')
+    @patch('AndroidRunner.Plugins.android.Android.Android.aggregate_android_subject')
+    @patch('time.strftime')
+    def test_aggregate_subject_resumed(self, time_mock, aggregate_mock, write_to_file_mock, android_plugin,
+                                       mock_device, tmpdir, fixture_dir):
+        tmpdir.join('device_id_previous_run.csv').write('datetime,cpu,mem\n')
+        time_mock.return_value = 'run_1'
+        mock_device.id = 'device_id'
+        android_plugin.output_dir = str(tmpdir)
+        android_plugin.data = self.csv_reader_to_table(op.join(fixture_dir, 'test_android_output.csv'))
+        android_plugin.collect_results(mock_device)
+
+        android_plugin.aggregate_subject()
+
+        aggregate_mock.assert_called_once_with(str(tmpdir))
+
     @patch("AndroidRunner.Plugins.android.Android.Android.aggregate_android_final")
     def test_aggregate_final_web(self, aggregate_mock, android_plugin, fixture_dir):
         test_struct_dir_web = op.join(fixture_dir, 'test_dir_struct', 'data_web')
@@ -636,7 +709,8 @@ class TestTrepnPlugin(object):
         mock_manager.attach_mock(wait_until_mock, 'wait_until_managed')
         mock_manager.attach_mock(filter_results_mock, 'filter_managed')
 
-        trepn_plugin.collect_results(mock_device)
+        task = trepn_plugin.collect_results(mock_device)
+        task()
 
         expected_calls = [call.device_managed.shell(r'ls /sdcard/trepn/ | grep "\.db$"'),
                           call.device_managed.shell('am broadcast -a com.quicinc.trepn.export_to_csv '
@@ -812,6 +886,24 @@ class TestTrepnPlugin(object):
         assert test_logs_aggregated['Battery Temperature [1/10 C]'] == 300.0
         assert test_logs_aggregated['Memory Usage [KB]'] == 2650836.2352941176
 
+    @patch('AndroidRunner.util.write_to_file')
+    def test_aggregate_subject_running_stats(self, write_to_file_mock, trepn_plugin, tmpdir, fixture_dir):
+        test_subject_log_dir = op.join(fixture_dir, 'trepn_subject_result')
+        trepn_plugin.output_dir = str(tmpdir)
+        for run_file in sorted(os.listdir(test_subject_log_dir)):
+            table = self.csv_reader_to_table(op.join(test_subject_log_dir, run_file))
+            trepn_plugin.subject_stats.record(str(tmpdir), run_file, trepn_plugin.run_means(table))
+
+        with patch.object(Trepn, 'aggregate_trepn_subject') as aggregate_mock:
+            trepn_plugin.aggregate_subject()
+        assert aggregate_mock.call_count == 0
+
+        subject_row = write_to_file_mock.call_args[0][1][0]
+        expected = trepn_plugin.aggregate_trepn_subject(test_subject_log_dir)
+        assert list(subject_row.keys()) == list(expected.keys())
+        for key, value in expected.items():
+            assert subject_row[key] == pytest.approx(value)
+
     @patch("AndroidRunner.Plugins.trepn.Trepn.Trepn.aggregate_trepn_final")
     def test_aggregate_final_web(self, aggregate_mock, trepn_plugin, fixture_dir):
         test_struct_dir_web = op.join(fixture_dir, 'test_dir_struct', 'data_web')
@@ -5,6 +5,7 @@ import pytest
 from mock import MagicMock, Mock, patch, call
 
 import paths
+from AndroidRunner.AggregationPool import AggregationPool
 from AndroidRunner.PluginHandler import PluginHandler
 from AndroidRunner.Profilers import Profilers
 from AndroidRunner.util import load_json, makedirs
@@ -38,6 +39,22 @@ class TestProfilers(object):
         with pytest.raises(ImportError):
             Profilers(config)
 
+    def test_reload(self, profilers):
+        profiler1 = Mock()
+        profiler1.unload.side_effect = Exception('device offline')
+        profiler2 = Mock()
+        profilers.profilers = [profiler1, profiler2]
+        fake_device = Mock()
+        fake_device.name = 'dev'
+        profilers.loaded_devices = ['dev']
+
+        profilers.reload(fake_device)
+
+        profiler1.load.assert_called_once_with(fake_device)
+        profiler2.unload.assert_called_once_with(fake_device)
+        profiler2.load.assert_called_once_with(fake_device)
+        assert profilers.loaded_devices == ['dev']
+
     def test_dependencies(self, profilers):
         profiler1 = Mock()
         profiler1.dependencies.return_value = ["dependencie1"]
@@ -51,6 +68,27 @@ class TestProfilers(object):
         assert "dependencie1" in dependencies
         assert "dependencie2" in dependencies
 
+    def test_clocks(self, profilers):
+        profiler1 = Mock()
+        profiler1.name = 'android'
+        profiler1.clock.return_value = 'device_realtime'
+        profiler2 = Mock()
+        profiler2.name = 'monsoon'
+        profiler2.clock.return_value = None
+        profilers.profilers = [profiler1, profiler2]
+
+        assert profilers.clocks() == {'android': 'device_realtime', 'monsoon': None}
+
+    def test_set_clock_sync(self, profilers):
+        profiler1 = Mock()
+        profiler2 = Mock()
+        profilers.profilers = [profiler1, profiler2]
+
+        profilers.set_clock_sync(True)
+
+        profiler1.set_clock_sync.assert_called_once_with(True)
+        profiler2.set_clock_sync.assert_called_once_with(True)
+
     def test_load_empty(self, profilers):
         fake_device = Mock
         fake_device.name = "fake_device"
@@ -112,9 +150,11 @@ class TestProfilers(object):
         m = MagicMock()
         m.__iter__.return_value = [profiler1, profiler2]
         profilers.profilers = m
-        profilers.collect_results(fake_device)
+        profiler1.collect_results.return_value = None
+        tasks = profilers.collect_results(fake_device)
         profiler1.collect_results.assert_called_once_with(fake_device)
         profiler2.collect_results.assert_called_once_with(fake_device)
+        assert tasks == [profiler2.collect_results.return_value]
 
     def test_unload(self, profilers):
         fake_device = Mock()
@@ -157,6 +197,63 @@ class TestProfilers(object):
         profiler1.aggregate_data_end.assert_called_once_with("fake/dir/path")
         profiler2.aggregate_data_end.assert_called_once_with("fake/dir/path")
 
+    @patch('multiprocessing.get_all_start_methods')
+    def test_aggregate_end_parallel(self, start_methods, profilers):
+        start_methods.return_value = ['spawn']
+        custom = Mock()
+        custom.default_end_aggregation.return_value = False
+        whole = Mock()
+        whole.default_end_aggregation.return_value = True
+        whole.subject_aggregated = False
+        whole.subject_dirs.return_value = ['subject/1', 'subject/2']
+        whole.aggregate_end_shards.return_value = None
+        whole.result_file.return_value = 'whole.csv'
+        split = Mock()
+        split.default_end_aggregation.return_value = True
+        split.subject_aggregated = True
+        split.aggregate_end_shards.return_value = ['shard1', 'shard2']
+        split.aggregate_end_shard.side_effect = ['result1', 'result2']
+        split.result_file.return_value = 'split.csv'
+        profilers.profilers = [custom, whole, split]
+
+        profilers.aggregate_end('fake/dir/path', workers=4)
+
+        custom.aggregate_data_end.assert_called_once_with('fake/dir/path')
+        assert whole.aggregate_subject_dir.mock_calls == [call('subject/1'), call('subject/2')]
+        whole.aggregate_end.assert_called_once_with(os.path.join('fake/dir/path', 'data'), 'whole.csv')
+        assert split.aggregate_subject_dir.call_count == 0
+        split.aggregate_end_merge.assert_called_once_with(['result1', 'result2'], 'split.csv')
+        assert whole.aggregate_data_end.call_count == 0
+
+
+class Shard(object):
+    def __init__(self, offset):
+        self.offset = offset
+
+    def add(self, value):
+        return self.offset + value
+
+
+class TestAggregationPool(object):
+    def test_map_sequential(self):
+        pool = AggregationPool(1)
+
+        results = pool.map([Shard(10), Shard(20)], [(1, 'add', (1,)), (0, 'add', (2,))])
+
+        assert pool.parallel is False
+        assert results == [21, 12]
+
+    def test_map_parallel_keeps_order(self):
+        pool = AggregationPool(3)
+        shards = [(i % 2, 'add', (i,)) for i in range(8)]
+
+        results = pool.map([Shard(0), Shard(100)], shards)
+
+        assert results == [i + (100 if i % 2 else 0) for i in range(8)]
+
+    def test_map_empty(self):
+        assert AggregationPool(2).map([Shard(0)], []) == []
+
 
 class TestPluginHandler(object):
     @pytest.fixture()
@@ -7,8 +7,9 @@ import pytest
 from mock import Mock, call, patch
 
 import paths
+from AndroidRunner import RunOrder
 from AndroidRunner.Progress import Progress
-from AndroidRunner.util import load_json
+from AndroidRunner.util import ConfigError, load_json
 
 
 class TestProgressSetup(object):
@@ -52,6 +53,33 @@ class TestProgressSetup(object):
         current_lxml = progress.progress_xml_content
         assert self.elements_equal(current_lxml, expected_lxml)
 
+    @staticmethod
+    def run_ids(progress):
+        return [el.get('runId') for el in progress.progress_xml_content.find('runsToRun')]
+
+    def test_progress_init_run_order(self, tmp_path, test_config):
+        paths.OUTPUT_DIR = tmp_path.as_posix()
+        config = load_json(test_config)
+        config['run_order'] = {'strategy': 'blocked', 'seed': 3}
+
+        progress = Progress(config_file=test_config, config=config)
+        resumed = Progress(config_file=test_config, progress_file=progress.progress_xml_file, load_progress=True)
+
+        assert progress.get_run_order() == ('blocked', 3)
+        assert sorted(self.run_ids(progress), key=int) == [str(i) for i in range(9)]
+        assert self.run_ids(Progress(config_file=test_config, config=config)) == self.run_ids(progress)
+        assert self.run_ids(resumed) == self.run_ids(progress)
+        assert resumed.get_run_order() == ('blocked', 3)
+        assert resumed.get_next_run()['runCount'] == 1
+
+    def test_progress_init_no_run_order(self, tmp_path, test_config):
+        paths.OUTPUT_DIR = tmp_path.as_posix()
+
+        progress = Progress(config_file=test_config, config=load_json(test_config))
+
+        assert progress.get_run_order() is None
+        assert self.run_ids(progress) == [str(i) for i in range(9)]
+
     def elements_equal(self, e1, e2):
         if e1.tag != e2.tag:
             return False
@@ -315,6 +343,28 @@ class TestProgressMethods(object):
         runs_to_run_mock.remove.assert_called_once_with('fake_element')
         runs_done_mock.append.assert_called_once_with('fake_element')
 
+    def test_requeue_run(self, current_progress):
+        assert current_progress.requeue_run('0') == 1
+        assert current_progress.requeue_run('0') == 2
+
+        runs_to_run = current_progress.progress_xml_content.find('runsToRun')
+        assert runs_to_run[-1].get('runId') == '0'
+        assert runs_to_run[0].get('runId') == '1'
+        assert current_progress.run_retries('0') == 2
+        assert current_progress.run_retries('1') == 0
+
+    def test_stop_subject(self, current_progress):
+        current_progress.run_finished('0')
+
+        assert current_progress.stop_subject('0') == 2
+
+        runs_to_run = current_progress.progress_xml_content.find('runsToRun')
+        runs_skipped = current_progress.progress_xml_content.find('runsSkipped')
+        assert [el.get('runId') for el in runs_skipped] == ['1', '2']
+        assert runs_to_run[0].get('runId') == '3'
+        assert current_progress.done_run_ids() == ['0']
+        assert current_progress.subject_finished('nexus6p', 'https://google.com/', 'firefox')
+
     def test_experiment_finished_check_true(self, current_progress):
         mock_progress_xml = Mock()
         mock_progress_xml.find.return_value = et.fromstring('<runsToRun></runsToRun>')
@@ -367,3 +417,82 @@ class TestProgressMethods(object):
         run = current_progress.get_next_run()
         current_progress.run_finished(run['runId'])
         assert current_progress.get_run_count(run_xml, device, path) == 2
+
+
+class TestRunOrder(object):
+    @staticmethod
+    def runs(subjects, repetitions):
+        runs = []
+        for device, path, browser in subjects:
+            for i in range(repetitions):
+                runs.append(et.fromstring('<run runId="{}"><device>{}</device><path>{}</path><browser>{}</browser>'
+                                          '<runCount>{}</runCount></run>'.format(len(runs), device, path, browser,
+                                                                                  i + 1)))
+        return runs
+
+    @staticmethod
+    def subjects(runs):
+        return [RunOrder.subject(run)[1:3] for run in runs]
+
+    @staticmethod
+    def switches(runs):
+        subjects = [RunOrder.subject(run) for run in runs]
+        return sum(1 for a, b in zip(subjects, subjects[1:]) if a != b)
+
+    def test_from_config(self):
+        run_order = RunOrder.from_config({'strategy': 'blocked', 'seed': 7, 'block_size': 2})
+
+        assert isinstance(run_order, RunOrder.BlockedOrder)
+        assert (run_order.seed, run_order.block_size) == (7, 2)
+        assert isinstance(RunOrder.from_config({}).seed, int)
+
+    def test_from_config_invalid(self):
+        with pytest.raises(ConfigError):
+            RunOrder.from_config({'strategy': 'alphabetical'})
+        with pytest.raises(ConfigError):
+            RunOrder.from_config({'strategy': 'random', 'block_size': 2})
+
+    def test_random_seeded(self):
+        runs = self.runs([('d', 'a', 'x'), ('d', 'b', 'x')], 5)
+
+        first = RunOrder.from_config({'strategy': 'random', 'seed': 1}).order(runs)
+
+        assert first == RunOrder.from_config({'strategy': 'random', 'seed': 1}).order(runs)
+        assert sorted(first, key=lambda run: int(run.get('runId'))) == runs
+
+    def test_blocked(self):
+        runs = self.runs([('d', 'a', 'x'), ('d', 'b', 'x'), ('d', 'c', 'x')], 4)
+
+        ordered = RunOrder.from_config({'strategy': 'blocked', 'seed': 1}).order(runs)
+        rounds = RunOrder.from_config({'strategy': 'blocked', 'seed': 1, 'block_size': 2}).order(runs)
+
+        assert self.switches(ordered) == 2
+        assert sorted(set(self.subjects(rounds[:6]))) == [('a', 'x'), ('b', 'x'), ('c', 'x')]
+        assert [run.findtext('runCount') for run in rounds[:6]] == ['1', '2'] * 3
+
+    def test_counterbalanced(self):
+        runs = self.runs([('d', 'a', 'x'), ('d', 'b', 'x'), ('d', 'c', 'x'), ('d', 'e', 'x')], 4)
+
+        ordered = RunOrder.from_config({'strategy': 'counterbalanced', 'seed': 1}).order(runs)
+
+        positions = {}
+        for i, run in enumerate(ordered):
+            positions.setdefault(RunOrder.subject(run), []).append(i % 4)
+        assert all(sorted(position) == [0, 1, 2, 3] for position in positions.values())
+        assert all(len(set(self.subjects(ordered[i:i + 4]))) == 4 for i in range(0, 16, 4))
+
+    def test_williams_odd(self):
+        rows = [RunOrder.CounterbalancedOrder.williams_row(3, i) for i in range(6)]
+
+        pairs = [(row[i], row[i + 1]) for row in rows for i in range(2)]
+        assert len(set(pairs)) == 6
+
+    def test_min_switch(self):
+        runs = self.runs([('d', 'a', 'x'), ('d', 'a', 'y'), ('d', 'b', 'x'), ('d', 'b', 'y'), ('e', 'a', 'x')], 3)
+
+        ordered = RunOrder.from_config({'strategy': 'min_switch', 'seed': 5}).order(runs)
+
+        assert self.switches(ordered) == 4
+        paths = [run.findtext('path') for run in ordered[:12]]
+        assert sum(1 for a, b in zip(paths, paths[1:]) if a != b) == 1
+        assert [run.findtext('device') for run in ordered[12:]] == ['e'] * 3
@@ -1,3 +1,4 @@
+import math
 import os
 import os.path as op
 import subprocess
@@ -6,6 +7,7 @@ from mock import Mock, patch, call
 from AndroidRunner.USBHandler import USBHandler, USBHandlerException
 import AndroidRunner.Tests as Tests
 import AndroidRunner.util as util
+from AndroidRunner.RunningStats import RunningStats, SubjectStats, t_quantile
 import paths
 import csv
 
@@ -326,3 +328,111 @@ class TestUSBHandler(object):
         assert "Could not execute USB command: error" in str(exception_result.value)
 
         popen_mock.assert_called_once_with(["enable"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+class TestRunningStats(object):
+    def test_update(self):
+        stats = RunningStats()
+        for value in [2, 4, 4, 4, 5, 5, 7, 9]:
+            stats.update({'metric': value})
+
+        assert stats.count('metric') == 8
+        assert stats.mean('metric') == pytest.approx(5.0)
+        assert stats.variance('metric') == pytest.approx(32.0 / 7)
+        assert stats.minimum('metric') == 2.0
+        assert stats.maximum('metric') == 9.0
+        assert stats.count('unknown') == 0
+
+    def test_variance_single_value(self):
+        stats = RunningStats()
+        stats.update({'metric': '3.5'})
+
+        assert stats.variance('metric') == 0.0
+        assert stats.std('metric') == 0.0
+
+    def test_merge(self):
+        first = RunningStats()
+        second = RunningStats()
+        combined = RunningStats()
+        for value in [1, 2, 3]:
+            first.update({'metric': value})
+            combined.update({'metric': value})
+        for value in [10, 20]:
+            second.update({'metric': value, 'other': value})
+            combined.update({'metric': value, 'other': value})
+
+        first.merge(second)
+
+        assert first.count('metric') == 5
+        assert first.mean('metric') == pytest.approx(combined.mean('metric'))
+        assert first.variance('metric') == pytest.approx(combined.variance('metric'))
+        assert first.maximum('metric') == 20.0
+        assert first.means()['other'] == pytest.approx(15.0)
+
+    def test_half_width(self):
+        stats = RunningStats()
+        for value in (2.0, 4.0, 4.0, 4.0, 5.0, 5.0, 7.0, 9.0):
+            stats.update({'a': value})
+
+        assert stats.half_width('a', 0.95) == pytest.approx(2.3646 * math.sqrt(32.0 / 7 / 8), abs=1e-4)
+
+    def test_half_width_single_value(self):
+        stats = RunningStats()
+        stats.update({'a': 1.0})
+
+        assert stats.half_width('a', 0.95) == float('inf')
+
+    @pytest.mark.parametrize('p, df, expected', [(0.975, 1, 12.7062), (0.975, 2, 4.3027), (0.975, 3, 3.1824),
+                                                 (0.975, 4, 2.7764), (0.995, 3, 5.8409), (0.975, 30, 2.0423),
+                                                 (0.025, 5, -2.5706), (0.5, 7, 0.0)])
+    def test_t_quantile(self, p, df, expected):
+        assert t_quantile(p, df) == pytest.approx(expected, abs=1e-4)
+
+    def test_table_means(self):
+        table = [['time', 'a', 'b'], ['1', '2', ''], ['2', '4', '6'], ['3', '', '']]
+
+        means = RunningStats.table_means(table, skip_columns=('time',))
+
+        assert list(means.keys()) == ['a', 'b']
+        assert means['a'] == 3.0
+        assert means['b'] == 6.0
+
+    def test_subject_stats_means(self, tmpdir):
+        subject_stats = SubjectStats()
+        subject_stats.record(str(tmpdir), 'run1.csv', {'b': 1, 'a': 2})
+        subject_stats.record(str(tmpdir), 'run2.csv', {'b': 3, 'a': 4})
+
+        means = subject_stats.means(str(tmpdir), prefix='p_')
+
+        assert list(means.items()) == [('p_a', 3.0), ('p_b', 2.0)]
+        assert subject_stats.means(op.join(str(tmpdir), 'other')) is None
+
+    def test_subject_stats_discard(self, tmpdir):
+        subject_stats = SubjectStats()
+        subject_stats.record(str(tmpdir), 'run1.csv', {'a': 2})
+        subject_stats.record(str(tmpdir), 'run2.csv', {'a': 10})
+        subject_stats.record(str(tmpdir), 'run3.csv', {'a': 4})
+
+        subject_stats.discard(str(tmpdir), 'run2.csv')
+        subject_stats.discard(str(tmpdir), 'unknown.csv')
+        subject_stats.discard(op.join(str(tmpdir), 'other'), 'run1.csv')
+
+        stats = subject_stats.get(str(tmpdir))
+        assert (stats.count('a'), stats.mean('a'), stats.maximum('a')) == (2, 3.0, 4.0)
+
+    def test_subject_stats_existing_run_files(self, tmpdir):
+        tmpdir.join('old_run.csv').write('a\n1\n')
+        tmpdir.join('Aggregated.csv').write('a\n1\n')
+        subject_stats = SubjectStats()
+
+        subject_stats.record(str(tmpdir), 'run1.csv', {'a': 2})
+
+        assert subject_stats.means(str(tmpdir)) is None
+
+    def test_subject_stats_invalid_run(self, tmpdir):
+        subject_stats = SubjectStats()
+        subject_stats.record(str(tmpdir), 'run1.csv', {'a': 2})
+        subject_stats.record(str(tmpdir), 'run2.csv', None)
+        subject_stats.record(str(tmpdir), 'run3.csv', {'a': 4})
+
+        assert subject_stats.means(str(tmpdir)) is None